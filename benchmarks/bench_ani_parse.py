@@ -0,0 +1,94 @@
+#! /usr/bin/python3
+##pylint: disable=wrong-import-position
+"""
+Benchmark parsing a large synthetic .ani file with the single pass
+tokenizer against the slice at a time tokenizer it replaced
+
+Also times the tokenizers alone on ever longer lines. The time per
+character should stay flat for the single pass tokenizer
+Run: python3 benchmarks/bench_ani_parse.py
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append("./")
+
+from pyxielib.animation_file import FileAnimation
+from tests.reference_impls import tokenizeBySlices
+
+parser = argparse.ArgumentParser(description='Animation file parse benchmark')
+parser.add_argument('--lines', type=int, default=100000, help="Lines in the synthetic .ani file")
+parser.add_argument('--widths', type=int, nargs='+', default=[16, 256, 4096, 16384],
+    help="Line lengths, in tokens, for the tokenizer scaling run")
+args = parser.parse_args()
+
+STARTS = ["{t_rail}", "{b_rail}", "{full}", "{0x0036}", "AB", "x", " "]
+PIECES = STARTS + ["{3}", "{2}"]
+
+
+def makeLine(rand, tokens):
+    """A frame line. Multipliers need something before them"""
+    return rand.choice(STARTS) + ''.join(rand.choice(PIECES) for _ in range(tokens - 1))
+
+
+def makeAni(path, num_lines):
+    """Sprites and a segment, then frame lines built from them"""
+    rand = random.Random(1)
+    with open(path, 'w') as f:
+        f.write("sprite|t_rail|0x0001\nsprite|b_rail|0x0008\nsegment|full|{t_rail}{b_rail}\nscale|0.01\n")
+        for _ in range(num_lines - 4):
+            f.write("frame|1|" + makeLine(rand, rand.randint(2, 8)) + "\n")
+
+
+def timeTokenize(lines, tokenize):
+    start = time.perf_counter()
+    for line in lines:
+        tokenize(line)
+    return time.perf_counter() - start
+
+
+def timeParse(path, tokenize):
+    FileAnimation._tokenize = staticmethod(tokenize)
+    start = time.perf_counter()
+    ani = FileAnimation(path, cache=False)
+    return time.perf_counter() - start, ani.frameCount()
+
+
+single_pass = FileAnimation._tokenize
+by_slices = tokenizeBySlices
+with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, 'synthetic.ani')
+    makeAni(path, args.lines)
+    try:
+        old, frames = timeParse(path, by_slices)
+        new, _ = timeParse(path, single_pass)
+    finally:
+        FileAnimation._tokenize = staticmethod(single_pass)
+
+    with open(path) as f:
+        lines = [x.rstrip('\n').split('|')[-1] for x in f]
+    tokenize_old = timeTokenize(lines, by_slices)
+    tokenize_new = timeTokenize(lines, single_pass)
+
+print(f"Parsed {args.lines} lines, {frames} frames")
+print(f"{'tokenizer':<12} {'parse s':>8} {'us/line':>8} {'tokenize s':>11} {'us/line':>8}")
+print(f"{'slices':<12} {old:>8.3f} {1e6*old/args.lines:>8.2f} {tokenize_old:>11.3f} {1e6*tokenize_old/args.lines:>8.2f}")
+print(f"{'single pass':<12} {new:>8.3f} {1e6*new/args.lines:>8.2f} {tokenize_new:>11.3f} {1e6*tokenize_new/args.lines:>8.2f}")
+print(f"Speedup: parse {old/new:.1f}x, tokenize {tokenize_old/tokenize_new:.1f}x")
+print()
+
+print(f"{'tokens':>7} {'chars':>7} {'slices ns/char':>15} {'single ns/char':>15}")
+rand = random.Random(2)
+for width in args.widths:
+    line = makeLine(rand, width)
+    times = []
+    for func in (by_slices, single_pass):
+        start = time.perf_counter()
+        func(line)
+        times.append(time.perf_counter() - start)
+    print(f"{width:>7} {len(line):>7} {1e9*times[0]/len(line):>15.0f} {1e9*times[1]/len(line):>15.0f}")
@@ -0,0 +1,42 @@
+#! /usr/bin/python3
+##pylint: disable=wrong-import-position
+"""
+Micro-benchmark of the table-driven print command decoder against the
+character-at-a-time state machine it replaced
+
+Run: python3 benchmarks/bench_cmd_decode.py
+"""
+
+import argparse
+import sys
+import timeit
+
+sys.path.append("./")
+
+from pyxielib import tube_manager as tm
+from tests.reference_impls import cmdDecodePrintStateMachine
+
+parser = argparse.ArgumentParser(description='Print command decoder benchmark')
+parser.add_argument('-n', '--number', type=int, default=20000, help="Decodes per timing run")
+parser.add_argument('-r', '--repeat', type=int, default=5, help="Timing runs per command. The fastest is kept")
+args = parser.parse_args()
+
+COMMANDS = {
+    'clock':     "SAT 14 09!41!07! PM",
+    'text':      "THE QUICK BROWN FOX",
+    'hex':       "".join(f"{{0x{1 << (x % 14):04X}}}" for x in range(16)),
+    'underline': "{!HELLO}: WORLD!!",
+    'mixed':     "A:{0x3F}B!{0b1010}{!CD}E:F",
+}
+
+print(f"{'command':<10} {'state machine us':>17} {'table us':>9} {'speedup':>8}")
+
+
+def best(func, cmd):
+    return min(timeit.repeat(lambda: func(cmd), number=args.number, repeat=args.repeat))
+
+
+for name, cmd in COMMANDS.items():
+    old = best(cmdDecodePrintStateMachine, cmd)
+    new = best(tm.cmdDecodeArray, cmd)
+    print(f"{name:<10} {1e6*old/args.number:>17.2f} {1e6*new/args.number:>9.2f} {old/new:>7.1f}x")
@@ -0,0 +1,79 @@
+#! /usr/bin/python3
+##pylint: disable=wrong-import-position
+"""
+Throughput of RaspberryPiController.spiSend against the fake spidev and
+RPi.GPIO backend, compared with the list building send path it replaced
+
+Run: python3 benchmarks/bench_spi_send.py
+"""
+
+import argparse
+import sys
+import time
+
+sys.path.append("./")
+
+from pyxielib import tube_manager as tm
+from pyxielib.controller import RaspberryPiController
+from pyxielib.fake_raspi import FakeGPIO, FakeSpidev
+
+parser = argparse.ArgumentParser(description='SPI send path benchmark')
+parser.add_argument('-n', '--number', type=int, default=20000, help="Frames per timing run")
+parser.add_argument('-r', '--repeat', type=int, default=5, help="Timing runs per workload. The fastest is kept")
+parser.add_argument('-t', '--tubes', type=int, default=16)
+parser.add_argument('-s', '--simulate-timing', action='store_true', help="Make transfers take as long as on the wire at 1MHz")
+args = parser.parse_args()
+
+
+def legacySpiSend(ctrl, code):
+    """The send path before frames were packed into a reused buffer"""
+    bitmaps = list(tm.cachedDecodePrint(code))
+    if len(bitmaps) > ctrl.num_tubes:
+        bitmaps = bitmaps[:ctrl.num_tubes]
+    elif len(bitmaps) < ctrl.num_tubes:
+        bitmaps.extend([0]*(ctrl.num_tubes - len(bitmaps)))
+
+    data = []
+    for bitmap in reversed(bitmaps):
+        data += [(bitmap >> 8) & 0xFF, bitmap & 0xFF]
+
+    enabled = ctrl.enabled
+    ctrl.disable(hv_off=False)
+    ctrl.spi.xfer(data)
+    if enabled:
+        ctrl.enable()
+
+
+def makeController():
+    spidev = FakeSpidev(simulate_timing=args.simulate_timing)
+    ctrl = RaspberryPiController(num_tubes=args.tubes, speed=10**6, spi_module=spidev, gpio_module=FakeGPIO())
+    ctrl.spi.keep_transfers = False
+    return ctrl
+
+
+WORKLOADS = {
+    ## A new frame every time, cycling through a minute of a clock
+    'changing':  [f"SAT 14 09!41!{x % 60:02}! PM" for x in range(args.number)],
+    ## A clock refreshed faster than it changes
+    'repeating': [f"SAT 14 09!41!{(x // 10) % 60:02}! PM" for x in range(args.number)],
+}
+
+
+def best(send, codes):
+    times = []
+    for _ in range(args.repeat):
+        ctrl = makeController()
+        start = time.perf_counter()
+        for code in codes:
+            send(ctrl, code)
+        times.append(time.perf_counter() - start)
+
+    return min(times), ctrl
+
+
+print(f"{args.tubes} tubes")
+print(f"{'workload':<10} {'legacy frames/s':>16} {'buffer frames/s':>16} {'speedup':>8} {'transfers':>10}")
+for name, codes in WORKLOADS.items():
+    old, _ = best(legacySpiSend, codes)
+    new, ctrl = best(RaspberryPiController.spiSend, codes)
+    print(f"{name:<10} {len(codes)/old:>16.0f} {len(codes)/new:>16.0f} {old/new:>7.1f}x {ctrl.frames_sent:>10}")
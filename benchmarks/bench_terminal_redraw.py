@@ -0,0 +1,58 @@
+#! /usr/bin/python3
+##pylint: disable=wrong-import-position
+"""
+Measure the bytes written per frame by TerminalController with a full
+clear-and-redraw compared with the incremental cursor-addressed redraw
+
+Run: python3 benchmarks/bench_terminal_redraw.py
+"""
+
+import argparse
+import io
+import sys
+
+sys.path.append("./")
+
+from pyxielib import animation_library as animationlib
+from pyxielib.animation_file import FileAnimation
+from pyxielib.controller import TerminalController
+
+parser = argparse.ArgumentParser(description='Terminal redraw benchmark')
+parser.add_argument('-a', '--animation', default="animations/packman.ani")
+args = parser.parse_args()
+
+
+def clockCodes():
+    return [f"SAT 14 09!41!{x:02}! PM" for x in range(60)]
+
+
+def spinCodes():
+    ani = animationlib.makeSpinAnimation(rate=8, num_tubes=16).toFullFrameAnimation()
+    return [''.join(f.getCode() for f in ff.getFrames()) for _, ff in ani.frames]
+
+
+def marqueeCodes():
+    msg = "THE QUICK BROWN FOX JUMPS OVER THE LAZY DOG"
+    padded = ' '*16 + msg + ' '*16
+    return [padded[x:x + 16] for x in range(len(padded) - 16)]
+
+
+def fileCodes():
+    ani = FileAnimation(args.animation)
+    return [''.join(f.getCode() for f in ff.getFrames()) for _, ff in ani.frames]
+
+
+def bytesPerFrame(codes, **kwargs):
+    ctrl = TerminalController(stream=io.StringIO(), **kwargs)
+    for code in codes:
+        ctrl.send(code)
+
+    return ctrl.bytes_written / ctrl.frames_written
+
+
+print(f"{'workload':<16} {'frames':>6} {'full B/frame':>13} {'incremental B/frame':>20} {'ratio':>6}")
+for name, codes in (('clock seconds', clockCodes()), ('spin x16', spinCodes()),
+        ('marquee', marqueeCodes()), (args.animation, fileCodes())):
+    full = bytesPerFrame(codes, clear_screen=True)
+    incremental = bytesPerFrame(codes, incremental=True)
+    print(f"{name:<16} {len(codes):>6} {full:>13.0f} {incremental:>20.0f} {full/incremental:>5.1f}x")
@@ -0,0 +1,52 @@
+#! /usr/bin/python3
+##pylint: disable=wrong-import-position
+"""
+Benchmark the sweep-line merge behind TubeAnimation.toFullFrameAnimation()
+and concatFullFrameTimelines()
+
+The time per merged tube cell (merged frames x tubes) should stay flat as
+tubes and frames grow
+Run: python3 benchmarks/bench_timeline_merge.py
+"""
+
+import argparse
+import sys
+import time
+
+sys.path.append("./")
+
+from pyxielib.animation import HexFrame, TubeAnimation, TubeSequence, concatFullFrameTimelines
+
+parser = argparse.ArgumentParser(description='Timeline merge benchmark')
+parser.add_argument('--tubes', type=int, nargs='+', default=[1, 4, 16, 64])
+parser.add_argument('--frames', type=int, nargs='+', default=[100, 1000, 10000])
+args = parser.parse_args()
+
+
+def makeTubes(num_tubes, num_frames):
+    """Spin-like tubes at a few different rates so the boundaries interleave"""
+    frames = [HexFrame(0x1 << x) for x in range(7, 14)]
+    tubes = []
+    for i in range(num_tubes):
+        delay = 1 / (3 + i % 4)
+        tubes.append(TubeSequence([(delay, frames[j % len(frames)]) for j in range(num_frames)]))
+
+    return tubes
+
+
+def timeIt(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+print(f"{'tubes':>6} {'frames':>7} {'merged':>8} {'merge s':>9} {'ns/cell':>8} {'concat s':>9} {'ns/cell':>8}")
+for num_tubes in args.tubes:
+    for num_frames in args.frames:
+        ani = TubeAnimation(makeTubes(num_tubes, num_frames))
+        merge_time, merged = timeIt(ani.toFullFrameAnimation)
+        count = merged.frameCount()
+        concat_time, joined = timeIt(lambda: concatFullFrameTimelines(merged.frames, merged.frames))
+        cells = count*num_tubes
+        print(f"{num_tubes:>6} {num_frames:>7} {count:>8} {merge_time:>9.3f} {1e9*merge_time/cells:>8.0f}"
+              f" {concat_time:>9.3f} {1e9*concat_time/(2*cells):>8.0f}")
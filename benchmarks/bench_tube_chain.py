@@ -0,0 +1,54 @@
+#! /usr/bin/python3
+##pylint: disable=wrong-import-position
+"""
+Frames per second RaspberryPiController can send as the tube chain grows,
+using the fake spidev and RPi.GPIO backend
+
+The host column is the Python side alone. The wire column also spends the
+time the bits take on the bus at --speed, which bounds a real chain
+
+Run: python3 benchmarks/bench_tube_chain.py
+"""
+
+import argparse
+import sys
+import time
+
+sys.path.append("./")
+
+from pyxielib.controller import RaspberryPiController
+from pyxielib.fake_raspi import FakeGPIO, FakeSpidev
+
+parser = argparse.ArgumentParser(description='Tube chain length benchmark')
+parser.add_argument('-n', '--number', type=int, default=500, help="Frames per timing run")
+parser.add_argument('-r', '--repeat', type=int, default=3, help="Timing runs per chain length. The fastest is kept")
+parser.add_argument('-s', '--speed', type=int, default=10**6, help="SPI clock in Hz")
+parser.add_argument('-m', '--max-transfer', type=int, default=4096, help="spidev transfer limit in bytes")
+parser.add_argument('-t', '--tubes', type=int, nargs='+', default=[16, 32, 48, 64, 128, 256, 1024, 4096])
+args = parser.parse_args()
+
+
+def framesPerSecond(num_tubes, simulate_timing):
+    ## Every frame differs, so none are skipped
+    codes = [f"{x:0{num_tubes}}" for x in range(args.number)]
+    times = []
+    for _ in range(args.repeat):
+        spidev = FakeSpidev(simulate_timing=simulate_timing)
+        ctrl = RaspberryPiController(num_tubes=num_tubes, speed=args.speed, max_transfer=args.max_transfer,
+            spi_module=spidev, gpio_module=FakeGPIO())
+        ctrl.spi.keep_transfers = False
+        start = time.perf_counter()
+        for code in codes:
+            ctrl.spiSend(code)
+        times.append(time.perf_counter() - start)
+
+    return args.number/min(times), len(ctrl.frame_chunks)
+
+
+print(f"SPI clock {args.speed} Hz, transfers of at most {args.max_transfer} bytes")
+print(f"{'tubes':>6} {'chunks':>7} {'host fps':>10} {'wire fps':>10} {'bus limit fps':>14}")
+for num_tubes in args.tubes:
+    host, chunks = framesPerSecond(num_tubes, False)
+    wire, _ = framesPerSecond(num_tubes, True)
+    limit = args.speed/(16*num_tubes)
+    print(f"{num_tubes:>6} {chunks:>7} {host:>10.0f} {wire:>10.0f} {limit:>14.0f}")
@@ -13,6 +13,14 @@ extern "C" {
 #define SPIN_DELAY 250
 #define BAUD 115200
 
+// Binary frame protocol. See pyxielib/frame_protocol.py
+#define FRAME_SOH 0x01
+#define FRAME_STX 0x02
+#define FRAME_ACK 0x06
+#define FRAME_NAK 0x15
+#define FRAME_ERR_CHECKSUM 1
+#define FRAME_ERR_TIMEOUT 2
+
 
 void newline() {
     Serial.print("\n");
@@ -195,7 +203,98 @@ void initDisplay() {
     tubeMsg("Nixie Tube Start");
 }
 
+uint16_t crc16Update(uint16_t crc, uint8_t byte) {
+    // CRC-CCITT, poly 0x1021
+    crc ^= (uint16_t)byte << 8;
+    int i;
+    for (i = 0; i < 8; i++) {
+        crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : (crc << 1);
+    }
+    return crc;
+}
+
+void frameReply(uint8_t type, uint8_t seq) {
+    Serial.write(type);
+    Serial.write(seq);
+}
+
+void frameNak(uint8_t seq, uint8_t errcode) {
+    frameReply(FRAME_NAK, seq);
+    Serial.write(errcode);
+}
+
+// Last bitmaps shown, which tube updates change
+uint16_t frame_bitmaps[NUM_TUBES];
+
+void frameLoop(void) {
+    // STX | seq | count | count x bitmap | crc
+    // SOH | seq | count | count x (tube, bitmap) | crc
+    // Values are big endian
+    uint8_t header[3];
+    if (Serial.readBytes((char*)header, 3) != 3) {
+        frameNak(0, FRAME_ERR_TIMEOUT);
+        return;
+    }
+    bool update = (header[0] == FRAME_SOH);
+    uint8_t seq = header[1];
+    int count = header[2];
+    uint16_t crc = crc16Update(crc16Update(0xFFFF, seq), count);
+
+    // Tubes past the end of the display are read and checked, but not shown
+    uint16_t tube_bitmaps[NUM_TUBES];
+    if (update) {
+        memcpy(tube_bitmaps, frame_bitmaps, sizeof(tube_bitmaps));
+    }
+    else {
+        memset(tube_bitmaps, 0, sizeof(tube_bitmaps));
+    }
+    int i;
+    for (i = 0; i < count; i++) {
+        uint8_t bytes[3];
+        int size = update ? 3 : 2;
+        if (Serial.readBytes((char*)bytes, size) != size) {
+            frameNak(seq, FRAME_ERR_TIMEOUT);
+            return;
+        }
+        int j;
+        for (j = 0; j < size; j++) {
+            crc = crc16Update(crc, bytes[j]);
+        }
+        int tube = update ? bytes[0] : i;
+        if (tube < NUM_TUBES) {
+            tube_bitmaps[tube] = ((uint16_t)bytes[size - 2] << 8) | bytes[size - 1];
+        }
+    }
+
+    uint8_t crc_bytes[2];
+    if (Serial.readBytes((char*)crc_bytes, 2) != 2) {
+        frameNak(seq, FRAME_ERR_TIMEOUT);
+        return;
+    }
+    if ((((uint16_t)crc_bytes[0] << 8) | crc_bytes[1]) != crc) {
+        frameNak(seq, FRAME_ERR_CHECKSUM);
+        return;
+    }
+
+    memcpy(frame_bitmaps, tube_bitmaps, sizeof(frame_bitmaps));
+    setTubes(tube_bitmaps, NUM_TUBES);
+    frameReply(FRAME_ACK, seq);
+}
+
 void tubeManagerLoop(void) {
+    // Binary frames only start between text commands
+    if (cmdBufLen() == 0) {
+        if (Serial.peek() == '\r') {
+            // Left over from a "\n\r" line ending
+            Serial.read();
+            return;
+        }
+        if (Serial.peek() == FRAME_STX || Serial.peek() == FRAME_SOH) {
+            frameLoop();
+            return;
+        }
+    }
+
     char cmd_buf[CMD_BUF_SIZE];
     memset(cmd_buf, '\0', CMD_BUF_SIZE);
 
@@ -263,6 +362,7 @@ void tubeManagerLoop(void) {
         printPrompt();
         return;
     }
+    memcpy(frame_bitmaps, tube_bitmaps, sizeof(frame_bitmaps));
     setTubes(tube_bitmaps, NUM_TUBES);
     printPrompt();
     return;
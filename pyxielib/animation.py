@@ -1,16 +1,44 @@
+import bisect
+import heapq
+import itertools
 import logging
 import math
 import re
-import time
+import threading
 
+from contextlib import contextmanager
 from copy import copy
 from typing import Dict, List, Sequence, Tuple
 
 from pyxielib import tube_manager as tm
+from pyxielib.clock import getClock
 from pyxielib.pyxieutil import PyxieError, PyxieUnimplementedError, strToInt
 
 logger = logging.getLogger(__name__)
 
+## How far ahead of the clock animations are stepped on this thread. Set
+## only while the assembler makes a frame it will send before it's due
+_ahead = threading.local()
+
+
+def animationTime() -> float:
+    """The clock all animations are timed against"""
+    return getClock().monotonic() + getattr(_ahead, 'seconds', 0.0)
+
+
+@contextmanager
+def steppingAhead(seconds:float):
+    """
+    Within the block animationTime() on this thread is 'seconds' ahead of
+    the clock, so frames are made that long before they are due. Other
+    threads still see the clock
+    """
+    _ahead.seconds = seconds
+    try:
+        yield
+    finally:
+        _ahead.seconds = 0.0
+
 
 def rgcd(nums):
     """Recursive math.gcd"""
@@ -71,7 +99,7 @@ class Frame:
     def decode(self):
         """Get the bitmap for an animation"""
         try:
-            return tm.cmdDecodePrint(self.getCode())[0]
+            return tm.cachedDecodePrint(self.getCode())[0]
         except:
             raise PixieAnimationError(f"Failed to decode '{self.getCode()}'")
 
@@ -237,24 +265,43 @@ TimeFullFrame = Tuple[float, FullFrame]
 FrameSequence = Sequence[Frame]
 
 
-def _frameSpans(timed_items):
-    """Convert [(delay, item), ...] into cumulative [(start, end, item), ...] spans"""
-    spans = []
-    clock = 0.0
-    for delay, item in timed_items:
-        spans.append((clock, clock + delay, item))
-        clock += delay
-
-    return spans
-
+def _sweepTimelines(timelines):
+    """
+    Walk several [(delay, item), ...] timelines once, in time order
+    Yields (delay, items) for every span between consecutive frame boundaries
+    of any timeline, where items holds each timeline's item over that span
+    (None once a timeline has ended)
+    """
+    current = [None]*len(timelines)
+    indexes = [0]*len(timelines)
+    ends = [0.0]*len(timelines)
+    heap = []
+
+    def advance(i, clock):
+        ## Move timeline i to the item covering 'clock', skipping zero length items
+        timeline = timelines[i]
+        while indexes[i] < len(timeline):
+            ends[i] += timeline[indexes[i]][0]
+            if ends[i] > clock:
+                current[i] = timeline[indexes[i]][1]
+                heapq.heappush(heap, (ends[i], i))
+                return
+            indexes[i] += 1
+
+        current[i] = None
 
-def _spanValueAt(spans, when):
-    """Return the item whose [start, end) span contains 'when', else None"""
-    for start, end, item in spans:
-        if start <= when < end:
-            return item
+    clock = 0.0
+    for i in range(len(timelines)):
+        advance(i, clock)
 
-    return None
+    while heap:
+        end = heap[0][0]
+        yield (end - clock, current[:])
+        clock = end
+        while heap and heap[0][0] == clock:
+            _, i = heapq.heappop(heap)
+            indexes[i] += 1
+            advance(i, clock)
 
 
 def _padTubes(full_frame, width):
@@ -281,17 +328,12 @@ def concatFullFrameRows(left_rows, right_rows):
 
 def concatFullFrameTimelines(left_frames, right_frames):
     """Merge two [(delay, FullFrame)] timelines, joining tubes over a shared timeline"""
-    left_spans = _frameSpans(left_frames)
-    right_spans = _frameSpans(right_frames)
-    left_width = max((ff.tubeCount() for _, _, ff in left_spans), default=0)
-    right_width = max((ff.tubeCount() for _, _, ff in right_spans), default=0)
-    boundaries = sorted({0.0} | {e for _, e, _ in left_spans} | {e for _, e, _ in right_spans})
+    left_width = max((ff.tubeCount() for _, ff in left_frames), default=0)
+    right_width = max((ff.tubeCount() for _, ff in right_frames), default=0)
     frames = []
-    for start, end in zip(boundaries, boundaries[1:]):
-        left = _spanValueAt(left_spans, start)
-        right = _spanValueAt(right_spans, start)
+    for delay, (left, right) in _sweepTimelines([left_frames, right_frames]):
         tubes = _padTubes(left, left_width) + _padTubes(right, right_width)
-        frames.append((end - start, FullFrame(tubes)))
+        frames.append((delay, FullFrame(tubes)))
 
     return frames
 
@@ -306,9 +348,11 @@ class TubeSequence:
     """
     def __init__(self, frames: Sequence[TimeFrame]=None):
         self.started = False
-        self.start_time: float = time.time()
+        self.start_time: float = animationTime()
         self.frames: List[TimeFrame] = list(frames or []) ## Make Copy
         self.frame_index = 0
+        self.end_offsets: List[float] = []
+        self.compile()
 
     @classmethod
     def makeBlank(cls, length: float=0):
@@ -328,6 +372,13 @@ class TubeSequence:
         time_frames: List[TimeFrame] = [(delay, frame) for frame in frames]
         return cls(time_frames, **kwargs)
 
+    def compile(self):
+        """
+        Build the timeline of cumulative frame end offsets
+        Must be called again whenever self.frames is changed
+        """
+        self.end_offsets = list(itertools.accumulate(delay for delay, _ in self.frames))
+
     def reset(self):
         """Reset the animation"""
         self.frame_index = 0
@@ -349,10 +400,10 @@ class TubeSequence:
 
     def length(self) -> float:
         """Time length of animation"""
-        if not self.frames:
+        if not self.end_offsets:
             return 0
 
-        return sum(map(lambda x: x[0], self.frames))
+        return self.end_offsets[-1]
 
     def currentFrame(self):
         if not self.remainingFrames():
@@ -376,31 +427,53 @@ class TubeSequence:
         if not self.remainingFrames():
             return None
 
-        now = time.time()
+        now = animationTime()
         ## If not started, set start time and return first frame
         if not self.started:
-            self.started = True
-            self.start_time = now
-            return self.frames[0][1]
+            return self.startAt(now)
 
-        ## Check to see if current frame has passed
-        length, _ = self.frames[self.frame_index]
-        if now < self.start_time + length:
+        return self.advanceTo(now)
+
+    def startAt(self, start_time:float) -> Frame:
+        """Start the sequence at 'start_time' and return the first frame"""
+        self.started = True
+        self.start_time = start_time
+        self.frame_index = 0
+        if not self.frames:
             return None
 
-        ## Get next frame
-        self.frame_index += 1
+        return self.frames[0][1]
+
+    def advanceTo(self, now:float) -> Frame:
+        """
+        Jump to the frame that belongs at 'now'
+        Return it if it differs from the current frame, else None
+        """
+        index = bisect.bisect_right(self.end_offsets, now - self.start_time)
+        if index <= self.frame_index:
+            return None
+
+        self.frame_index = index
         if len(self.frames) <= self.frame_index:
             return None
 
-        self.start_time = now
         return self.frames[self.frame_index][1]
 
+    def nextDeadline(self):
+        """Time at which popFrame() will next return a frame. None if finished"""
+        if not self.remainingFrames():
+            return None
+        if not self.started:
+            return 0.0
+
+        return self.start_time + self.end_offsets[self.frame_index]
+
     def __add__(self, other):
         return TubeSequence(self.frames + other.frames)
 
     def __iadd__(self, other):
         self.frames += other.frames
+        self.compile()
         self.reset()
         return self
 
@@ -433,6 +506,7 @@ class TubeSequence:
             raise PixieAnimationError(f"{name} must be multiplied by int")
 
         self.frames = self._mul_helper(x)
+        self.compile()
         self.reset()
         return self
 
@@ -466,6 +540,9 @@ class TubeSequence:
 
 
 class Animation:
+    ## Polling period used by animations that can't predict their next update
+    POLL_PERIOD = 0.01
+
     def __init__(self):
         pass
 
@@ -473,6 +550,15 @@ class Animation:
         """Reset the start time of the first frame"""
         raise PyxieUnimplementedError(self)
 
+    def startAt(self, start_time:float):
+        """
+        Reset and start the animation as though it started at 'start_time',
+        which may have just passed. Return True if updated
+        Animations that don't keep a start time start now
+        """
+        self.reset()
+        return self.updateFrameSet()
+
     def length(self):
         """Time length of the animation set"""
         raise PyxieUnimplementedError(self)
@@ -485,6 +571,13 @@ class Animation:
         """Get the code to send to the decoder"""
         raise PyxieUnimplementedError(self)
 
+    def getBitmaps(self):
+        """
+        The bitmaps that getCode() decodes to, for animations that already
+        have them. None means only the code is known
+        """
+        return None
+
     def updateFrameSet(self):
         """Update the frame set based upon the current time. Return True if updated"""
         raise PyxieUnimplementedError(self)
@@ -493,7 +586,19 @@ class Animation:
         """The last frame has loaded"""
         raise PyxieUnimplementedError(self)
 
-class EmtpyAnimation:
+    def nextDeadline(self):
+        """
+        The animationTime() at which updateFrameSet() should next be called
+        A time in the past means an update is due now
+        None means the animation won't change again until it is reset
+        """
+        return animationTime() + self.POLL_PERIOD
+
+    def endTime(self):
+        """The animationTime() at which done() becomes true. None if unknown or never"""
+        return None
+
+class EmtpyAnimation(Animation):
     def __init__(self):
         Animation.__init__(self)
 
@@ -521,6 +626,14 @@ class EmtpyAnimation:
         """The last frame has loaded"""
         return True
 
+    def nextDeadline(self):
+        """Never changes"""
+        return None
+
+    def endTime(self):
+        """Always done"""
+        return 0.0
+
 #    @staticmethod
 #    def _makeCode(frames, start=0, end=None):
 #        if end is None:
@@ -538,6 +651,10 @@ class TubeAnimation(Animation):
         Animation.__init__(self)
         self.tubes: Sequence[TubeSequence] = tubes
         self.current_frame_set: List[Frame] = [Frame()]*len(tubes)
+        self.started = False
+        self.start_time: float = animationTime()
+        ## Min-heap of (deadline, tube index) for every tube with frames left
+        self.deadlines: List[Tuple[float, int]] = []
 
     @classmethod
     def makeAndEqualize(cls, tubes: Sequence[TubeSequence], *, extend=1):
@@ -550,6 +667,13 @@ class TubeAnimation(Animation):
         for animation in self.tubes:
             animation.reset()
 
+        self.started = False
+        self.deadlines = []
+
+    def startAt(self, start_time:float):
+        self.reset()
+        return self._startTubes(start_time, animationTime())
+
     def length(self):
         """Time length of the animation set. Equal to the longest animation"""
         return max(map(lambda x: x.length(), self.tubes))
@@ -576,15 +700,43 @@ class TubeAnimation(Animation):
             if diff:
                 animation += TubeSequence.makeBlank(diff)
 
+    def _scheduleTube(self, index):
+        """Queue the tube's next deadline, if it has one"""
+        deadline = self.tubes[index].nextDeadline()
+        if deadline is not None:
+            heapq.heappush(self.deadlines, (deadline, index))
+
+    def _startTubes(self, start_time, now):
+        """Anchor every tube to one start time, then catch them up to 'now'"""
+        self.started = True
+        self.start_time = start_time
+        self.deadlines = []
+        for i, animation in enumerate(self.tubes):
+            frame = animation.startAt(start_time)
+            if frame is not None:
+                self.current_frame_set[i] = frame
+            frame = animation.advanceTo(now)
+            if frame is not None:
+                self.current_frame_set[i] = frame
+            self._scheduleTube(i)
+
+        return True
+
     def updateFrameSet(self):
         """Update the frame set based upon the current time. Return True if updated"""
+        now = animationTime()
+        if not self.started:
+            return self._startTubes(now, now)
+
         updated = False
-        ## Iterate over each tube animation and check for an update
-        for i, animation in enumerate(self.tubes):
-            frame = animation.popFrame()
+        ## Only visit the tubes whose deadline has passed
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, i = heapq.heappop(self.deadlines)
+            frame = self.tubes[i].advanceTo(now)
             if frame is not None:
                 self.current_frame_set[i] = frame
                 updated = True
+            self._scheduleTube(i)
 
         if not updated:
             return None
@@ -595,6 +747,22 @@ class TubeAnimation(Animation):
         """The last frame as loaded"""
         return all([tube.done() for tube in self.tubes])
 
+    def nextDeadline(self):
+        """The earliest deadline of all the tubes"""
+        if not self.started:
+            return 0.0
+        if not self.deadlines:
+            return None
+
+        return self.deadlines[0][0]
+
+    def endTime(self):
+        """When the longest tube ends. None until started"""
+        if not self.started:
+            return None
+
+        return self.start_time + self.length()
+
     def clone(self):
         return TubeAnimation(self.tubes[:])
 
@@ -639,12 +807,11 @@ class TubeAnimation(Animation):
 
     def toFullFrameAnimation(self):
         """Merge the per-tube sequences onto a shared timeline of full frames"""
-        timelines = [_frameSpans(tube.frames) for tube in self.tubes]
-        boundaries = sorted({0.0} | {end for timeline in timelines for _, end, _ in timeline})
+        blank = Frame()
         frames = []
-        for start, end in zip(boundaries, boundaries[1:]):
-            tubes = [_spanValueAt(timeline, start) or Frame() for timeline in timelines]
-            frames.append((end - start, FullFrame(tubes)))
+        for delay, items in _sweepTimelines([tube.frames for tube in self.tubes]):
+            tubes = [blank if item is None else item for item in items]
+            frames.append((delay, FullFrame(tubes)))
 
         return FullFrameAnimation(frames)
 
@@ -699,11 +866,28 @@ class LoopedTubeAnimation(TubeAnimation):
         if self.loopOver():
             self.loops_done += 1
             if not self.done():
+                ## Start the next loop exactly where the last one ended so
+                ## the tubes stay phase-locked no matter how late this is
+                start_time = self.start_time + self.length()
                 TubeAnimation.reset(self)
-                return TubeAnimation.updateFrameSet(self)
+                return self._startTubes(start_time, animationTime())
 
         return None
 
+    def nextDeadline(self):
+        """Restart right away when the loop is over"""
+        if self.loopOver():
+            return None if self.done() else 0.0
+
+        return TubeAnimation.nextDeadline(self)
+
+    def endTime(self):
+        """When the last loop ends. None if it loops forever"""
+        if self.loops is None or not self.started:
+            return None
+
+        return self.start_time + max(0, self.loops - self.loops_done)*self.length()
+
     def clone(self):
         return LoopedTubeAnimation(self.tubes[:])
 
@@ -719,11 +903,13 @@ class FullFrameAnimation(Animation):
         """A sequence of timed full frames"""
         Animation.__init__(self)
         self.frames: Sequence[TimeFullFrame] = list(frames or [(0, [])])
-        self.start_time: float = time.time()
+        self.start_time: float = animationTime()
         self.frame_index = 0
         self.started = False
-        self.current_frame = self.frames[0]
+        self.current_frame = self.frames[0][1]
         self.num_tubes = max(map(lambda x: x[1].tubeCount(), self.frames))
+        self.end_offsets: List[float] = []
+        self.compile()
 
     @classmethod
     def makeTimed(cls, frames: Sequence[FullFrame], rate: int=1, *, delay: float=0, **kwargs):
@@ -739,11 +925,24 @@ class FullFrameAnimation(Animation):
         time_frames: List[TimeFullFrame] = [(delay, frame) for frame in frames]
         return cls(time_frames, **kwargs)
 
+    def compile(self):
+        """
+        Build the timeline of cumulative frame end offsets
+        Must be called again whenever self.frames is changed
+        """
+        self.end_offsets = list(itertools.accumulate(delay for delay, _ in self.frames))
+
     def reset(self):
         """Reset the animation"""
         self.started = False
         self.frame_index = 0
-        self.start_time = time.time()
+        self.start_time = animationTime()
+
+    def startAt(self, start_time:float):
+        """The first frame is shown now. Frames already due are caught up on the next update"""
+        updated = Animation.startAt(self, start_time)
+        self.start_time = start_time
+        return updated
 
     def frameCount(self):
         """Total frame count"""
@@ -751,7 +950,33 @@ class FullFrameAnimation(Animation):
 
     def length(self):
         """Time length of the animation set"""
-        return self.frames[0]
+        return self.end_offsets[-1] if self.end_offsets else 0
+
+    def frameIndexAt(self, offset:float) -> int:
+        """
+        Index of the frame showing 'offset' seconds after the start
+        Equal to frameCount() once the animation has ended
+        """
+        if offset < 0:
+            return 0
+
+        return bisect.bisect_right(self.end_offsets, offset)
+
+    def frameAt(self, offset:float) -> FullFrame:
+        """The full frame showing 'offset' seconds after the start. None after the end"""
+        index = self.frameIndexAt(offset)
+        if index >= len(self.frames):
+            return None
+
+        return self.frames[index][1]
+
+    def seek(self, offset:float):
+        """Jump playback to 'offset' seconds after the start"""
+        self.started = True
+        self.start_time = animationTime() - offset
+        self.frame_index = self.frameIndexAt(offset)
+        if self.frame_index < len(self.frames):
+            self.current_frame = self.frames[self.frame_index][1]
 
     def tubeCount(self):
         """Get the number of tubes supported by this animation"""
@@ -783,7 +1008,7 @@ class FullFrameAnimation(Animation):
         if self.frame_index >= len(self.frames):
             return False
 
-        now = time.time()
+        now = animationTime()
         ## Force set the first frame and set the start time
         if not self.started:
             self.started = True
@@ -791,19 +1016,36 @@ class FullFrameAnimation(Animation):
             self.current_frame = self.frames[0][1]
             return True
 
-        ## See if current frame has passed
-        length, _ = self.frames[self.frame_index]
-        if now < self.start_time + length:
+        ## Jump straight to the frame that belongs at 'now'. Frames that were
+        ## missed while the caller was late are skipped, and lateness never
+        ## accumulates as every frame is timed from the same start
+        index = self.frameIndexAt(now - self.start_time)
+        if index == self.frame_index:
             return False
 
-        self.frame_index += 1
-        self.start_time = now
+        self.frame_index = index
         if self.frame_index >= len(self.frames):
             return False
 
         self.current_frame = self.frames[self.frame_index][1]
         return True
 
+    def nextDeadline(self):
+        """End time of the current frame. None after the last frame"""
+        if self.frame_index >= len(self.frames):
+            return None
+        if not self.started:
+            return 0.0
+
+        return self.start_time + self.end_offsets[self.frame_index]
+
+    def endTime(self):
+        """End time of the last frame. None until started"""
+        if not self.started:
+            return None
+
+        return self.start_time + self.length()
+
     def done(self):
         return (self.frame_index == len(self.frames))
 
@@ -848,6 +1090,7 @@ class FullFrameAnimation(Animation):
 
         ## Add frames
         self.frames += new_frames
+        self.compile()
         self.reset()
         return self
 
@@ -876,6 +1119,7 @@ class FullFrameAnimation(Animation):
             raise PixieAnimationError(f"{name} must be multiplied by int")
 
         self.frames = self._mul_helper(x)
+        self.compile()
         self.reset()
         return self
 
@@ -898,7 +1142,7 @@ class LoopedFullFrameAnimation(FullFrameAnimation):
     def __init__(self, frames:Sequence[TimeFullFrame], delay: float=0):
         FullFrameAnimation.__init__(self, frames)
         self.delay = delay
-        self.last_update = time.time()
+        self.last_update = animationTime()
 
     @classmethod
     def makeTimed(cls, frames: Sequence[FullFrame], rate: int=1, *, delay: float=0, **kwargs):
@@ -926,15 +1170,26 @@ class LoopedFullFrameAnimation(FullFrameAnimation):
         """Update the frame set based upon the current time. Return True if updated"""
         update = FullFrameAnimation.updateFrameSet(self)
         if update:
-            self.last_update = time.time()
+            self.last_update = animationTime()
             return update
 
-        if self.loopOver() and self.last_update + self.delay < time.time():
+        if self.loopOver() and self.last_update + self.delay < animationTime():
             self.reset()
             return FullFrameAnimation.updateFrameSet(self)
 
         return None
 
+    def nextDeadline(self):
+        """Restart 'delay' after the last update once the loop is over"""
+        if self.loopOver():
+            return self.last_update + self.delay
+
+        return FullFrameAnimation.nextDeadline(self)
+
+    def endTime(self):
+        """Never ends"""
+        return None
+
     def clone(self):
         return LoopedFullFrameAnimation(self.frames[:], self.delay)
 
@@ -949,6 +1204,9 @@ class ComboAnimation(Animation):
         for ani in self.animations:
             ani.reset()
 
+    def startAt(self, start_time:float):
+        return any([ani.startAt(start_time) for ani in self.animations])
+
     def tubeCount(self):
         total = 0
         for ani in self.animations:
@@ -967,6 +1225,19 @@ class ComboAnimation(Animation):
     def done(self):
         return all(map(lambda ani: ani.done(), self.animations))
 
+    def nextDeadline(self):
+        """The earliest deadline of all the animations"""
+        deadlines = [ani.nextDeadline() for ani in self.animations]
+        return min(filter(lambda x: x is not None, deadlines), default=None)
+
+    def endTime(self):
+        """When the last animation ends. None if any end time is unknown"""
+        end_times = [ani.endTime() for ani in self.animations]
+        if None in end_times:
+            return None
+
+        return max(end_times, default=None)
+
 
 class MarqueeAnimation(Animation):
     def __init__(self, frames:Sequence[Frame], size:int, delay:float=0.5, freeze:float=0):
@@ -976,7 +1247,7 @@ class MarqueeAnimation(Animation):
         self.delay      = delay
         self.freeze     = freeze if len(frames) <= size else 0
         self.index      = None
-        self.start_time = time.time()
+        self.start_time = animationTime()
 
     @classmethod
     def fromText(cls, msg, *args, **kwargs):
@@ -985,7 +1256,12 @@ class MarqueeAnimation(Animation):
 
     def reset(self):
         self.index = None
-        self.start_time = time.time()
+        self.start_time = animationTime()
+
+    def startAt(self, start_time:float):
+        self.reset()
+        self.start_time = start_time
+        return self.updateFrameSet()
 
     def tubeCount(self):
         return self.size
@@ -1007,7 +1283,7 @@ class MarqueeAnimation(Animation):
             return (idx is None)
 
         ## Shift frames if it's time
-        elapsed = time.time() - self.start_time
+        elapsed = animationTime() - self.start_time
         next_index = int(elapsed / self.delay)
         if next_index > len(self.frames) or next_index == self.index:
             return False
@@ -1015,12 +1291,28 @@ class MarqueeAnimation(Animation):
         self.index = next_index
         return True
 
+    def nextDeadline(self):
+        """Time of the next shift. A frozen marquee never changes after the first frame"""
+        if self.index is None:
+            return 0.0
+        if self.freeze or self.index >= len(self.frames):
+            return None
+
+        return self.start_time + (self.index + 1)*self.delay
+
+    def endTime(self):
+        """When the freeze is over, or the last frame has shifted off the screen"""
+        if self.freeze:
+            return self.start_time + self.freeze
+
+        return self.start_time + len(self.frames)*self.delay
+
     def done(self):
         """The last frame has loaded"""
         if self.freeze:
-            return (time.time() - self.start_time > self.freeze)
+            return (animationTime() - self.start_time > self.freeze)
 
         ## Return true if the last frame has shifted off the screen
-        elapsed = time.time() - self.start_time
+        elapsed = animationTime() - self.start_time
         next_index = elapsed // self.delay
         return (next_index >= len(self.frames))
@@ -0,0 +1,201 @@
+"""
+On-disk cache of parsed animation files
+
+Parsing a .ani file and the libraries it imports is slow on a Pi. The
+parsed (delay, FullFrame) timeline is pickled to the cache directory, one
+entry per file. Each entry records a content hash of the file and of every
+library the parse imported, however deep, so changing any of them makes
+the next load a miss and the file is parsed again. So does a change to
+the parser itself, caught by a digest of its modules' source
+
+Entries are never rewritten in place, so a file that moves or is deleted
+leaves its entry behind. Each store prunes entries that haven't been used
+in 'max_age' seconds, then the least recently used past 'max_entries'
+"""
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import time
+from typing import List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+## Bump when the parser's output changes so older entries are ignored
+CACHE_VERSION = 1
+
+## Modules, next to this one, whose code decides what a parse produces
+PARSER_MODULES = (
+    'animation.py', 'animation_cache.py', 'animation_file.py', 'animation_library.py',
+    'animation_sandbox.py', 'decoder.py', 'tube_manager.py',
+)
+
+
+def fileHash(path) -> str:
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def parserDigest() -> str:
+    """SHA-256 of CACHE_VERSION and the source of every parser module. Worked out once"""
+    if _parser_digest:
+        return _parser_digest[0]
+
+    digest = hashlib.sha256(str(CACHE_VERSION).encode())
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in PARSER_MODULES:
+        digest.update(name.encode())
+        digest.update(fileHash(os.path.join(here, name)).encode())
+
+    _parser_digest.append(digest.hexdigest())
+    return _parser_digest[0]
+
+
+_parser_digest: List[str] = []
+
+
+def defaultCacheDir() -> str:
+    """$PYXIE_CACHE_DIR, or ~/.cache/pyxie"""
+    return os.environ.get('PYXIE_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'pyxie')
+
+
+class AnimationCache:
+    def __init__(self, directory:str=None, *, max_entries=256, max_age=30*24*60*60):
+        self.directory   = directory or defaultCacheDir()
+        self.max_entries = max_entries
+        self.max_age     = max_age
+        self.hits        = 0
+        self.misses      = 0
+
+    def entryPath(self, path, size) -> str:
+        """Where the entry for the animation file 'path' is kept"""
+        key = f"{CACHE_VERSION}|{size}|{os.path.abspath(path)}"
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest() + '.pkl')
+
+    def load(self, path, size) -> Optional[List]:
+        """The cached timeline of 'path', or None if there's no valid entry"""
+        frames = self._load(path, size)
+        if frames is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return frames
+
+    def _load(self, path, size):
+        entry_path = self.entryPath(path, size)
+        try:
+            with open(entry_path, 'rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cache entry for '{path}': {e}")
+            return None
+
+        ## So must the parser and every file the parse read
+        if entry.get('parser') != parserDigest():
+            logger.debug(f"Cached parse of '{path}' is stale, the parser has changed")
+            return None
+
+        try:
+            for dep, digest in entry['files']:
+                if fileHash(dep) != digest:
+                    logger.debug(f"Cached parse of '{path}' is stale, '{dep}' has changed")
+                    return None
+        except OSError:
+            return None
+
+        ## The mtime marks when an entry was last used, for prune()
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        logger.debug(f"Loaded '{path}' from the animation cache")
+        return entry['frames']
+
+    def store(self, path, size, frames:Sequence, imports:Sequence[str]=()):
+        """
+        Cache the parsed timeline of 'path'. 'imports' are the paths of
+        every library the parse read. Failing to write is only logged
+        """
+        try:
+            entry = {
+                'parser': parserDigest(),
+                'files':  [(x, fileHash(x)) for x in [path, *imports]],
+                'frames': list(frames),
+            }
+            os.makedirs(self.directory, exist_ok=True)
+            ## Write to a temp file first so a reader never sees half an entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self.entryPath(path, size))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            self.prune()
+        except Exception as e:
+            logger.warning(f"Failed to cache parsed animation '{path}': {e}")
+
+    def entries(self) -> List[Tuple[float, str]]:
+        """The (mtime, path) of every cache entry, least recently used first"""
+        if not os.path.isdir(self.directory):
+            return []
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+
+        return sorted(entries)
+
+    def prune(self):
+        """Delete entries older than 'max_age', then the oldest past 'max_entries'"""
+        entries = self.entries()
+        cutoff = time.time() - self.max_age
+        fresh = [x for x in entries if x[0] >= cutoff]
+        stale = [x for x in entries if x[0] < cutoff] + fresh[:max(0, len(fresh) - self.max_entries)]
+        for _, path in stale:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        if stale:
+            logger.debug(f"Pruned {len(stale)} animation cache entries")
+
+    def clear(self):
+        """Delete every cache entry"""
+        if not os.path.isdir(self.directory):
+            return
+
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                os.unlink(os.path.join(self.directory, name))
+
+
+_cache: Optional[AnimationCache] = AnimationCache()
+
+
+def getAnimationCache() -> Optional[AnimationCache]:
+    return _cache
+
+
+def setAnimationCache(cache:Optional[AnimationCache]) -> Optional[AnimationCache]:
+    """Use 'cache' from now on. None turns caching off. Returns the cache it replaces"""
+    global _cache ## pylint: disable=global-statement
+    old = _cache
+    _cache = cache
+    return old
@@ -1,7 +1,9 @@
 import logging
 import os
 import re
+import threading
 
+from types import MappingProxyType
 from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 from pyxielib.animation import (
@@ -9,6 +11,7 @@ from pyxielib.animation import (
     PixieAnimationError, TimeFullFrame,
     textToFrames,
 )
+from pyxielib.animation_cache import getAnimationCache
 from pyxielib.pyxieutil import PyxieError, strToInt
 
 logger = logging.getLogger(__name__)
@@ -39,8 +42,76 @@ class ArgSpec:
         self.handler = handler          ## function invoked as handler(*positional, **named)
 
 
+## One alternative per token, tried in order at each position: a macro
+## '{name}', an inline hex literal '{0x1A2B}', a multiplier '{3}', or a
+## run of literal text
+_TOKEN_SCAN = re.compile(r"\{([A-z]\w*)}|\{(0[xX][0-9A-Fa-f]+)}|\{(\d+)}|[^\{\}]+").match
+
+FileStamp = Tuple[int, int]  ## (mtime in ns, size)
+
+
+def fileStamp(path) -> FileStamp:
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class LibraryCache:
+    """
+    Parsed libraries shared by every FileAnimation in the process, keyed by
+    path and tube count. An entry is only used while the library and every
+    library it imports still have the mtimes and sizes they were parsed with
+    """
+    def __init__(self):
+        self.hits    = 0
+        self.misses  = 0
+        self.lock    = threading.Lock()
+        self.entries: Dict[Tuple[str, int], 'FileAnimation'] = {}
+
+    def get(self, path, size) -> Optional['FileAnimation']:
+        """The parsed library at 'path', or None if it isn't cached or has changed"""
+        with self.lock:
+            lib = self.entries.get((path, size))
+
+        if lib is not None and not lib.libraryChanged():
+            with self.lock:
+                self.hits += 1
+            return lib
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, lib:'FileAnimation'):
+        with self.lock:
+            self.entries[(lib.path, lib.size)] = lib
+
+    def clear(self):
+        """Drop every entry and zero the counters"""
+        with self.lock:
+            self.entries.clear()
+            self.hits   = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'size':   len(self.entries),
+                'hits':   self.hits,
+                'misses': self.misses,
+            }
+
+
+## Shared by every FileAnimation and library import
+library_cache = LibraryCache()
+
+
 class FileAnimation(FullFrameAnimation):
-    def __init__(self, path, size=16):
+    def __init__(self, path, size=16, *, cache=True):
+        """
+        With 'cache' the parsed frames are read from and saved to the
+        animation cache. On a hit nothing is parsed, so sprites, segments
+        and sequences are left empty
+        """
         self.path          = path
         self.size          = size
         self.scale         = 1
@@ -62,12 +133,19 @@ class FileAnimation(FullFrameAnimation):
         ## Cache shared down the import tree: filename -> parsed library object,
         ## or None while a file is still being parsed (marks a circular import).
         self._imported:    Dict[str, Optional['FileAnimation']] = {}
+        ## Stamp of every library read while parsing, including nested imports
+        self.library_files: Dict[str, FileStamp] = {}
+        self.partial       = False  ## A circular import was skipped somewhere below
+        ## Frame lines already expanded since a symbol was last defined or
+        ## imported: line -> frames, and frame line -> padded FullFrame
+        self._line_memo:   Dict[str, Tuple[Frame, ...]] = {}
+        self._frame_memo:  Dict[str, FullFrame] = {}
         self.sprites:      Dict[str, Frame] = {}
         self.sequences:    Dict[str, List[TimeFullFrame]] = {}
         self.segments:     Dict[str, List[Frame]] = {}
         self.fullframes:   List[TimeFullFrame] = []
         self.active:       List[TimeFullFrame] = self.fullframes
-        FullFrameAnimation.__init__(self, self.loadFrames(path))
+        FullFrameAnimation.__init__(self, self.loadCachedFrames(path) if cache else self.loadFrames(path))
 
     @classmethod
     def _load_as_library(cls, path, imported: Dict[str, Optional['FileAnimation']], size=16) -> 'FileAnimation':
@@ -85,20 +163,46 @@ class FileAnimation(FullFrameAnimation):
         obj._skip_block   = None
         obj._library_mode = True
         obj._imported     = imported
+        obj.library_files = {}
+        obj.partial       = False
+        obj._line_memo    = {}
+        obj._frame_memo   = {}
         obj.sprites       = {}
         obj.sequences     = {}
         obj.segments      = {}
         obj.fullframes    = []
         obj.active        = obj.fullframes
         try:
+            ## Stamped before reading, so a change made mid-parse is seen next time
+            obj.library_files[path] = fileStamp(path)
             with open(path, 'r') as f:
                 obj._loadFramesHelper(f)
         except FileAnimationError:
             raise
         except Exception as e:
             raise FileAnimationError(f"Failed to load library '{path}': {e}")
+
+        obj._freeze()
         return obj
 
+    def _freeze(self):
+        """
+        Make a parsed library's symbol tables read only, so one parse can be
+        shared by every file that imports it without copying
+        """
+        self.sprites   = MappingProxyType(self.sprites)
+        self.segments  = MappingProxyType({k: tuple(v) for k, v in self.segments.items()})
+        self.sequences = MappingProxyType({k: tuple(v) for k, v in self.sequences.items()})
+        self._imported = None
+        self._symbolsChanged()
+
+    def libraryChanged(self) -> bool:
+        """True if this library or anything it imports changed since it was parsed"""
+        try:
+            return any(fileStamp(path) != stamp for path, stamp in self.library_files.items())
+        except OSError:
+            return True
+
     def loadFrames(self, path):
         """Load animation from a file given the path"""
         try:
@@ -109,6 +213,24 @@ class FileAnimation(FullFrameAnimation):
         except Exception as e:
             raise PixieAnimationError(f"Failed to load animation file {path}: " + str(e)) from e
 
+    def loadCachedFrames(self, path):
+        """Load animation from the animation cache, or parse the file and cache it"""
+        cache = getAnimationCache()
+        frames = cache.load(path, self.size) if cache is not None else None
+        if frames is not None:
+            self.fullframes = frames
+            self.active = self.fullframes
+            return frames
+
+        frames = self.loadFrames(path)
+        if cache is not None:
+            cache.store(path, self.size, frames, self.importedPaths())
+        return frames
+
+    def importedPaths(self) -> List[str]:
+        """Paths of every library imported while parsing, including nested imports"""
+        return list(self.library_files)
+
     def _loadFramesHelper(self, ani_file):
         """Load animation from a sequence of strings"""
         ## Parse file line by line
@@ -306,10 +428,28 @@ class FileAnimation(FullFrameAnimation):
             raise FileAnimationError("Failed to convert sprite code: " + str(e))
 
         self.sprites[name] = HexFrame(code)
+        self._symbolsChanged()
         logger.debug(f"Found sprite '{name}'")
 
-    def _parseSegmentHlpr(self, line) -> List[Frame]:
-        """Parse a frame line"""
+    def _symbolsChanged(self):
+        """A sprite or segment was defined or imported, so a memoized line may now expand differently"""
+        self._line_memo.clear()
+        self._frame_memo.clear()
+
+    def _parseSegmentHlpr(self, line) -> Tuple[Frame, ...]:
+        """
+        Parse a frame line. Identical lines share one expansion until a
+        sprite or segment is next defined or imported
+        """
+        frames = self._line_memo.get(line)
+        if frames is None:
+            ## Lines with errors raise every time and are never memoized
+            frames = self._line_memo[line] = tuple(self._expandLine(line))
+
+        return frames
+
+    def _expandLine(self, line) -> List[Frame]:
+        """Expand a frame line's tokens into frames"""
         ## Tokenize the frames
         tokens = self._tokenize(line)
         frames = []
@@ -346,6 +486,7 @@ class FileAnimation(FullFrameAnimation):
             raise FileAnimationError(f"Segment '{name}' already exists")
 
         self.segments[name] = self._parseSegmentHlpr(line)
+        self._symbolsChanged()
 
     def _parseFrame(self, length, line):
         if self._library_mode and self.sequence is None:
@@ -361,24 +502,30 @@ class FileAnimation(FullFrameAnimation):
         if self.sequence is None:
             length *= self.scale
 
-        frames = self._parseSegmentHlpr(line)
+        ## Identical lines share one FullFrame. Nothing modifies a FullFrame
+        ## once it's in a timeline, so sharing is safe
+        full_frame = self._frame_memo.get(line)
+        if full_frame is None:
+            frames = list(self._parseSegmentHlpr(line))
 
-        ## Fix number of frames
-        num_frames = len(frames)
-        if num_frames > self.size:
-            frames = frames[:self.size]
-        elif num_frames < self.size:
-            missing = self.size - num_frames
-            frames += [Frame()]*missing
+            ## Fix number of frames
+            num_frames = len(frames)
+            if num_frames > self.size:
+                frames = frames[:self.size]
+            elif num_frames < self.size:
+                missing = self.size - num_frames
+                frames += [Frame()]*missing
+
+            full_frame = self._frame_memo[line] = FullFrame(frames)
 
         if length:
             ## Add the frames
-            self.active.append((length, FullFrame(frames)))
+            self.active.append((length, full_frame))
         else:
             ## Overlay the frames
             logger.debug("%s", self.active[-1])
-            logger.debug("%s", FullFrame(frames))
-            self.active[-1] = (self.active[-1][0], self.active[-1][1].overlay(FullFrame(frames)))
+            logger.debug("%s", full_frame)
+            self.active[-1] = (self.active[-1][0], self.active[-1][1].overlay(full_frame))
             logger.debug("%s", self.active[-1])
 
     def _parseScale(self, scale):
@@ -602,6 +749,7 @@ class FileAnimation(FullFrameAnimation):
                 logger.debug(f"Inserted anonymous flattened frame from {len(segs)} segments (delay={delay})")
             else:
                 self.segments[name] = frames
+                self._symbolsChanged()
                 logger.debug(f"Flattened {len(segs)} segments into '{name}'")
         else:
             raise FileAnimationError(f"Unknown flatten subcommand '{subcmd}'")
@@ -762,25 +910,42 @@ class FileAnimation(FullFrameAnimation):
             lib = self._imported[filename]
             if lib is None:
                 logger.debug(f"Skipping circular import of library '{filename}'")
+                self.partial = True
                 return
             logger.debug(f"Re-using already-parsed library '{filename}'")
             self._mergeLibrary(lib, import_scale)
             return
 
-        self._imported[filename] = None  ## mark in-progress to break import cycles
-        logger.debug(f"Importing library '{full_path}' with scale={import_scale}")
-        lib = FileAnimation._load_as_library(full_path, self._imported, size=self.size)
+        ## Libraries are also shared across files. One parsed with a circular
+        ## import skipped depends on who imported it, so it's never shared
+        lib = library_cache.get(full_path, self.size)
+        if lib is not None:
+            logger.debug(f"Re-using cached library '{full_path}'")
+        else:
+            self._imported[filename] = None  ## mark in-progress to break import cycles
+            logger.debug(f"Importing library '{full_path}' with scale={import_scale}")
+            lib = FileAnimation._load_as_library(full_path, self._imported, size=self.size)
+            if not lib.partial:
+                library_cache.put(lib)
+
         self._imported[filename] = lib
         self._mergeLibrary(lib, import_scale)
 
     def _mergeLibrary(self, lib, import_scale):
-        """Merge a parsed library's sprites, segments, and sequences into this file."""
+        """
+        Merge a parsed library's sprites, segments, and sequences into this file.
+        The library's symbols are read only, so they're shared, not copied
+        """
         self.sprites.update(lib.sprites)
         self.segments.update(lib.segments)
         for name, frames in lib.sequences.items():
-            self.sequences[name] = [(t * import_scale, f) for t, f in frames]
+            self.sequences[name] = frames if import_scale == 1 else tuple((t * import_scale, f) for t, f in frames)
             logger.debug(f"Imported sequence '{name}'")
 
+        self.library_files.update(lib.library_files)
+        self.partial = self.partial or lib.partial
+        self._symbolsChanged()
+
     def _parseSandbox(self, subcmd):
         if subcmd == 'start':
             if self._sandbox is not None:
@@ -808,44 +973,29 @@ class FileAnimation(FullFrameAnimation):
 
     @staticmethod
     def _tokenize(line):
-        """Break line into tokens"""
+        """Break line into tokens in one pass"""
         tokens = []
-        parsed = ""
-        while line:
-            ## Match macro
-            m = re.search(r"^\{([A-z]\w*)}", line)
-            if m:
-                tokens.append(('macro', m.groups()[0]))
-
-            ## Match inline hex literal e.g. {0x1A2B}
-            if m is None:
-                m = re.search(r"^\{(0[xX][0-9A-Fa-f]+)}", line)
-                if m:
-                    tokens.append(('hex', m.groups()[0]))
-
-            ## Match multiplier
+        pos = 0
+        while pos < len(line):
+            m = _TOKEN_SCAN(line, pos)
             if m is None:
-                m = re.search(r"^\{(\d+)}", line)
-                if m:
-                    tokens.append(('multiplier', int(m.groups()[0])))
-
-            ## Match literal
-            if m is None:
-                m = re.search(r"^[^\{\}]+", line)
-                if m:
-                    tokens.append(('literal', m.group()))
-
-            ## At least one match was found
-            if m:
-                matched = m.group()
-                line = line[len(matched):]
-                parsed += matched
-                continue
-
-            ## Identify error
-            if line[0] in ['{', '}']:
-                raise FileAnimationError(f"Found unmatched '{line[0]}: '{parsed}<<HERE>>{line}'")
+                ## Identify error
+                parsed, rest = line[:pos], line[pos:]
+                if rest[0] in ['{', '}']:
+                    raise FileAnimationError(f"Found unmatched '{rest[0]}: '{parsed}<<HERE>>{rest}'")
+
+                raise FileAnimationError(f"Unknown syntax error: '{parsed}<<HERE>>{rest}'")
+
+            kind = m.lastindex
+            if kind == 1:
+                tokens.append(('macro', m.group(1)))
+            elif kind == 2:
+                tokens.append(('hex', m.group(2)))
+            elif kind == 3:
+                tokens.append(('multiplier', int(m.group(3))))
+            else:
+                tokens.append(('literal', m.group()))
 
-            raise FileAnimationError(f"Unknown syntax error: '{parsed}<<HERE>>{line}'")
+            pos = m.end()
 
         return tokens
@@ -1,21 +1,185 @@
 import logging
 import threading
 import traceback
+from typing import Dict, List, Sequence
 
+from pyxielib import tube_manager as tm
 from pyxielib.controller import Controller, TerminalController
-from pyxielib.animation import Animation
+from pyxielib.animation import Animation, animationTime, steppingAhead
+from pyxielib.clock import getClock
+from pyxielib.pyxieutil import LatestValueQueue
+from pyxielib.telemetry import FrameTelemetry, MovingAverage
 
 logger = logging.getLogger(__name__)
 
+
+class ControllerOutput:
+    """One controller fed by an Assembler, with its own frame queue and state"""
+    ## Most a frame is sent ahead of its deadline to make up for the controller's latency
+    MAX_LEAD_TIME = 0.25
+
+    def __init__(self, controller: Controller, *, name=None, queue_size=1):
+        self.controller        = controller
+        self.frames            = LatestValueQueue(queue_size)
+        self.thread: threading.Thread = None
+        self.last_bitmaps      = None
+        self.last_resets       = 0
+        self.frames_suppressed = 0
+        self.send_latency      = MovingAverage()
+        self.telemetry = FrameTelemetry(name or type(controller).__name__)
+
+    @property
+    def name(self):
+        return self.telemetry.name
+
+    def leadTime(self) -> float:
+        """How long before its deadline a frame is sent so it shows on time"""
+        latency = self.send_latency.value
+        return min(latency, self.MAX_LEAD_TIME) if latency is not None else 0.0
+
+    def output(self, code, bitmaps=None):
+        """
+        Send a frame to the controller. Only the tubes that changed are sent
+        if the controller accepts partial updates, and a frame that changes
+        nothing isn't sent at all. Returns whether anything was sent
+        'bitmaps' is the decoded frame, when the animation has it. Then
+        'code' may be None, and is only made if the controller needs it
+        """
+        controller = self.controller
+        if code is None and not (controller.enabled and controller.acceptsPartialUpdates()):
+            ## Only sendTubes() takes bitmaps
+            code = tm.bitmapsToCode(bitmaps)
+        if not controller.enabled:
+            ## The controller may not show what it's sent, so forget the last frame
+            self.last_bitmaps = None
+            controller.send(code)
+            return True
+
+        if bitmaps is None:
+            bitmaps = tm.cachedDecodePrint(code)
+        last = self.last_bitmaps if self.last_resets == controller.resets else None
+        self.last_bitmaps = bitmaps
+        self.last_resets = controller.resets
+        if last is not None and len(last) == len(bitmaps):
+            changed = [i for i, (a, b) in enumerate(zip(last, bitmaps)) if a != b]
+            if not changed:
+                self.frames_suppressed += 1
+                return False
+        else:
+            changed = None
+
+        if not controller.acceptsPartialUpdates():
+            controller.send(code)
+        elif changed is None:
+            controller.sendTubes(bitmaps, list(range(len(bitmaps))))
+        else:
+            controller.sendTubes(bitmaps, changed)
+
+        return True
+
+    def outputTimed(self, code, scheduled, bitmaps=None):
+        """
+        Output a frame due at 'scheduled' and record how late it showed and
+        how long it took. Returns the average send time, or None if nothing was sent
+        """
+        clock = getClock()
+        start = clock.monotonic()
+        if not self.output(code, bitmaps):
+            self.telemetry.suppressed += 1
+            return None
+
+        end = clock.monotonic()
+        self.telemetry.record(scheduled, end, end - start)
+        return self.send_latency.add(end - start)
+
+    def dropped(self):
+        """Frames that never reached the controller because it fell behind"""
+        return self.frames.dropped + self.frames.coalesced
+
+    def timingStats(self) -> dict:
+        self.telemetry.dropped = self.dropped()
+        return self.telemetry.stats()
+
+    def frameStats(self) -> dict:
+        return {
+            'frames':     self.frames.puts,
+            'dropped':    self.frames.dropped,
+            'coalesced':  self.frames.coalesced,
+            'suppressed': self.frames_suppressed,
+        }
+
+
 class Assembler:
-    def __init__(self, *, controller: Controller=None, animation: Animation=None):
+    ## Most the time frames are made ahead of their deadlines grows per frame.
+    ## Growing it by more than a frame at once would skip frames
+    MAX_LEAD_STEP = 0.001
+
+    def __init__(self, *, controller: Controller=None, controllers: Sequence[Controller]=None, \
+            animation: Animation=None, queue_size=1, compensate_latency=True, spin=0.0):
+        """
+        One thread steps the animation and another sends the frames to the
+        controller, so a slow controller can't delay the frame timing.
+        They are joined by a queue of up to 'queue_size' frames. When the
+        controller falls behind, older frames are dropped or skipped
+        With 'controllers' the same frames are sent to every controller.
+        Each gets its own output thread and queue, so a slow one only drops
+        its own frames. 'controller' is the same as a list of one
+        With 'compensate_latency' each controller is sent a frame ahead of
+        its deadline by the average time that controller takes to send one,
+        so frames show when they are due instead of that much later
+        With 'spin' the last 'spin' seconds before a frame is sent to a
+        controller are busy waited instead of slept, for less jitter
+        """
         self.running    = False
         self.shutdown   = False
         self.thread     = threading.Thread(target=self.handler)
         self.lock       = threading.Lock()
         self.cv         = threading.Condition(lock=self.lock)
         self.animation : Animation  = animation
-        self.controller: Controller = controller or TerminalController()
+        self.next_animation: Animation = None  ## Starts the moment 'animation' is done
+        self.queued_at         = None  ## When 'next_animation' was queued
+        self.controllers: List[Controller] = list(controllers or []) or [controller or TerminalController()]
+        self.controller: Controller = self.controllers[0]
+        self.outputs = [ControllerOutput(ctrl, name=name, queue_size=queue_size) \
+            for ctrl, name in zip(self.controllers, self.outputNames(self.controllers))]
+        self.deadline          = None  ## When the frame being waited for is due
+        self.swaps             = 0     ## Times a queued animation was started
+        self.compensate_latency = compensate_latency
+        self.spin               = spin
+        self.lead_time          = 0.0  ## How far ahead of their deadlines frames are made
+
+    @staticmethod
+    def outputNames(controllers):
+        """Controller class names, numbered when there are more than one of a class"""
+        names = [type(ctrl).__name__ for ctrl in controllers]
+        seen: Dict[str, int] = {}
+        numbered = []
+        for name in names:
+            seen[name] = seen.get(name, 0) + 1
+            numbered.append(name if names.count(name) == 1 else f"{name}#{seen[name]}")
+
+        return numbered
+
+    @property
+    def telemetry(self):
+        """Telemetry of the first controller"""
+        return self.outputs[0].telemetry
+
+    def leadTime(self, out:ControllerOutput=None) -> float:
+        """
+        How long before its deadline a frame is sent to 'out'. Without
+        'out', the longest of any controller, which is how early frames are made
+        """
+        if not self.compensate_latency:
+            return 0.0
+        if out is not None:
+            return out.leadTime()
+
+        return max(x.leadTime() for x in self.outputs)
+
+    @property
+    def frames_suppressed(self):
+        return sum(out.frames_suppressed for out in self.outputs)
 
     def isRunning(self):
         return (self.running and self.thread.is_alive())
@@ -27,27 +191,108 @@ class Assembler:
         self.cv.acquire()
         self.animation = animation
         self.animation.reset()
+        self.next_animation = None
+        self.deadline = None
         self.cv.notify_all()
         self.cv.release()
 
+    def queueAnimation(self, animation):
+        """
+        Play 'animation' as soon as the current one is done, at the same
+        frame boundary, instead of waiting for someone to call setAnimation()
+        Replaces any animation already queued. One that's already done, like
+        an EmtpyAnimation, would never show a frame and isn't queued.
+        Returns whether it was queued
+        """
+        if animation is None or animation.done():
+            logger.debug(f"Not queueing {type(animation).__name__}, it has nothing to show")
+            return False
+
+        self.cv.acquire()
+        self.next_animation = animation
+        self.queued_at = animationTime()
+        self.cv.notify_all()
+        self.cv.release()
+        return True
+
+    def needsNextAnimation(self, within:float):
+        """Nothing is queued and the current animation ends in less than 'within' seconds"""
+        self.cv.acquire()
+        needed = False
+        if self.animation is not None and self.next_animation is None:
+            end_time = self.animation.endTime()
+            needed = (end_time is not None and end_time - animationTime() < within)
+        self.cv.release()
+        return needed
+
     def clearAnimation(self):
         self.animation = None
+        self.next_animation = None
 
     def rerun(self):
         self.cv.acquire()
         self.animation.reset()
+        self.deadline = None
         self.cv.notify_all()
         self.cv.release()
 
+    def nextDeadline(self):
+        """
+        When the animation next changes. None if it never will
+        With an animation queued, also when the current one ends
+        """
+        animation = self.animation
+        if animation is None:
+            return None
+
+        deadline = animation.nextDeadline()
+        if self.next_animation is not None:
+            end_time = animation.endTime()
+            if end_time is not None and (deadline is None or end_time < deadline):
+                return end_time
+
+        return deadline
+
+    @staticmethod
+    def secondsUntil(deadline):
+        if deadline is None:
+            return None
+
+        return max(0, deadline - animationTime())
+
+    def timeToNextFrame(self):
+        """Seconds until the animation next changes. None if it never will"""
+        return self.secondsUntil(self.nextDeadline())
+
+    def scheduledTime(self, now):
+        """When the frame made at 'now' was due"""
+        if not self.deadline or self.deadline > now:
+            ## Not made for a timed deadline, such as the first frame of an animation
+            return now
+
+        return self.deadline
+
+    def output(self, code, bitmaps=None):
+        """Send a frame to every controller. Returns whether any of them were sent anything"""
+        sent = [out.output(code, bitmaps) for out in self.outputs]
+        return any(sent)
+
     def handler(self):
         self.cv.acquire()
         logger.info("Starting assembler thread")
         try:
             while self.running:
-                if self.animation and self.animation.updateFrameSet():
-                    self.controller.send(self.animation.getCode())
+                ## Make the frame early enough to reach the slowest controller on time
+                self.lead_time = min(self.leadTime(), self.lead_time + self.MAX_LEAD_STEP)
+                with steppingAhead(self.lead_time):
+                    frame = self.step()
+                if frame is not None:
+                    for out in self.outputs:
+                        out.frames.put(frame)
 
-                self.cv.wait(0.01)
+                ## Sleep until the next frame should be made, or until
+                ## setAnimation/rerun/stop wakes the thread
+                self.waitForDeadline(self.lead_time)
         except Exception as e:
             logger.error(f"Fatal error in assembler thread: {e}")
             traceback.print_exc()
@@ -56,9 +301,105 @@ class Assembler:
         logger.info("Exiting assembler thread")
         self.shutdown = True
 
+    def step(self):
+        """
+        Called holding the lock. Update the animation and set the next
+        deadline. Returns the (code, scheduled time, bitmaps) of the new
+        frame, or None if the frame didn't change. When the animation
+        has its bitmaps the code is left to the controllers that need it
+        """
+        animation = self.animation
+        updated = animation is not None and animation.updateFrameSet()
+        if self.next_animation is not None and (animation is None or animation.done()):
+            ## Swap in the queued animation at the same frame boundary.
+            ## The last frame of the old one is skipped if it's replaced
+            updated = self.swapAnimation()
+            animation = self.animation
+
+        frame = None
+        if updated:
+            bitmaps = animation.getBitmaps()
+            code = animation.getCode() if bitmaps is None else None
+            frame = (code, self.scheduledTime(animationTime()), bitmaps)
+
+        self.deadline = self.nextDeadline()
+        return frame
+
+    def swapAnimation(self):
+        """
+        Called holding the lock. Make the queued animation the current one
+        and start it. Return True if updated
+        It's timed from when the old one ended, so the two stay back to back
+        however late this runs. One queued after that is timed from then
+        """
+        start = self.queued_at
+        end_time = self.animation.endTime() if self.animation is not None else None
+        if end_time is not None and end_time > start:
+            start = end_time
+
+        self.animation = self.next_animation
+        self.next_animation = None
+        self.swaps += 1
+        return self.animation.startAt(start)
+
+    def waitForDeadline(self, lead=0.0):
+        """Called holding the lock. Returns 'lead' before the deadline or when woken up"""
+        deadline = self.deadline - lead if self.deadline is not None else None
+        self.cv.wait(self.secondsUntil(deadline))
+
+    def outputHandler(self, out: ControllerOutput):
+        logger.info(f"Starting assembler output thread for {out.name}")
+        try:
+            while self.running:
+                frame = out.frames.getLatest()
+                if frame is not None:
+                    self.sendOnTime(out, *frame)
+        except Exception as e:
+            logger.error(f"Fatal error in assembler output thread for {out.name}: {e}")
+            traceback.print_exc()
+
+        logger.info(f"Exiting assembler output thread for {out.name}")
+
+    def outputTimed(self, code, scheduled, bitmaps=None):
+        """Output a frame due at 'scheduled' to every controller now, timing each"""
+        for out in self.outputs:
+            out.outputTimed(code, scheduled, bitmaps)
+
+    def sendOnTime(self, out:ControllerOutput, code, scheduled, bitmaps=None):
+        """
+        Output a frame to one controller its lead time before 'scheduled', so
+        it shows then. Called from the output thread, without the lock
+        """
+        clock = getClock()
+        send_at = scheduled - self.leadTime(out)
+        wait = send_at - clock.monotonic()
+        if wait > self.spin:
+            clock.sleep(wait - self.spin)
+        if self.spin:
+            ## Close enough. Don't give the thread up to the scheduler again
+            while clock.monotonic() < send_at:
+                pass
+
+        out.outputTimed(code, scheduled, bitmaps)
+
+    def timingStats(self) -> dict:
+        """
+        Per controller, the p50/p99/min/max of how late frames were sent
+        and how long sending took, in seconds, and how many were dropped
+        """
+        return {out.name: out.timingStats() for out in self.outputs}
+
+    def frameStats(self) -> dict:
+        """How many frames were made, and how many never reached the first controller"""
+        return self.outputs[0].frameStats()
+
+    def droppedFrames(self) -> Dict[str, int]:
+        """Per controller, frames that never reached it because it fell behind"""
+        return {out.name: out.dropped() for out in self.outputs}
+
     def animationDone(self):
         self.cv.acquire()
-        done = (self.animation is None or self.animation.done())
+        done = (self.animation is None or self.animation.done()) and self.next_animation is None
         self.cv.release()
         return done
 
@@ -70,6 +411,9 @@ class Assembler:
             return
 
         self.running = True
+        for out in self.outputs:
+            out.thread = threading.Thread(target=self.outputHandler, args=(out,))
+            out.thread.start()
         self.thread.start()
 
     def stop(self):
@@ -81,6 +425,11 @@ class Assembler:
         self.cv.notify_all()
         self.cv.release()
         self.thread.join()
+        for out in self.outputs:
+            out.frames.close()
+        for out in self.outputs:
+            if out.thread is not None:
+                out.thread.join()
         self.shutdown = True
 
     def __del__(self):
@@ -0,0 +1,190 @@
+"""
+Python model of the nixie control board firmware
+
+It speaks both the text command protocol and the binary frame protocol,
+and behaves like the serial port connected to the board, so a
+SerialController can be run and tested without hardware
+"""
+import threading
+from typing import List
+
+from pyxielib import frame_protocol as fp
+from pyxielib import tube_manager as tm
+
+
+class BoardEmulator:
+    HEADER = "Nixie tube command terminal\n"
+    PROMPT = "> "
+
+    def __init__(self, num_tubes=16, *, timeout=0.1):
+        """Reads wait up to 'timeout' seconds for data, like a serial port"""
+        self.num_tubes      = num_tubes
+        self.tubes: List[int] = [0]*num_tubes
+        self.timeout        = timeout
+        self.is_open        = True
+        self.paused         = False
+        self.lock           = threading.Lock()
+        self.cv             = threading.Condition(lock=self.lock)
+        self.frames_shown   = 0
+        self.bytes_received = 0
+        self.bytes_sent     = 0
+        self.pending        = bytearray()  ## Received and not yet handled
+        self.output         = bytearray()  ## Waiting to be read by the host
+        self.reply(self.HEADER + self.PROMPT)
+
+    ## Serial port interface, as seen from the host
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        with self.cv:
+            self.is_open = False
+            self.cv.notify_all()
+
+    def reset_input_buffer(self):
+        with self.cv:
+            self.output.clear()
+
+    def reset_output_buffer(self):
+        with self.cv:
+            self.pending.clear()
+
+    def write(self, data):
+        with self.cv:
+            self.bytes_received += len(data)
+            self.pending += data
+            if not self.paused:
+                self.process()
+            self.cv.notify_all()
+
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def read(self, size=1) -> bytes:
+        with self.cv:
+            self.cv.wait_for(lambda: len(self.output) >= size or not self.is_open, self.timeout)
+            data = bytes(self.output[:size])
+            del self.output[:size]
+            return data
+
+    def read_until(self, expected=b'\n') -> bytes:
+        """Everything up to and including 'expected', or all that is left on a timeout"""
+        with self.cv:
+            self.cv.wait_for(lambda: expected in self.output or not self.is_open, self.timeout)
+            end = self.output.find(expected)
+            size = len(self.output) if end < 0 else end + len(expected)
+            data = bytes(self.output[:size])
+            del self.output[:size]
+            return data
+
+    def readline(self) -> bytes:
+        return self.read_until(b'\n')
+
+    ## Test hooks
+
+    def pause(self):
+        """Stop handling received data, like a busy board"""
+        with self.cv:
+            self.paused = True
+
+    def resume(self):
+        with self.cv:
+            self.paused = False
+            self.process()
+            self.cv.notify_all()
+
+    ## Firmware
+
+    def reply(self, data):
+        data = data.encode('utf8') if isinstance(data, str) else data
+        self.bytes_sent += len(data)
+        self.output += data
+
+    def showTubes(self, bitmaps):
+        """Set the tubes, padding or cutting 'bitmaps' to the number of tubes"""
+        bitmaps = list(bitmaps[:self.num_tubes])
+        self.tubes = bitmaps + [0]*(self.num_tubes - len(bitmaps))
+        self.frames_shown += 1
+
+    def process(self):
+        """Handle every complete command and frame received"""
+        while self.pending:
+            if self.pending[0] == ord('\r'):
+                ## Left over from a "\n\r" line ending
+                del self.pending[0]
+            elif self.pending[0] in (fp.STX, fp.SOH):
+                if not self.processFrame():
+                    return
+            elif not self.processLine():
+                return
+
+    def processFrame(self) -> bool:
+        """Handle one binary frame or tube update. False if it hasn't been fully received yet"""
+        if len(self.pending) < fp.HEADER_SIZE:
+            return False
+
+        size = fp.packetSize(self.pending)
+        if len(self.pending) < size:
+            return False
+
+        packet = bytes(self.pending[:size])
+        del self.pending[:size]
+        try:
+            if packet[0] == fp.STX:
+                seq, bitmaps = fp.decodeFrame(packet)
+            else:
+                seq, tubes = fp.decodeTubes(packet)
+                bitmaps = list(self.tubes)
+                for tube, bitmap in tubes:
+                    if tube < self.num_tubes:
+                        bitmaps[tube] = bitmap
+        except fp.FrameProtocolError:
+            self.reply(fp.encodeNak(packet[1], fp.ERR_CHECKSUM))
+            return True
+
+        self.showTubes(bitmaps)
+        self.reply(fp.encodeAck(seq))
+        return True
+
+    def expire(self):
+        """
+        Drop a partly received frame, like the firmware does when the
+        rest of it doesn't arrive in time
+        """
+        with self.cv:
+            if self.pending and self.pending[0] in (fp.STX, fp.SOH):
+                seq = self.pending[1] if len(self.pending) > 1 else 0
+                self.pending.clear()
+                self.reply(fp.encodeNak(seq, fp.ERR_TIMEOUT))
+                self.cv.notify_all()
+
+    def processLine(self) -> bool:
+        """Handle one text command. False if it hasn't been fully received yet"""
+        end = self.pending.find(b'\n')
+        if end < 0:
+            return False
+
+        line = self.pending[:end].decode('utf8', errors='replace').rstrip('\r')
+        del self.pending[:end + 1]
+        if not line:
+            self.reply("\nNoop\n" + self.PROMPT)
+            return True
+
+        cmd, _, arg = line.partition(':')
+        if cmd != 'print':
+            self.reply("NAK: Unsupported command\n\n" + self.PROMPT)
+            return True
+
+        try:
+            bitmaps = tm.cmdDecodePrint(arg)
+        except tm.DecodeError as e:
+            self.reply(f"\nNAK: {e.what()}\n" + self.PROMPT)
+            return True
+
+        self.reply(f"Print: '{arg}'\n")
+        self.showTubes(bitmaps)
+        self.reply(self.PROMPT)
+        return True
@@ -0,0 +1,77 @@
+"""
+The clock that pyxielib reads the time from
+
+Animations, the Assembler and the Scheduler all ask the current clock
+for the time instead of calling the time module. Swapping in a
+VirtualClock with setClock() makes time move only when it's advanced,
+so hours of playback can be run in seconds with headless.HeadlessRunner
+"""
+import datetime as dt
+import time
+
+
+class Clock:
+    """Real time"""
+    virtual = False
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def time(self) -> float:
+        """Seconds since the epoch"""
+        return time.time()
+
+    def now(self) -> dt.datetime:
+        return dt.datetime.now()
+
+    def sleep(self, seconds:float):
+        time.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    """Time that stands still until advance() or sleep() is called"""
+    virtual = True
+
+    def __init__(self, start:dt.datetime=None):
+        """
+        'start' is the wall clock time to start at. The default is now.
+        monotonic() starts where the real one is, so anything timed
+        before the switch keeps making sense
+        """
+        self.epoch   = (start or dt.datetime.now()).timestamp()
+        self.start   = time.monotonic()
+        self.elapsed = 0.0
+
+    def monotonic(self) -> float:
+        return self.start + self.elapsed
+
+    def time(self) -> float:
+        return self.epoch + self.elapsed
+
+    def now(self) -> dt.datetime:
+        return dt.datetime.fromtimestamp(self.time())
+
+    def sleep(self, seconds:float):
+        self.advance(seconds)
+
+    def advance(self, seconds:float):
+        self.elapsed += max(0.0, seconds)
+
+    def advanceTo(self, monotonic:float):
+        """Move to the monotonic() time 'monotonic'. Time never goes backwards"""
+        self.advance(monotonic - self.monotonic())
+
+
+_clock: Clock = Clock()
+
+
+def getClock() -> Clock:
+    return _clock
+
+
+def setClock(clock:Clock=None) -> Clock:
+    """Use 'clock' from now on, or real time if None. Returns the clock it replaces"""
+    global _clock ## pylint: disable=global-statement
+    old = _clock
+    _clock = clock or Clock()
+    return old
@@ -0,0 +1,229 @@
+"""
+Compiled animations (.anc)
+
+A full frame animation rendered to bitmaps ahead of time. Playing one
+reads straight out of the memory mapped file, so a large show starts
+right away and no Frame objects are made
+
+Header:
+    "PXAC" | version:u8 | flags:u8 | tubes:u16 | frame_count:u32
+           | table_size:u32 | loop_delay:u32 | length:u64
+
+Then:
+    delays:  frame_count x u32
+    indices: frame_count x u32
+    table:   table_size x tubes x u16
+
+Times are in microseconds. Frame i is shown for delays[i] and its
+bitmaps are row indices[i] of the table. Identical frames share one row.
+Frames with fewer tubes than the widest are padded with blank tubes. With
+the LOOPED flag the animation restarts 'loop_delay' after its last frame
+is shown, like a LoopedFullFrameAnimation. Multi-byte values are big endian, like
+the frame protocol and frame log
+"""
+import logging
+import mmap
+import os
+import struct
+from typing import Dict, Tuple
+
+from pyxielib import tube_manager as tm
+from pyxielib.animation import (
+    Animation, FullFrameAnimation, LoopedFullFrameAnimation, TubeAnimation, animationTime,
+)
+from pyxielib.pyxieutil import PyxieError
+
+logger = logging.getLogger(__name__)
+
+MAGIC   = b"PXAC"
+VERSION = 1
+LOOPED  = 0x01
+
+HEADER = struct.Struct(">4sBBHIIIQ")
+U32    = struct.Struct(">I")
+
+
+class CompiledAnimationError(PyxieError):
+    pass
+
+
+def compileAnimation(animation:Animation, path):
+    """
+    Write 'animation' to 'path' as a compiled animation.
+    Works with any FullFrameAnimation, including a FileAnimation, or a TubeAnimation
+    """
+    looped = isinstance(animation, LoopedFullFrameAnimation)
+    loop_delay = animation.delay if looped else 0
+    if isinstance(animation, TubeAnimation):
+        animation = animation.toFullFrameAnimation()
+    if not isinstance(animation, FullFrameAnimation):
+        raise CompiledAnimationError(f"Can't compile a {animation.__class__.__name__}")
+
+    tubes = animation.tubeCount()
+    delays = []
+    indices = []
+    rows: Dict[Tuple[int, ...], int] = {}
+    for delay, full_frame in animation.frames:
+        bitmaps = tm.cmdDecodeArray(''.join(x.getCode() for x in full_frame.getFrames()))
+        if len(bitmaps) > tubes:
+            raise CompiledAnimationError(f"Frame '{full_frame}' has more tubes than the animation's {tubes}")
+
+        row = tuple(bitmaps) + (0,)*(tubes - len(bitmaps))
+        indices.append(rows.setdefault(row, len(rows)))
+        delays.append(round(delay*1e6))
+
+    if any(not 0 <= x <= 0xFFFFFFFF for x in delays + [round(loop_delay*1e6)]):
+        raise CompiledAnimationError("Frame delays must be between 0 and 4294 seconds")
+
+    row_format = struct.Struct(f">{tubes}H")
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, LOOPED if looped else 0, tubes, len(delays), len(rows),
+            round(loop_delay*1e6), sum(delays)))
+        f.write(struct.pack(f">{len(delays)}I", *delays))
+        f.write(struct.pack(f">{len(indices)}I", *indices))
+        for row in rows:
+            f.write(row_format.pack(*row))
+
+    logger.debug(f"Compiled {len(delays)} frames, {len(rows)} unique, to '{path}'")
+
+
+class CompiledAnimation(Animation):
+    """Plays a compiled animation from its memory mapped file"""
+    def __init__(self, path):
+        Animation.__init__(self)
+        self.path = path
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise CompiledAnimationError(f"'{path}' is too short to be a compiled animation")
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, flags, self.tubes, self.frame_count, self.table_size, loop_delay, length \
+            = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise CompiledAnimationError(f"'{path}' isn't a compiled animation")
+        if version != VERSION:
+            raise CompiledAnimationError(f"Compiled animation '{path}' is version {version}. "
+                f"Only version {VERSION} is supported")
+        if not self.frame_count:
+            raise CompiledAnimationError(f"Compiled animation '{path}' has no frames")
+
+        self.looped      = bool(flags & LOOPED)
+        self.loop_delay  = loop_delay/1e6
+        self.duration    = length/1e6
+        self.row         = struct.Struct(f">{self.tubes}H")
+        self.delays_at   = HEADER.size
+        self.indices_at  = self.delays_at + 4*self.frame_count
+        self.table_at    = self.indices_at + 4*self.frame_count
+        if size < self.table_at + self.row.size*self.table_size:
+            raise CompiledAnimationError(f"Compiled animation '{path}' is cut short")
+
+        self.reset()
+
+    def reset(self):
+        self.started     = False
+        self.start_time  = animationTime()
+        self.frame_index = 0
+        self.frame_end   = self.delay(0)  ## Offset from the start that the current frame ends at
+        self.loop_at     = None           ## When a finished loop restarts
+        self.last_update = self.start_time
+        self.bitmaps: Tuple[int, ...] = ()
+
+    def startAt(self, start_time:float):
+        """The first frame is shown now. Frames already due are caught up on the next update"""
+        updated = Animation.startAt(self, start_time)
+        self.start_time = start_time
+        return updated
+
+    def delay(self, index:int) -> float:
+        """How long frame 'index' is shown"""
+        return U32.unpack_from(self.map, self.delays_at + 4*index)[0]/1e6
+
+    def bitmapsAt(self, index:int) -> Tuple[int, ...]:
+        """The bitmaps of frame 'index'"""
+        row = U32.unpack_from(self.map, self.indices_at + 4*index)[0]
+        if row >= self.table_size:
+            raise CompiledAnimationError(f"Frame {index} of '{self.path}' points past the frame table")
+
+        return self.row.unpack_from(self.map, self.table_at + self.row.size*row)
+
+    def length(self):
+        return self.duration
+
+    def frameCount(self):
+        return self.frame_count
+
+    def tubeCount(self):
+        return self.tubes
+
+    def getBitmaps(self) -> Tuple[int, ...]:
+        return self.bitmaps
+
+    def getCode(self):
+        return tm.bitmapsToCode(self.getBitmaps())
+
+    def updateFrameSet(self):
+        """Update the frame set based upon the current time. Return True if updated"""
+        now = animationTime()
+        if self.loop_at is not None:
+            if now < self.loop_at:
+                return False
+            self.reset()
+
+        if not self.started:
+            self.started = True
+            self.start_time = now
+            self.last_update = now
+            self.bitmaps = self.bitmapsAt(0)
+            return True
+        if self.frame_index >= self.frame_count:
+            return False
+
+        ## Walk forward to the frame that belongs at 'now'. Frames that
+        ## were missed while the caller was late are skipped
+        elapsed = now - self.start_time
+        index = self.frame_index
+        while index < self.frame_count and self.frame_end <= elapsed:
+            index += 1
+            if index < self.frame_count:
+                self.frame_end += self.delay(index)
+
+        if index == self.frame_index:
+            return False
+
+        self.frame_index = index
+        if index >= self.frame_count:
+            ## The last frame stays up. A loop restarts 'loop_delay' after
+            ## the last frame was shown, or right away if that's passed
+            if self.looped:
+                self.loop_at = self.last_update + self.loop_delay
+                return self.updateFrameSet()
+            return False
+
+        self.last_update = now
+        self.bitmaps = self.bitmapsAt(index)
+        return True
+
+    def nextDeadline(self):
+        """End time of the current frame, or when a loop restarts. None after the last frame"""
+        if not self.started:
+            return 0.0
+        if self.loop_at is not None:
+            return self.loop_at
+        if self.frame_index >= self.frame_count:
+            return None
+
+        return self.start_time + self.frame_end
+
+    def endTime(self):
+        """End time of the last frame. None until started, or if looped"""
+        if not self.started or self.looped:
+            return None
+
+        return self.start_time + self.duration
+
+    def done(self):
+        return (not self.looped and self.frame_index >= self.frame_count)
+
+    def close(self):
+        self.map.close()
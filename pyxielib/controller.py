@@ -1,11 +1,24 @@
+import importlib
 import logging
+import struct
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
 
 from pyxielib import decoder
+from pyxielib import frame_protocol as fp
+from pyxielib.frame_log import DEFAULT_KEYFRAME_INTERVAL, FrameLogWriter
 from pyxielib import tube_manager as tm
-from pyxielib.pyxieutil import PyxieError
+from pyxielib.pyxieutil import PyxieError, PyxieUnimplementedError
 
 logger = logging.getLogger(__name__)
 
+## Where the spidev driver reports its transfer size limit, and its default
+SPIDEV_BUFSIZ = '/sys/module/spidev/parameters/bufsiz'
+SPIDEV_DEFAULT_BUFSIZ = 4096
+
 SERIAL_ENABLED = False
 try:
     import serial
@@ -23,23 +36,51 @@ class ControllerError(PyxieError):
 class Controller:
     def __init__(self):
         self.enabled = True
+        ## Bumped whenever the display may no longer show the last frame sent
+        self.resets  = 0
 
     def send(self, code):
         pass
 
+    def acceptsPartialUpdates(self) -> bool:
+        """Whether sendTubes() can be used instead of send()"""
+        return False
+
+    def sendTubes(self, bitmaps, changed):
+        """
+        Show the decoded frame 'bitmaps', where only the tubes at the
+        indexes in 'changed' differ from the last frame sent
+        """
+        raise PyxieUnimplementedError(self)
+
     def enable(self):
         self.enabled = True
 
     def disable(self):
         self.enabled = False
+        self.resets += 1
 
 
 class TerminalController(Controller):
-    def __init__(self, *, clear_screen=False, print_code=False, verbose=False):
+    ## Cursor-addressed output is drawn starting at the top left of the screen
+    NUM_ROWS = 6
+
+    def __init__(self, *, clear_screen=False, print_code=False, verbose=False, incremental=False, stream=None):
+        """
+        With 'incremental' the screen is only cleared and fully drawn for the
+        first frame. After that only the cells of tubes that changed are
+        rewritten, using cursor addressing
+        'stream' defaults to sys.stdout
+        """
         Controller.__init__(self)
-        self.clear_screen = (clear_screen and not print_code)
-        self.print_code   = print_code
-        self.verbose      = verbose
+        self.clear_screen   = (clear_screen and not print_code)
+        self.print_code     = print_code
+        self.verbose        = verbose
+        self.incremental    = (incremental and not print_code)
+        self.stream         = stream
+        self.last_bitmaps   = None
+        self.bytes_written  = 0
+        self.frames_written = 0
 
     @staticmethod
     def clearScreen():
@@ -54,26 +95,140 @@ class TerminalController(Controller):
     def disable(self):
         if self.enabled and self.verbose:
             logger.info("Terminal disabled")
-        if self.clear_screen:
-            self.clearScreen()
+        if self.clear_screen or self.incremental:
+            self.write("\033[2J\n")
+        self.last_bitmaps = None
         Controller.disable(self)
 
+    def write(self, text):
+        """Write a whole frame to the terminal at once"""
+        if not text:
+            return
+
+        stream = self.stream or sys.stdout
+        stream.write(text)
+        stream.flush()
+        self.bytes_written += len(text.encode('utf8'))
+
     def send(self, code):
         if not self.enabled:
             return
 
-        if self.clear_screen:
-            self.clearScreen()
-
         if self.print_code:
-            print(f"Print: '{code}'")
+            self.frames_written += 1
+            self.write(f"Print: '{code}'\n")
+        else:
+            self.sendTubes(tm.cachedDecodePrint(code), None)
+
+    def acceptsPartialUpdates(self) -> bool:
+        return not self.print_code
+
+    def sendTubes(self, bitmaps, changed):
+        if not self.enabled:
+            return
+
+        self.frames_written += 1
+        if self.incremental:
+            self.write(self.renderChanges(bitmaps, changed))
         else:
-            print(decoder.bitmapsToDecodedStr(tm.cmdDecodePrint(code), buffer=1))
+            prefix = "\033[2J\n" if self.clear_screen else ''
+            self.write(prefix + decoder.bitmapsToDecodedStr(bitmaps, buffer=1) + "\n")
+
+    def renderChanges(self, bitmaps, changed=None):
+        """
+        Terminal output that turns the last frame drawn into 'bitmaps'
+        'changed' are the indexes of the tubes that differ, if known
+        Redraws everything when there is no usable last frame
+        """
+        last = self.last_bitmaps
+        self.last_bitmaps = bitmaps
+        full = "\033[2J\033[H" + decoder.bitmapsToDecodedStr(bitmaps, buffer=1) + "\n"
+        if last is None or len(last) != len(bitmaps):
+            return full
+
+        if changed is None:
+            changed = [i for i, (a, b) in enumerate(zip(last, bitmaps)) if a != b]
+        changed = set(changed)
+
+        glyphs = [decoder.glyphLines(b, buffer=1) for b in bitmaps]
+        out = []
+        col = 1
+        index = 0
+        while index < len(bitmaps):
+            if index not in changed:
+                col += len(glyphs[index][0])
+                index += 1
+                continue
+
+            ## Redraw the whole run of adjacent changed tubes with one cursor
+            ## move per row. A tube that gains or loses a colon changes width,
+            ## which moves every tube after it, so the rest of the row is redrawn
+            end = index + 1
+            while end < len(bitmaps) and end in changed:
+                end += 1
+            if any(len(glyphs[i][0]) != len(decoder.glyphLines(last[i], buffer=1)[0]) for i in range(index, end)):
+                end = len(bitmaps)
+
+            for row in range(self.NUM_ROWS):
+                line = ''.join(glyph[row] for glyph in glyphs[index:end])
+                clear = "\033[K" if end == len(bitmaps) else ''
+                out.append(f"\033[{row + 1};{col}H{line}{clear}")
+
+            col += sum(len(glyph[0]) for glyph in glyphs[index:end])
+            index = end
+
+        if not out:
+            return ''
+
+        ## Park the cursor where a full redraw would have left it
+        out.append(f"\033[{self.NUM_ROWS + 2};1H")
+        changes = ''.join(out)
+
+        ## When most tubes changed the cursor moves cost more than they save
+        return changes if len(changes) < len(full) else full
+
+
+class RecordingController(Controller):
+    """
+    Appends every frame it's sent to a frame log, to replay later with
+    frame_log.ReplayAnimation. Use it with other controllers to record
+    what they show
+    """
+    def __init__(self, path, *, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+        Controller.__init__(self)
+        self.log = FrameLogWriter(path, keyframe_interval=keyframe_interval)
+
+    def send(self, code):
+        self.log.write(tm.cachedDecodePrint(code))
+
+    def acceptsPartialUpdates(self) -> bool:
+        return True
+
+    def sendTubes(self, bitmaps, changed):
+        ## The log works out the changes itself
+        self.log.write(bitmaps)
+
+    def close(self):
+        self.log.close()
 
 
 class SerialController(Controller):
-    def __init__(self, port:str, *, baud:int=115200, timeout:int=5, endl="\n\r", debug=False):
-        if not SERIAL_ENABLED:
+    ## Number of round trip latencies kept for latencyStats()
+    LATENCY_HISTORY = 256
+
+    def __init__(self, port:str, *, baud:int=115200, timeout:int=5, endl="\n\r", debug=False, \
+            binary=False, connection=None, pipelined=False, window=4):
+        """
+        With 'binary' frames are sent as decoded bitmaps using the binary
+        frame protocol instead of 'print' commands
+        'connection' is an already open serial port like object to use
+        instead of opening 'port'
+        With 'pipelined' send() never waits on the board. A writer thread
+        keeps up to 'window' frames in flight and only the newest frame
+        waiting to be written is kept. Text commands are always sent one
+        at a time, as the board handles one command at a time
+        """
+        if connection is None and not SERIAL_ENABLED:
             raise PyxieError("Cannot start a SerialController as the 'serial' module is missing")
 
         Controller.__init__(self)
@@ -82,15 +237,41 @@ class SerialController(Controller):
         self.timeout   = timeout
         self.endl      = endl
         self.debug     = debug
-        self.serial    = serial.Serial(self.port, self.baud, timeout=self.timeout)
+        self.binary    = binary
+        self.serial    = connection or serial.Serial(self.port, self.baud, timeout=self.timeout)
         self.on_prompt = False
         self.prompt    = '> '
+        self.seq       = 0
+        self.resync    = True   ## The board's tubes aren't known, so send whole frames
+
+        ## Pipelining
+        self.pipelined      = pipelined
+        self.window         = max(1, window) if binary else 1
+        self.running        = False
+        self.lock           = threading.Lock()
+        self.cv             = threading.Condition(lock=self.lock)
+        self.writer         = threading.Thread(target=self.writeHandler)
+        self.reader         = threading.Thread(target=self.readHandler)
+        self.next_code      = None
+        self.in_flight      = OrderedDict()  ## seq -> time sent, oldest first
+        self.latencies      = deque(maxlen=self.LATENCY_HISTORY)
+        self.frames_sent    = 0
+        self.frames_acked   = 0
+        self.frames_dropped = 0 ## Superseded before being written
+        self.frames_lost    = 0 ## Nacked or never answered
 
         ## Check for header
         header = self.readline()
         if header != 'Nixie tube command terminal':
             raise ControllerError("Didn't find 'nixie tube' control board header")
 
+        ## Binary frames aren't answered with a prompt, so consume the first one now
+        if (self.binary or self.pipelined) and not self.findPrompt():
+            raise ControllerError("Can't find Nixie controller prompt")
+
+        if self.pipelined:
+            self.start()
+
     def opened(self) -> bool:
         return self.serial.is_open
 
@@ -128,6 +309,14 @@ class SerialController(Controller):
         return self.on_prompt
 
     def send(self, code):
+        if self.pipelined:
+            self.queueCode(code)
+            return
+
+        if self.binary:
+            self.sendFrame(code)
+            return
+
         if not self.findPrompt():
             self.close()
             raise ControllerError("Can't find Nixie controller prompt")
@@ -143,15 +332,275 @@ class SerialController(Controller):
         if self.debug:
             logger.debug(f"Read '{line}'")
 
+    def acceptsPartialUpdates(self) -> bool:
+        ## Pipelined frames can be dropped, which a tube update can't survive
+        return self.binary and not self.pipelined
+
+    def sendTubes(self, bitmaps, changed):
+        """Send only the tubes that changed, unless a whole frame is as small"""
+        if not self.acceptsPartialUpdates():
+            raise ControllerError("SerialController only accepts tube updates in binary mode without pipelining")
+
+        if changed is None or self.resync or fp.tubesSize(len(changed)) >= fp.frameSize(len(bitmaps)):
+            packet = fp.encodeFrame(bitmaps, self.seq)
+        else:
+            packet = fp.encodeTubes(((x, bitmaps[x]) for x in changed), self.seq)
+
+        seq = self.nextSeq()
+        if self.debug:
+            logger.debug(f"Frame {seq} {len(packet)} bytes")
+
+        self.serial.write(packet)
+        self.serial.flush()
+        self.readReply(seq)
+
+    def nextSeq(self) -> int:
+        seq = self.seq
+        self.seq = (self.seq + 1) & 0xFF
+        return seq
+
+    def writeCode(self, code, seq):
+        """Write one frame or command without waiting for the reply"""
+        if self.binary:
+            msg = fp.encodeFrame(tm.cachedDecodePrint(code), seq)
+        else:
+            msg = f"print:{code}{self.endl}".encode('utf8')
+
+        if self.debug:
+            logger.debug(f"Frame {seq} '{code}' {len(msg)} bytes")
+
+        self.serial.write(msg)
+        self.serial.flush()
+
+    def sendFrame(self, code):
+        """Send the decoded bitmaps as one binary frame and wait for the reply"""
+        seq = self.nextSeq()
+        self.writeCode(code, seq)
+        self.readReply(seq)
+
+    def readFrameReply(self):
+        """
+        The (seq, error) of the next reply to a binary frame, where error
+        is None for an ACK. None if no reply arrived in time
+        """
+        reply = self.serial.read(fp.ACK_SIZE)
+        if not reply:
+            return None
+        if len(reply) < fp.ACK_SIZE:
+            reply += self.serial.read(fp.ACK_SIZE - len(reply))
+
+        if len(reply) == fp.ACK_SIZE and reply[0] == fp.ACK:
+            return (reply[1], None)
+
+        if len(reply) == fp.ACK_SIZE and reply[0] == fp.NAK:
+            error = self.serial.read(1)
+            return (reply[1], error[0] if error else None)
+
+        ## Out of sync. Throw away whatever else is waiting
+        self.serial.reset_input_buffer()
+        raise fp.FrameProtocolError(f"Unexpected reply from Nixie controller: {reply!r}")
+
+    def readReply(self, seq):
+        ## Until the frame is known to be shown, the next one can't be a tube update
+        self.resync = True
+        try:
+            reply = self.readFrameReply()
+        except fp.FrameProtocolError as e:
+            logger.warning(e.what())
+            return
+
+        if reply is None:
+            self.close()
+            raise ControllerError(f"No reply from Nixie controller for frame {seq}")
+
+        reply_seq, error = reply
+        if error is not None:
+            logger.warning(f"Nixie controller dropped frame {reply_seq}: {fp.errorName(error)}")
+        elif reply_seq != seq:
+            logger.warning(f"Nixie controller acknowledged frame {reply_seq}, expected {seq}")
+        else:
+            self.resync = False
+
+    ## Pipelining
+
+    def queueCode(self, code):
+        """Make 'code' the next frame written, replacing any frame still waiting"""
+        self.cv.acquire()
+        if self.next_code is not None:
+            self.frames_dropped += 1
+        self.next_code = code
+        self.cv.notify_all()
+        self.cv.release()
+
+    def acknowledge(self, seq, error=None):
+        """Handle the reply to frame 'seq'. Frames sent before it were never answered"""
+        now = time.monotonic()
+        self.cv.acquire()
+        if seq is None and self.in_flight:
+            ## Text replies are in order
+            seq = next(iter(self.in_flight))
+
+        if seq in self.in_flight:
+            while True:
+                sent_seq, sent = self.in_flight.popitem(last=False)
+                if sent_seq == seq:
+                    break
+                self.frames_lost += 1
+
+            if error is None:
+                self.frames_acked += 1
+                self.latencies.append(now - sent)
+                if self.debug:
+                    logger.debug(f"Frame {seq} round trip {(now - sent)*1000:.1f} ms")
+            else:
+                self.frames_lost += 1
+                logger.warning(f"Nixie controller dropped frame {seq}: {fp.errorName(error)}")
+
+        self.cv.notify_all()
+        self.cv.release()
+
+    def expireInFlight(self, now):
+        """Give up on frames that haven't been answered in time. Returns the seconds until the next expiry"""
+        wait = None
+        expired = False
+        while self.in_flight:
+            seq, sent = next(iter(self.in_flight.items()))
+            if now - sent < self.timeout:
+                wait = sent + self.timeout - now
+                break
+
+            del self.in_flight[seq]
+            self.frames_lost += 1
+            expired = True
+            logger.warning(f"No reply from Nixie controller for frame {seq}")
+
+        ## The window has room again, and waitForReplies may be done
+        if expired:
+            self.cv.notify_all()
+
+        return wait
+
+    def writeHandler(self):
+        self.cv.acquire()
+        logger.info("Starting serial writer thread")
+        try:
+            while self.running:
+                wait = self.expireInFlight(time.monotonic())
+                if self.next_code is None or len(self.in_flight) >= self.window:
+                    self.cv.wait(wait)
+                    continue
+
+                code = self.next_code
+                self.next_code = None
+                seq = self.nextSeq()
+                self.in_flight[seq] = time.monotonic()
+                self.frames_sent += 1
+
+                ## Replies are handled by the reader thread while writing
+                self.cv.release()
+                try:
+                    self.writeCode(code, seq)
+                finally:
+                    self.cv.acquire()
+        except Exception as e:
+            logger.error(f"Fatal error in serial writer thread: {e}")
+            traceback.print_exc()
+
+        self.cv.release()
+        logger.info("Exiting serial writer thread")
+
+    def readHandler(self):
+        logger.info("Starting serial reader thread")
+        try:
+            while self.running:
+                if self.binary:
+                    try:
+                        reply = self.readFrameReply()
+                    except fp.FrameProtocolError as e:
+                        logger.warning(e.what())
+                        continue
+
+                    if reply is not None:
+                        self.acknowledge(*reply)
+                elif self.serial.read_until(self.prompt.encode('utf8')).endswith(self.prompt.encode('utf8')):
+                    self.acknowledge(None)
+        except Exception as e:
+            if self.running:
+                logger.error(f"Fatal error in serial reader thread: {e}")
+                traceback.print_exc()
+
+        logger.info("Exiting serial reader thread")
+
+    def waitForReplies(self, timeout=None) -> bool:
+        """Wait until every frame written has been answered. False on a timeout"""
+        self.cv.acquire()
+        done = self.cv.wait_for(lambda: self.next_code is None and not self.in_flight, timeout)
+        self.cv.release()
+        return done
+
+    def latencyStats(self) -> dict:
+        """Round trip latency, in seconds, of the recently acknowledged frames"""
+        self.cv.acquire()
+        latencies = list(self.latencies)
+        stats = {
+            'sent':    self.frames_sent,
+            'acked':   self.frames_acked,
+            'dropped': self.frames_dropped,
+            'lost':    self.frames_lost,
+            'last':    latencies[-1] if latencies else None,
+            'mean':    sum(latencies)/len(latencies) if latencies else None,
+            'max':     max(latencies) if latencies else None,
+        }
+        self.cv.release()
+        return stats
+
+    def start(self):
+        if self.running:
+            return
+
+        self.running = True
+        self.writer.start()
+        self.reader.start()
+
+    def stop(self):
+        if not self.running:
+            return
+
+        self.running = False
+        self.cv.acquire()
+        self.cv.notify_all()
+        self.cv.release()
+        self.writer.join()
+        self.reader.join()
+
+
+def spiTransferLimit() -> int:
+    """Largest single transfer the spidev driver accepts"""
+    try:
+        with open(SPIDEV_BUFSIZ, encoding='utf8') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return SPIDEV_DEFAULT_BUFSIZ
+
 
 class RaspberryPiController(Controller):
     def __init__(self, *, num_tubes=16, oe_pin=29, hv_pin=13, strobe_pin=15, \
-            spi_ctrl=0, device=0, mode=2, speed=100000, \
-            debug=False, print_code=False, cleanup=True):
-        """Controller for directly using the RasPis output pins"""
+            spi_ctrl=0, device=0, mode=2, speed=100000, max_transfer=None, strobe_latch=False, \
+            debug=False, print_code=False, cleanup=True, spi_module=None, gpio_module=None):
+        """
+        Controller for directly using the RasPis output pins
+        Any number of daisy chained tubes is supported. Frames longer than
+        'max_transfer' bytes, by default the spidev driver's limit, are
+        sent in chunks
+        While a frame is shifted in the tubes are blanked with the output
+        enable pin. With 'strobe_latch' the strobe is held low instead,
+        so the last frame stays lit until the new one is latched
+        'spi_module' and 'gpio_module' replace the 'spidev' and 'RPi.GPIO'
+        modules, such as with the fakes in fake_raspi
+        """
         try:
-            import spidev           ## pylint: disable=import-error
-            import RPi.GPIO as GPIO ## pylint: disable=import-error
+            spidev = spi_module or importlib.import_module('spidev')
+            GPIO = gpio_module or importlib.import_module('RPi.GPIO')
         except ImportError as e:
             raise ControllerError(f"Cannot instantiate a 'RaspberryPiController': {e}")
 
@@ -171,6 +620,17 @@ class RaspberryPiController(Controller):
         self.spi        = None
         self.hv_on      = False
 
+        ## Every frame is packed into the same buffer, last tube first
+        self.frame_struct = struct.Struct(f">{self.num_tubes}H")
+        self.frame_buffer = bytearray(self.frame_struct.size)
+        self.last_frame   = None
+        self.max_transfer = max_transfer or spiTransferLimit()
+        self.strobe_latch = strobe_latch
+        view = memoryview(self.frame_buffer)
+        self.frame_chunks = [view[x:x + self.max_transfer] for x in range(0, len(view), self.max_transfer)]
+        self.frames_sent    = 0
+        self.frames_skipped = 0
+
         ## Setup GPIO
         GPIO.setmode(GPIO.BOARD)
         GPIO.setwarnings(False)
@@ -188,6 +648,9 @@ class RaspberryPiController(Controller):
         self.spi.max_speed_hz = self.speed
         self.spi.mode = self.mode
 
+        ## Older spidev versions can only send lists
+        self.spi_write = getattr(self.spi, 'writebytes2', None)
+
         self.enable()
 
     def enable(self):
@@ -232,28 +695,41 @@ class RaspberryPiController(Controller):
         except:
             pass
 
+    def packFrame(self, code) -> bytearray:
+        """Pack the bitmaps of 'code' into the frame buffer, padded or cut to the number of tubes"""
+        bitmaps = tm.cachedDecodePrint(code)
+        if len(bitmaps) != self.num_tubes:
+            bitmaps = bitmaps[:self.num_tubes] + (0,)*(self.num_tubes - len(bitmaps))
+
+        ## The first tube is the last one shifted out
+        self.frame_struct.pack_into(self.frame_buffer, 0, *reversed(bitmaps))
+        return self.frame_buffer
+
     def spiSend(self, code):
-        bitmaps = tm.cmdDecodePrint(code)
-
-        ## Correct number of tubes
-        if len(bitmaps) > self.num_tubes:
-            data = bitmaps[:16] ## Take left most 16 tubes
-        elif len(bitmaps) < self.num_tubes:
-            missing = 16 - len(bitmaps)
-            bitmaps.extend([0]*missing)
-
-        data = []
-        ## Send the data in reverse order
-        for bitmap in reversed(bitmaps):
-            msb = (bitmap >> 8) & 0xFF
-            lsb = bitmap & 0xFF
-            data += [msb, lsb]
-
-        enabled = self.enabled
-        self.disable(hv_off=False)
-        self.spi.xfer(data)
-        if enabled:
-            self.enable()
+        frame = self.packFrame(code)
+        if frame == self.last_frame:
+            self.frames_skipped += 1
+            return
+
+        ## No chunk is shown until the whole chain has been shifted
+        if self.strobe_latch:
+            self._GPIO.output(self.strobe_pin, False)
+        else:
+            self._GPIO.output(self.oe_pin, False)
+
+        for chunk in self.frame_chunks:
+            if self.spi_write is not None:
+                self.spi_write(chunk)
+            else:
+                self.spi.xfer(list(chunk))
+
+        if self.strobe_latch:
+            self._GPIO.output(self.strobe_pin, True)
+        elif self.enabled:
+            self._GPIO.output(self.oe_pin, True)
+
+        self.last_frame = bytes(frame)
+        self.frames_sent += 1
 
     def __del__(self):
         self.spi.close()
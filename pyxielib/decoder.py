@@ -136,16 +136,31 @@ def bitmapToDecodedChar(bitmap):
     return "\n".join(bitmapToLines(bitmap)) + "\n"
 
 
+## Rendered lines of each bitmap, filled lazily. One table per buffer width
+_glyph_cache = {}
+
+
+def glyphLines(bitmap, buffer=0):
+    """The rendered lines of a bitmap, padded by 'buffer' spaces when it has no colon"""
+    table = _glyph_cache.setdefault(buffer, {})
+    lines = table.get(bitmap)
+    if lines is None:
+        lines = bitmapToLines(bitmap)
+        if buffer:
+            lines = [line + " "*buffer if len(line) <= 5 else line for line in lines]
+        lines = tuple(lines)
+        table[bitmap] = lines
+
+    return lines
+
+
 def bitmapsToDecodedStr(bitmaps, buffer=0):
-    bitmap_lines = [bitmapToLines(b) for b in bitmaps]
-    out_lines = [""] * 6
-    for lines in bitmap_lines:
-        for i, line in enumerate(lines):
-            out_lines[i] += line
-            if buffer and len(line) <= 5:
-               out_lines[i] += " "*buffer
-
-    return "\n".join(out_lines) + "\n"
+    glyphs = [glyphLines(b, buffer) for b in bitmaps]
+    if not glyphs:
+        return "\n"*6
+
+    ## Build each output row with a single join
+    return "\n".join(map(''.join, zip(*glyphs))) + "\n"
 
 
 def strToDecodedStr(s):
@@ -0,0 +1,108 @@
+"""
+Stand ins for the 'spidev' and 'RPi.GPIO' modules
+
+They record what a RaspberryPiController does with the pins and the SPI
+bus, so it can be tested and benchmarked on a normal Linux box
+"""
+import time
+from typing import Dict, List
+
+
+class FakeSpiDev:
+    def __init__(self, *, bufsiz=4096, simulate_timing=False):
+        """
+        'bufsiz' is the spidev driver's transfer limit
+        With 'simulate_timing' transfers take as long as they would on the wire
+        """
+        self.bufsiz          = bufsiz
+        self.simulate_timing = simulate_timing
+        self.max_speed_hz    = 500000
+        self.mode            = 0
+        self.is_open         = False
+        self.transfers: List[bytes] = []
+        self.bytes_written   = 0
+        self.keep_transfers  = True
+
+    def open(self, bus, device):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def _transfer(self, data):
+        if not self.is_open:
+            raise OSError("SPI device isn't open")
+
+        data = bytes(data)
+        if self.keep_transfers:
+            self.transfers.append(data)
+        self.bytes_written += len(data)
+        if self.simulate_timing:
+            time.sleep(8*len(data)/self.max_speed_hz)
+
+    def xfer(self, data):
+        if len(data) > self.bufsiz:
+            raise OverflowError(f"Argument list size exceeds {self.bufsiz} bytes")
+
+        self._transfer(data)
+        return [0]*len(data)
+
+    def writebytes(self, data):
+        if len(data) > self.bufsiz:
+            raise OverflowError(f"Argument list size exceeds {self.bufsiz} bytes")
+
+        self._transfer(data)
+
+    def writebytes2(self, data):
+        ## The real driver splits large buffers itself
+        for start in range(0, len(data), self.bufsiz):
+            self._transfer(data[start:start + self.bufsiz])
+
+
+class FakeSpidev:
+    """The 'spidev' module"""
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.devices: List[FakeSpiDev] = []
+
+    def SpiDev(self): ## pylint: disable=invalid-name
+        device = FakeSpiDev(**self.kwargs)
+        self.devices.append(device)
+        return device
+
+
+class FakeGPIO:
+    """The 'RPi.GPIO' module"""
+    BOARD = 10
+    BCM   = 11
+    OUT   = 0
+    IN    = 1
+    LOW   = 0
+    HIGH  = 1
+
+    def __init__(self):
+        self.mode = None
+        self.pins: Dict[int, bool] = {}
+        self.changes: Dict[int, int] = {}
+        self.cleaned_up = False
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction):
+        self.pins.setdefault(pin, False)
+
+    def output(self, pin, value):
+        if pin not in self.pins:
+            raise RuntimeError(f"Pin {pin} hasn't been set up as an output")
+
+        value = bool(value)
+        if self.pins[pin] != value:
+            self.changes[pin] = self.changes.get(pin, 0) + 1
+        self.pins[pin] = value
+
+    def cleanup(self):
+        self.cleaned_up = True
@@ -0,0 +1,334 @@
+"""
+Compact binary log of the frames sent to a display
+
+Header:
+    "PXLG" | version:u8 | reserved:u8 | keyframe_interval:u16
+
+Then one record per frame:
+    KEYFRAME | dt:varint | count:u8 | count x bitmap:u16
+    DELTA    | dt:varint | count:u8 | count x (tube:u8, bitmap:u16)
+
+'dt' is the microseconds since the frame before, as an unsigned LEB128
+varint. A delta lists only the tubes that changed. A keyframe is
+written every 'keyframe_interval' frames, and whenever the tube count
+changes, so playback can start from any keyframe. Multi-byte values are
+big endian, like the frame protocol
+"""
+import bisect
+import logging
+import mmap
+import os
+import struct
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from pyxielib import frame_protocol as fp
+from pyxielib import tube_manager as tm
+from pyxielib.animation import Animation, PixieAnimationError, animationTime
+from pyxielib.clock import getClock
+from pyxielib.pyxieutil import PyxieError
+
+logger = logging.getLogger(__name__)
+
+MAGIC    = b"PXLG"
+VERSION  = 1
+KEYFRAME = 0x4B  ## 'K'
+DELTA    = 0x44  ## 'D'
+
+HEADER = struct.Struct(">4sBBH")
+TUBE   = struct.Struct(">BH")
+
+DEFAULT_KEYFRAME_INTERVAL = 64
+
+
+class FrameLogError(PyxieError):
+    pass
+
+
+def encodeVarint(value:int) -> bytes:
+    if value < 0:
+        raise FrameLogError(f"Can't encode negative value {value}")
+
+    data = bytearray()
+    while value >= 0x80:
+        data.append((value & 0x7F) | 0x80)
+        value >>= 7
+
+    data.append(value)
+    return bytes(data)
+
+
+def decodeVarint(data, offset:int) -> Tuple[int, int]:
+    """The (value, offset after it) of the varint at 'offset'"""
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise FrameLogError("Varint runs past the end of the log")
+
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return (value, offset)
+
+        shift += 7
+
+
+def encodeKeyframe(dt:int, bitmaps:Sequence[int]) -> bytes:
+    return bytes((KEYFRAME,)) + encodeVarint(dt) + bytes((len(bitmaps),)) + fp.packBitmaps(bitmaps)
+
+
+def encodeDelta(dt:int, bitmaps:Sequence[int], changed:Sequence[int]) -> bytes:
+    return bytes((DELTA,)) + encodeVarint(dt) + bytes((len(changed),)) \
+        + b''.join(TUBE.pack(x, bitmaps[x]) for x in changed)
+
+
+class FrameLogWriter:
+    def __init__(self, path, *, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+        """Starts a new log at 'path'. Every 'keyframe_interval' frames are written whole"""
+        if not 0 < keyframe_interval <= 0xFFFF:
+            raise FrameLogError(f"Keyframe interval must be between 1 and {0xFFFF}, not {keyframe_interval}")
+
+        self.path              = path
+        self.keyframe_interval = keyframe_interval
+        self.file              = open(path, 'wb')
+        self.last_bitmaps: Optional[Tuple[int, ...]] = None
+        self.last_time: Optional[float] = None
+        self.since_keyframe    = 0
+        self.frames            = 0
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0, keyframe_interval))
+
+    def write(self, bitmaps:Sequence[int], timestamp:float=None):
+        """Log a frame shown at monotonic time 'timestamp', or now"""
+        if self.file is None:
+            raise FrameLogError(f"Frame log '{self.path}' is closed")
+        if len(bitmaps) > fp.MAX_TUBES:
+            raise FrameLogError(f"Can't log {len(bitmaps)} tubes. The max is {fp.MAX_TUBES}")
+
+        if timestamp is None:
+            timestamp = getClock().monotonic()
+
+        dt = 0
+        if self.last_time is not None:
+            dt = max(0, round((timestamp - self.last_time)*1e6))
+            ## Keep the error from rounding from adding up
+            timestamp = self.last_time + dt/1e6
+
+        last = self.last_bitmaps
+        bitmaps = tuple(bitmaps)
+        if last is None or len(last) != len(bitmaps) or self.since_keyframe >= self.keyframe_interval:
+            self.file.write(encodeKeyframe(dt, bitmaps))
+            self.since_keyframe = 0
+            ## Whatever is written up to a keyframe survives a crash
+            self.file.flush()
+        else:
+            changed = [i for i, (a, b) in enumerate(zip(last, bitmaps)) if a != b]
+            self.file.write(encodeDelta(dt, bitmaps, changed))
+
+        self.since_keyframe += 1
+        self.frames += 1
+        self.last_bitmaps = bitmaps
+        self.last_time = timestamp
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FrameLogReader:
+    def __init__(self, path):
+        """Memory maps the log at 'path' and indexes its keyframes"""
+        self.path = path
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise FrameLogError(f"'{path}' is too short to be a frame log")
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, self.keyframe_interval = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise FrameLogError(f"'{path}' isn't a frame log")
+        if version != VERSION:
+            raise FrameLogError(f"Frame log '{path}' is version {version}. Only version {VERSION} is supported")
+
+        ## (timestamp, offset, frame number) of every keyframe
+        self.keyframes: List[Tuple[float, int, int]] = []
+        self.frame_count = 0
+        self.duration    = 0.0
+        self.end         = len(self.map)  ## Offset after the last whole record
+        self.index()
+
+    def readRecord(self, offset:int):
+        """
+        The (kind, dt, tubes, offset after it) of the record at 'offset'.
+        'tubes' is the bitmaps of a keyframe, or (tube, bitmap) pairs of a delta
+        """
+        data = self.map
+        start = offset
+        kind = data[offset]
+        dt, offset = decodeVarint(data, offset + 1)
+        if offset >= len(data):
+            raise FrameLogError("Record runs past the end of the log")
+
+        count = data[offset]
+        offset += 1
+        if kind == KEYFRAME:
+            size = 2*count
+            if offset + size > len(data):
+                raise FrameLogError("Keyframe runs past the end of the log")
+            return (kind, dt, fp.unpackBitmaps(data[offset:offset + size]), offset + size)
+        if kind == DELTA:
+            size = TUBE.size*count
+            if offset + size > len(data):
+                raise FrameLogError("Delta runs past the end of the log")
+            return (kind, dt, tuple(TUBE.iter_unpack(data[offset:offset + size])), offset + size)
+
+        raise FrameLogError(f"Unknown record type 0x{kind:02X} at offset {start}")
+
+    def index(self):
+        offset = HEADER.size
+        timestamp = 0
+        while offset < len(self.map):
+            try:
+                kind, dt, _, end = self.readRecord(offset)
+            except FrameLogError as e:
+                ## The recorder was likely stopped mid-write. Play what's whole
+                logger.warning(f"Frame log '{self.path}' is cut short at offset {offset}: {e}")
+                break
+
+            if self.frame_count == 0 and kind != KEYFRAME:
+                raise FrameLogError(f"Frame log '{self.path}' doesn't start with a keyframe")
+
+            timestamp += dt
+            if kind == KEYFRAME:
+                self.keyframes.append((timestamp/1e6, offset, self.frame_count))
+
+            self.frame_count += 1
+            offset = end
+
+        self.end = offset
+        self.duration = timestamp/1e6
+
+    def frames(self, start:float=0.0) -> Iterator[Tuple[float, Tuple[int, ...]]]:
+        """
+        The (timestamp, bitmaps) of each frame, timed from the first frame.
+        Starts at the last keyframe at or before 'start' seconds
+        """
+        if not self.keyframes:
+            return
+
+        first = max(0, bisect.bisect_right(self.keyframes, (start, len(self.map))) - 1)
+        timestamp, offset, _ = self.keyframes[first]
+        micros = round(timestamp*1e6)
+        ## The keyframe's time already includes its own 'dt'
+        _, _, tubes, offset = self.readRecord(offset)
+        bitmaps = list(tubes)
+        yield (micros/1e6, tuple(bitmaps))
+        while offset < self.end:
+            kind, dt, tubes, offset = self.readRecord(offset)
+            micros += dt
+            if kind == KEYFRAME:
+                bitmaps = list(tubes)
+            else:
+                for tube, bitmap in tubes:
+                    bitmaps[tube] = bitmap
+
+            yield (micros/1e6, tuple(bitmaps))
+
+    def close(self):
+        self.map.close()
+
+    def __len__(self):
+        return self.frame_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ReplayAnimation(Animation):
+    """Plays back a frame log with its original timing, sped up by 'speed'"""
+    def __init__(self, log, *, speed:float=1.0):
+        Animation.__init__(self)
+        if speed <= 0:
+            raise PixieAnimationError(f"Replay speed must be more than 0, not {speed}")
+
+        self.log: FrameLogReader = log if isinstance(log, FrameLogReader) else FrameLogReader(log)
+        self.speed = speed
+        self.reset()
+
+    def reset(self):
+        self.started    = False
+        self.start_time = animationTime()
+        self.frames: Iterator[Tuple[float, Tuple[int, ...]]] = iter(())
+        self.current: Optional[Tuple[float, Tuple[int, ...]]] = None
+        self.pending: Optional[Tuple[float, Tuple[int, ...]]] = None
+
+    def startAt(self, start_time:float):
+        """The first frame is shown now. Frames already due are caught up on the next update"""
+        updated = Animation.startAt(self, start_time)
+        self.start_time = start_time
+        return updated
+
+    def length(self):
+        return self.log.duration/self.speed
+
+    def tubeCount(self):
+        return len(self.current[1]) if self.current is not None else 0
+
+    def getBitmaps(self) -> Tuple[int, ...]:
+        return self.current[1] if self.current is not None else ()
+
+    def getCode(self):
+        return tm.bitmapsToCode(self.getBitmaps())
+
+    def updateFrameSet(self):
+        """Update the frame set based upon the current time. Return True if updated"""
+        now = animationTime()
+        if not self.started:
+            self.started = True
+            self.start_time = now
+            self.frames = self.log.frames()
+            self.current = next(self.frames, None)
+            self.pending = next(self.frames, None)
+            return (self.current is not None)
+
+        ## Frames that were missed while the caller was late are skipped
+        elapsed = (now - self.start_time)*self.speed
+        updated = False
+        while self.pending is not None and self.pending[0] <= elapsed:
+            self.current = self.pending
+            self.pending = next(self.frames, None)
+            updated = True
+
+        return updated
+
+    def nextDeadline(self):
+        """When the next logged frame is due. None after the last one"""
+        if not self.started:
+            return 0.0
+        if self.pending is None:
+            return None
+
+        return self.start_time + self.pending[0]/self.speed
+
+    def endTime(self):
+        if not self.started:
+            return None
+
+        return self.start_time + self.length()
+
+    def done(self):
+        return (self.started and self.pending is None)
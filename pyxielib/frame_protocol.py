@@ -0,0 +1,153 @@
+"""
+Binary frame protocol between the host and the nixie control board
+
+Frame, host -> board:
+    STX | seq:u8 | count:u8 | count x bitmap:u16 | crc:u16
+
+Tube update, host -> board:
+    SOH | seq:u8 | count:u8 | count x (tube:u8, bitmap:u16) | crc:u16
+Only the listed tubes change, the rest keep showing the last frame
+
+Reply, board -> host:
+    ACK | seq           Frame was shown
+    NAK | seq | error   Frame was dropped
+
+Multi-byte values are big endian. The crc is CRC-CCITT (poly 0x1021,
+init 0xFFFF) over everything between the start byte and the crc. Text commands never
+start with STX or SOH, so the board can accept both on the same link
+"""
+import binascii
+import struct
+import sys
+from array import array
+from typing import Iterable, Tuple
+
+from pyxielib.pyxieutil import PyxieError
+
+
+SOH = 0x01
+STX = 0x02
+ACK = 0x06
+NAK = 0x15
+
+MAX_TUBES   = 0xFF
+CRC_INIT    = 0xFFFF
+HEADER_SIZE = 3     ## STX or SOH, seq, count
+CRC_SIZE    = 2
+ACK_SIZE    = 2
+NAK_SIZE    = 3
+
+## NAK error codes
+ERR_CHECKSUM = 1
+ERR_TIMEOUT  = 2
+
+ERROR_NAMES = {
+    ERR_CHECKSUM: "Bad checksum",
+    ERR_TIMEOUT:  "Incomplete frame",
+}
+
+
+class FrameProtocolError(PyxieError):
+    pass
+
+
+def crc16(data, crc=CRC_INIT) -> int:
+    return binascii.crc_hqx(data, crc)
+
+
+def frameSize(count) -> int:
+    """Size in bytes of a frame carrying 'count' bitmaps"""
+    return HEADER_SIZE + 2*count + CRC_SIZE
+
+
+def tubesSize(count) -> int:
+    """Size in bytes of a tube update carrying 'count' tubes"""
+    return HEADER_SIZE + 3*count + CRC_SIZE
+
+
+def packetSize(header) -> int:
+    """Size in bytes of the frame or tube update starting with 'header'"""
+    return frameSize(header[2]) if header[0] == STX else tubesSize(header[2])
+
+
+def packBitmaps(bitmaps:Iterable[int]) -> bytes:
+    """Bitmaps as big endian uint16"""
+    data = array('H', bitmaps)
+    if sys.byteorder == 'little':
+        data.byteswap()
+
+    return data.tobytes()
+
+
+def unpackBitmaps(data) -> Tuple[int, ...]:
+    bitmaps = array('H')
+    bitmaps.frombytes(data)
+    if sys.byteorder == 'little':
+        bitmaps.byteswap()
+
+    return tuple(bitmaps)
+
+
+def encodeFrame(bitmaps, seq=0) -> bytes:
+    """Packet for showing 'bitmaps', one per tube"""
+    if len(bitmaps) > MAX_TUBES:
+        raise FrameProtocolError(f"Can't send {len(bitmaps)} tubes in one frame. The max is {MAX_TUBES}")
+
+    body = bytes((seq & 0xFF, len(bitmaps))) + packBitmaps(bitmaps)
+    return bytes((STX,)) + body + struct.pack('>H', crc16(body))
+
+
+def decodeFrame(packet) -> Tuple[int, Tuple[int, ...]]:
+    """The (seq, bitmaps) of a whole packet"""
+    if len(packet) < HEADER_SIZE + CRC_SIZE or packet[0] != STX:
+        raise FrameProtocolError("Not a frame packet")
+    if len(packet) != frameSize(packet[2]):
+        raise FrameProtocolError(f"Frame packet should be {frameSize(packet[2])} bytes, not {len(packet)}")
+
+    body = packet[1:-CRC_SIZE]
+    (crc,) = struct.unpack('>H', packet[-CRC_SIZE:])
+    if crc != crc16(body):
+        raise FrameProtocolError("Frame packet has a bad checksum")
+
+    return (body[0], unpackBitmaps(body[2:]))
+
+
+def encodeTubes(tubes, seq=0) -> bytes:
+    """Packet for changing only some tubes. 'tubes' is pairs of (tube, bitmap)"""
+    tubes = list(tubes)
+    if len(tubes) > MAX_TUBES:
+        raise FrameProtocolError(f"Can't send {len(tubes)} tubes in one update. The max is {MAX_TUBES}")
+
+    try:
+        body = struct.pack(f">BB{'BH'*len(tubes)}", seq & 0xFF, len(tubes), *(x for tube in tubes for x in tube))
+    except struct.error as e:
+        raise FrameProtocolError(f"Can't encode tube update: {e}")
+
+    return bytes((SOH,)) + body + struct.pack('>H', crc16(body))
+
+
+def decodeTubes(packet) -> Tuple[int, Tuple[Tuple[int, int], ...]]:
+    """The (seq, ((tube, bitmap), ...)) of a whole tube update packet"""
+    if len(packet) < HEADER_SIZE + CRC_SIZE or packet[0] != SOH:
+        raise FrameProtocolError("Not a tube update packet")
+    if len(packet) != tubesSize(packet[2]):
+        raise FrameProtocolError(f"Tube update packet should be {tubesSize(packet[2])} bytes, not {len(packet)}")
+
+    body = packet[1:-CRC_SIZE]
+    (crc,) = struct.unpack('>H', packet[-CRC_SIZE:])
+    if crc != crc16(body):
+        raise FrameProtocolError("Tube update packet has a bad checksum")
+
+    return (body[0], tuple(struct.iter_unpack('>BH', body[2:])))
+
+
+def encodeAck(seq) -> bytes:
+    return bytes((ACK, seq & 0xFF))
+
+
+def encodeNak(seq, error) -> bytes:
+    return bytes((NAK, seq & 0xFF, error))
+
+
+def errorName(error) -> str:
+    return ERROR_NAMES.get(error, f"Unknown error {error}")
@@ -0,0 +1,111 @@
+"""
+Run an Assembler, and optionally a Scheduler, on a virtual clock
+
+There are no threads and no waiting. The clock jumps straight to the
+next frame deadline or scheduler poll, so hours of playback take seconds
+and the frame timing comes out the same on every run
+"""
+import logging
+import time
+from typing import Callable, Optional
+
+from pyxielib.assembler import Assembler
+from pyxielib.clock import VirtualClock, setClock
+from pyxielib.pyxieutil import PyxieError
+
+logger = logging.getLogger(__name__)
+
+
+class HeadlessRunner:
+    ## Least the clock moves per step, so a deadline that's already
+    ## passed can't stop time
+    MIN_STEP = 1e-6
+
+    def __init__(self, assembler:Assembler, scheduler=None, *, clock:VirtualClock=None):
+        """
+        'scheduler' is polled every scheduler.period seconds of virtual time.
+        The virtual clock is used by all of pyxielib while running
+        """
+        if assembler.isRunning() or (scheduler is not None and scheduler.isRunning()):
+            raise PyxieError("Can't run headless while the assembler or scheduler threads are running")
+
+        self.assembler = assembler
+        self.scheduler = scheduler
+        self.clock     = clock or VirtualClock()
+        self.next_poll = None
+        self.frames    = 0
+        self.polls     = 0
+        self.virtual_seconds = 0.0
+        self.real_seconds    = 0.0
+
+    def step(self):
+        """Poll the scheduler if it's due, then update the animation and send any new frame"""
+        now = self.clock.monotonic()
+        if self.scheduler is not None and now >= self.next_poll:
+            self.scheduler.poll()
+            self.polls += 1
+            self.next_poll += self.scheduler.period
+
+        with self.assembler.lock:
+            frame = self.assembler.step()
+
+        ## Sending takes no virtual time, so frames go out at their deadlines
+        if frame is not None:
+            self.assembler.outputTimed(*frame)
+            self.frames += 1
+
+    def nextEvent(self) -> Optional[float]:
+        """Monotonic time of the next deadline or poll. None if nothing will ever happen"""
+        events = [self.assembler.deadline]
+        if self.scheduler is not None:
+            events.append(self.next_poll)
+
+        events = [x for x in events if x is not None]
+        return min(events, default=None)
+
+    def run(self, seconds:float=None, *, until:Callable[[], bool]=None) -> dict:
+        """
+        Run for 'seconds' of virtual time, until 'until()' is true, or until
+        nothing is left to happen, whichever is first. Returns stats
+        """
+        if seconds is None and until is None and self.scheduler is not None:
+            raise PyxieError("A headless run with a scheduler needs 'seconds' or 'until' to end")
+
+        old_clock = setClock(self.clock)
+        real_start = time.perf_counter()
+        start = self.clock.monotonic()
+        end = start + seconds if seconds is not None else None
+        if self.next_poll is None:
+            self.next_poll = start
+
+        try:
+            while True:
+                self.step()
+                if until is not None and until():
+                    break
+
+                event = self.nextEvent()
+                if event is None or (end is not None and event > end):
+                    if end is not None:
+                        self.clock.advanceTo(end)
+                    break
+
+                self.clock.advanceTo(max(event, self.clock.monotonic() + self.MIN_STEP))
+        finally:
+            setClock(old_clock)
+
+        elapsed = self.clock.monotonic() - start
+        real = time.perf_counter() - real_start
+        self.virtual_seconds += elapsed
+        self.real_seconds += real
+        logger.info(f"Ran {elapsed:.1f}s of playback in {real:.3f}s")
+        return self.stats()
+
+    def stats(self) -> dict:
+        return {
+            'virtual_seconds': self.virtual_seconds,
+            'real_seconds':    self.real_seconds,
+            'frames':          self.frames,
+            'polls':           self.polls,
+            'speedup':         self.virtual_seconds/self.real_seconds if self.real_seconds else None,
+        }
@@ -1,4 +1,3 @@
-import datetime
 import logging
 import re
 import time
@@ -7,6 +6,7 @@ import traceback
 import feedparser
 
 import pyxielib.animation_library as animationlib
+from pyxielib.clock import getClock
 
 logger = logging.getLogger(__name__)
 from pyxielib.animation import Animation, EmtpyAnimation, MarqueeAnimation, escapeText
@@ -122,7 +122,7 @@ class ClockProgram(Program):
     @staticmethod
     def formatDate(dateformat, dt=None):
         if dt is None:
-            dt = datetime.datetime.now()
+            dt = getClock().now()
         return dt.strftime(dateformat)
 
     def date(self):
@@ -1,5 +1,7 @@
 import inspect
 import logging
+import threading
+from collections import deque
 
 TRACE = 5
 logging.addLevelName(TRACE, 'TRACE')
@@ -56,3 +58,55 @@ def strToInt(num):
         return int(num, 8)
 
     return int(num)
+
+
+class LatestValueQueue:
+    """
+    Bounded queue between threads for values where only the newest
+    matters, like display frames. put() never blocks: when the queue is
+    full the oldest value is dropped. getLatest() takes the newest value
+    and skips the rest
+    """
+    def __init__(self, maxsize=1):
+        self.maxsize   = max(1, maxsize)
+        self.items     = deque()
+        self.lock      = threading.Lock()
+        self.cv        = threading.Condition(lock=self.lock)
+        self.closed    = False
+        self.puts      = 0
+        self.dropped   = 0  ## Pushed out of a full queue
+        self.coalesced = 0  ## Skipped over for a newer value
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item):
+        with self.cv:
+            if self.closed:
+                return
+
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+
+            self.items.append(item)
+            self.puts += 1
+            self.cv.notify_all()
+
+    def getLatest(self, timeout=None):
+        """The newest value. None on a timeout or once the queue is closed and empty"""
+        with self.cv:
+            self.cv.wait_for(lambda: self.items or self.closed, timeout)
+            if not self.items:
+                return None
+
+            item = self.items.pop()
+            self.coalesced += len(self.items)
+            self.items.clear()
+            return item
+
+    def close(self):
+        """Wake up and stop all readers"""
+        with self.cv:
+            self.closed = True
+            self.cv.notify_all()
@@ -1,6 +1,5 @@
 import datetime as dt
 import logging
-import time
 import threading
 import traceback
 from typing import List, Sequence
@@ -8,6 +7,7 @@ from typing import List, Sequence
 from croniter import croniter
 
 from pyxielib.assembler import Assembler
+from pyxielib.clock import getClock
 from pyxielib.program import Program
 
 logger = logging.getLogger(__name__)
@@ -48,28 +48,34 @@ class ScheduleEntry:
     def nextTimeStamp(self, now=None) -> float:
         """Returns the timestamp of the next event"""
         if now is None:
-            now = dt.datetimem.now()
+            now = getClock().now()
 
         return croniter(self.timecode, now, ret_type=dt.datetime).get_next()
 
     def nextTimeStamps(self, n, now=None) -> List[float]:
         """Returns list of the timestamps of the next n events"""
         if now is None:
-            now = dt.datetime.now()
+            now = getClock().now()
 
         return [croniter(self.timecode, now, ret_type=dt.datetime).get_next() for x in range(n)]
 
     def nextTimeSlot(self, now=None) -> TimeSlot:
         if now is None:
-            now = dt.datetime.now()
+            now = getClock().now()
 
         return TimeSlot(self.nextTimeStamp(now), self.program, self.priority)
 
 
 class Scheduler:
-    def __init__(self, assembler:Assembler, *, period:float=.1, user_menu:UserMenuProgram=None):
+    def __init__(self, assembler:Assembler, *, period:float=.1, lookahead:float=None, user_menu:UserMenuProgram=None):
+        """
+        The program is polled every 'period' seconds. It's also polled once
+        the current animation is less than 'lookahead' seconds from its end,
+        so the next animation can be queued and start without a gap
+        """
         self.assembler = assembler
         self.period    = period
+        self.lookahead = lookahead if lookahead is not None else 2*period
         self.user_menu = user_menu
         self.running   = False
         self.shutdown  = False
@@ -112,8 +118,11 @@ class Scheduler:
     def idle(self):
         """This is called when the current animation and program are done"""
 
-    def pollProgram(self):
-        """Check the current program to see if it has a new animation"""
+    def pollProgram(self, *, queue=False):
+        """
+        Check the current program to see if it has a new animation
+        With 'queue' the animation is played after the current one instead of right away
+        """
         ## Pick the program
         ## The user menu takes precident
         program = None
@@ -128,6 +137,10 @@ class Scheduler:
 
         ## Check to see if the program is done
         if program.done():
+            if queue:
+                ## Let the current animation finish first
+                return
+
             ## Clear the last animation and reset the program
             self.assembler.clearAnimation()
             program.reset()
@@ -135,28 +148,43 @@ class Scheduler:
         elif program.update():
             ## Get the next animation
             ani = program.getAnimation()
-            if ani is not None:
+            if ani is not None and queue:
+                self.assembler.queueAnimation(ani)
+            elif ani is not None:
                 self.assembler.setAnimation(ani)
 
+    def poll(self):
+        """One pass of the scheduler loop. Called every 'period' seconds"""
+        ## Poll the program if
+        ## - a new program has been scheduled
+        ## - the current animation has completed
+        ## - the user menu is reqeusting an interrupt
+        if self.checkSchedule() or self.assembler.animationDone() or (self.user_menu is not None and self.user_menu.interrupt()):
+            try:
+                self.pollProgram()
+            except KeyboardInterrupt:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to poll program: {e}")
+                traceback.print_exc()
+                self.idle()
+        elif self.assembler.needsNextAnimation(self.lookahead):
+            try:
+                self.pollProgram(queue=True)
+            except Exception as e:
+                logger.error(f"Failed to poll program for the next animation: {e}")
+                traceback.print_exc()
+
     def handler(self):
         """The main scheduler loop"""
         self.cv.acquire()
         logger.info("Starting scheduler thread")
         try:
             while self.running:
-                ## Poll the program if
-                ## - a new program has been scheduled
-                ## - the current animation has completed
-                ## - the user menu is reqeusting an interrupt
-                if self.checkSchedule() or self.assembler.animationDone() or (self.user_menu is not None and self.user_menu.interrupt()):
-                    try:
-                        self.pollProgram()
-                    except KeyboardInterrupt:
-                        break
-                    except Exception as e:
-                        logger.error(f"Failed to poll program: {e}")
-                        traceback.print_exc()
-                        self.idle()
+                try:
+                    self.poll()
+                except KeyboardInterrupt:
+                    break
 
                 self.cv.wait(self.period)
         except Exception as e:
@@ -179,7 +207,7 @@ class SingleProgramScheduler(Scheduler):
         return self.program
 
     def nextScheduledEntry(self) -> TimeSlot:
-        return (dt.datetime.now(), self.program)
+        return (getClock().now(), self.program)
 
     def checkSchedule(self):
         pass
@@ -198,7 +226,7 @@ class CronScheduler(Scheduler):
         return self.program
 
     def printSchedule(self):
-        now = dt.datetime.now()
+        now = getClock().now()
         logger.info("Cron Program Schedule")
         slots = sorted([entry.nextTimeSlot(now) for entry in self.schedule])
         for slot in slots:
@@ -212,13 +240,13 @@ class CronScheduler(Scheduler):
         if len(self.schedule) == 1:
             return self.schedule[0].nextTimeSlot()
 
-        now = dt.datetime.now()
+        now = getClock().now()
         slots = sorted([entry.nextTimeSlot(now) for entry in self.schedule if entry.program.ready()])
         return slots[0]
 
     def checkSchedule(self):
         """Return True if a new event should be started"""
-        if time.time() - self.last_update < 1:
+        if getClock().time() - self.last_update < 1:
             return False
 
         slot = self.nextScheduledEntry()
@@ -228,16 +256,16 @@ class CronScheduler(Scheduler):
             self.program = self.default if self.default is not None else slot.program
             logger.info(f"Starting with program '{self.program.name}'")
             self.program.reset()
-            self.last_update = time.time()
+            self.last_update = getClock().time()
             return True
 
         ## Update program if it's scheduled to run now
-        now = dt.datetime.now() + dt.timedelta(seconds=1) ## Ugly hack. Don't miss start of time slot
+        now = getClock().now() + dt.timedelta(seconds=1) ## Ugly hack. Don't miss start of time slot
         if slot.timestamp <= now and slot.program != self.program:
             logger.info(f"Switch to program '{name}'")
             self.program = slot.program
             self.program.reset()
-            self.last_update = time.time()
+            self.last_update = getClock().time()
             return True
 
         return False
@@ -4,13 +4,13 @@ import os
 import threading
 
 from dataclasses import dataclass
-from datetime import datetime
 
 import requests
 import bs4 as bs
 
 import pyxielib.animation_library as animationlib
 from pyxielib.animation import Animation, MarqueeAnimation
+from pyxielib.clock import getClock
 from pyxielib.program import Program
 
 logger = logging.getLogger(__name__)
@@ -96,21 +96,21 @@ def fetchStock(symbol, session, crumb, *, extended_hours=False) -> Stock:
 
 
 def isMarketOpen() -> bool:
-    now = datetime.now()
+    now = getClock().now()
     start = now.replace(hour=9, minute=30, second=0)
     end = now.replace(hour=16, second=0)
     return (start <= now < end)
 
 
 def isPreMarket() -> bool:
-    now = datetime.now()
+    now = getClock().now()
     start = now.replace(hour=4, minute=0, second=0)
     end = now.replace(hour=9, minute=30, second=0)
     return (start <= now < end)
 
 
 def isPostMarket() -> bool:
-    now = datetime.now()
+    now = getClock().now()
     start = now.replace(hour=16, minute=0, second=0)
     end = now.replace(hour=20, minute=0, second=0)
     return (start <= now < end)
@@ -195,7 +195,7 @@ class StockTicker(Program):
         return (self.running and self.stocks and active)
 
     def clearStocks(self):
-        now = datetime.now()
+        now = getClock().now()
         if self.extended_hours:
             start = now.replace(hour=4, minute=0, second=0)
         else:
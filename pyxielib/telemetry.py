@@ -0,0 +1,168 @@
+"""
+Frame timing telemetry
+
+Everything here is fixed size and recording is a few integer operations,
+so it can stay on in the output path
+"""
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+
+class HdrHistogram:
+    """
+    Log-linear histogram of durations, in the style of HdrHistogram
+
+    Values are counted in microseconds. Below 2**precision they are exact,
+    above that every power of two is split into 2**(precision - 1) buckets,
+    so any value is known to within about 2**(1 - precision). Negative
+    values, like a frame sent early, are counted in mirrored buckets
+    """
+    def __init__(self, *, precision=7, max_seconds=3600):
+        self.precision  = precision
+        self.sub_count  = 1 << precision
+        self.half_count = self.sub_count >> 1
+        self.max_value  = int(max_seconds*1e6)
+        size = self.bucketIndex(self.max_value) + 1
+        self.positive = array('Q', bytes(8*size))
+        self.negative = array('Q', bytes(8*size))
+        self.count    = 0
+        self.min      = None
+        self.max      = None
+
+    def bucketIndex(self, value:int) -> int:
+        if value < self.sub_count:
+            return value
+
+        shift = value.bit_length() - self.precision
+        return self.sub_count + (shift - 1)*self.half_count + (value >> shift) - self.half_count
+
+    def bucketValue(self, index:int) -> float:
+        """Middle of the values counted in bucket 'index'"""
+        if index < self.sub_count:
+            return float(index)
+
+        shift = (index - self.sub_count)//self.half_count + 1
+        mantissa = (index - self.sub_count)%self.half_count + self.half_count
+        return (mantissa << shift) + ((1 << shift) - 1)/2
+
+    def record(self, seconds:float):
+        value = min(int(abs(seconds)*1e6), self.max_value)
+        if seconds < 0:
+            self.negative[self.bucketIndex(value)] += 1
+        else:
+            self.positive[self.bucketIndex(value)] += 1
+
+        self.count += 1
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct:float) -> Optional[float]:
+        """Value in seconds that 'pct' percent of the recorded values are at or below"""
+        if not self.count:
+            return None
+
+        rank = max(1, round(pct/100*self.count))
+        seen = 0
+        ## Most negative first
+        for index in range(len(self.negative) - 1, -1, -1):
+            seen += self.negative[index]
+            if seen >= rank:
+                return -self.bucketValue(index)/1e6
+
+        for index, count in enumerate(self.positive):
+            seen += count
+            if seen >= rank:
+                return self.bucketValue(index)/1e6
+
+        return self.max
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        return {
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'min': self.min,
+            'max': self.max,
+        }
+
+
+class MovingAverage:
+    """Exponentially weighted moving average"""
+    def __init__(self, weight=0.1):
+        self.weight = weight
+        self.value  = None
+
+    def add(self, value:float) -> float:
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.weight*(value - self.value)
+
+        return self.value
+
+
+class RingBuffer:
+    """The last 'size' rows of a fixed number of float columns"""
+    def __init__(self, size, columns):
+        self.size    = size
+        self.columns = [array('d', bytes(8*size)) for _ in range(columns)]
+        self.next    = 0
+        self.count   = 0
+
+    def append(self, *values):
+        for column, value in zip(self.columns, values):
+            column[self.next] = value
+
+        self.next = (self.next + 1)%self.size
+        self.count += 1
+
+    def rows(self) -> List[Tuple[float, ...]]:
+        """Kept rows, oldest first"""
+        kept = min(self.count, self.size)
+        start = (self.next - kept)%self.size
+        return [tuple(column[(start + x)%self.size] for column in self.columns) for x in range(kept)]
+
+
+class FrameTelemetry:
+    """Timing of the frames sent to one controller"""
+    def __init__(self, name, *, history=1024):
+        self.name       = name
+        self.recent     = RingBuffer(history, 3)  ## Scheduled, shown, send duration
+        self.lateness   = HdrHistogram()
+        self.send_time  = HdrHistogram()
+        self.suppressed = 0
+        self.dropped    = 0
+
+    def record(self, scheduled, shown, duration):
+        """
+        A frame due at 'scheduled' finished sending, and so was shown, at
+        'shown'. Sending it took 'duration' seconds
+        """
+        self.recent.append(scheduled, shown, duration)
+        self.lateness.record(shown - scheduled)
+        self.send_time.record(duration)
+
+    def stats(self) -> dict:
+        return {
+            'frames':     self.lateness.count,
+            'suppressed': self.suppressed,
+            'dropped':    self.dropped,
+            'lateness':   self.lateness.summary(),
+            'send':       self.send_time.summary(),
+        }
+
+
+def formatStats(stats:Dict[str, dict]) -> str:
+    """Table of the stats of each controller, in milliseconds"""
+    def ms(value):
+        return '-' if value is None else f"{value*1000:.2f}"
+
+    lines = [f"{'controller':<22} {'frames':>7} {'dropped':>8} {'suppressed':>11} "
+        f"{'late p50':>9} {'late p99':>9} {'send p50':>9} {'send p99':>9}"]
+    for name, s in stats.items():
+        late, send = s['lateness'], s['send']
+        lines.append(f"{name:<22} {s['frames']:>7} {s['dropped']:>8} {s['suppressed']:>11} "
+            f"{ms(late['p50']):>9} {ms(late['p99']):>9} {ms(send['p50']):>9} {ms(send['p99']):>9}")
+
+    return '\n'.join(lines) + "\n(times in ms)"
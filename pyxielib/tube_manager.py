@@ -1,5 +1,8 @@
 import re
-from typing import List
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Tuple
 
 from pyxielib import decoder
 from pyxielib.pyxieutil import PyxieError
@@ -10,62 +13,124 @@ class DecodeError(PyxieError):
     pass
 
 
-def cmdDecodePrint(cmd) -> List[int]:
-    ## pylint: disable=too-many-branches
-    out = []
-    token = ''
-    state = 'start'
-    for c in cmd:
-        if state == 'start':
-            ## First character must be printable or token start
-            if c == '{':
-                state = 'token_start'
-                continue
-
-            if not decoder.isPrintable(c):
-                raise DecodeError("First character must be pritable or start a token")
-
-            ## Decode and set char
-            out.append(decoder.decodeChar(c))
-            state = 'idle'
-        elif state == 'idle':
-            if c == '{':
-                state = 'token_start'
-            elif c == '!':
-                out[-1] = decoder.underlineCode(out[-1])
-                state = 'idle'
-            elif c == ':':
-                out[-1] = decoder.colonCode(out[-1])
-                state = 'idle'
-            else:
-                ## Decode and set char
-                out.append(decoder.decodeChar(c))
-                state = 'idle'
-        elif state == 'token_start':
-            if c == '!':
-                state = 'underline'
-                continue
-
-            token = ''
-            state = 'token'
-
-        ## Allow 'token_start' state to jump to 'token'
-        if state == 'token':
-            ## Add to token buf
-            if c != '}':
-                token += c
-                state = 'token'
-            else:
-                out.append(cmdDecodeToken(token))
-                state = 'idle'
-        elif state == 'underline':
-            if c == '}':
-                state = 'idle'
+## Bitmap of every ASCII character, indexed by code point
+_ASCII_CODES = tuple(decoder.decodeChar(chr(x)) for x in range(128))
+
+
+class _CharCodes(dict):
+    """Character -> bitmap lookup. Filled from the ASCII table, anything else is decoded"""
+    def __init__(self, underline=False):
+        self.underline = underline
+        dict.__init__(self, {chr(x): self._code(chr(x)) for x in range(len(_ASCII_CODES))})
+
+    def _code(self, c):
+        code = _ASCII_CODES[ord(c)] if ord(c) < len(_ASCII_CODES) else decoder.decodeChar(c)
+        return decoder.underlineCode(code) if self.underline else code
+
+    def __missing__(self, c):
+        return self._code(c)
+
+
+class _TokenCodes(dict):
+    """Memo of '{0x..}'/'{0b..}' token bodies to bitmaps, masked to 16 bits"""
+    MAX_SIZE = 4096
+
+    def __missing__(self, token):
+        code = cmdDecodeToken(token) & 0xFFFF
+        if len(self) < self.MAX_SIZE:
+            self[token] = code
+
+        return code
+
+
+_CHAR_CODES       = _CharCodes()
+_UNDERLINED_CODES = _CharCodes(underline=True)
+_TOKEN_CODES      = _TokenCodes()
+_MODIFIER_BITS    = {'!': 0x4000, ':': 0x8000}
+
+## One alternative per piece of the print command grammar: a run of plain
+## characters, a run of '!'/':' modifiers, the body of an underlined '{!...}'
+## group, or a token body with its closing '}'. Unclosed groups run to the end
+_CMD_SCAN = re.compile(r"([^{!:]+)|([!:]+)|\{!([^}]*)\}?|\{([^}]*\}?)").findall
+
+## The same grammar cut into self-contained pieces: an underlined group, a
+## token or a run of characters, each with the modifiers that follow it
+_CMD_PIECES = re.compile(
+    r"\{![^}]+\}?[!:]*|\{!\}?|\{[^}]*\}[!:]*|\{[^}]*|.[^{!:]*[!:]*", re.DOTALL
+).findall
+
+
+class _PieceCodes(dict):
+    """Memo of command pieces to their packed bitmaps, modifiers applied"""
+    MAX_SIZE = 4096
+
+    def __missing__(self, piece):
+        if piece[0] != '{':
+            text  = piece[0] + piece[1:].rstrip('!:')
+            codes = [_CHAR_CODES[c] for c in text]
+            mods  = piece[len(text):]
+        else:
+            end  = piece.find('}') + 1 or len(piece)
+            mods = piece[end:]
+            if piece[1:2] == '!':
+                codes = [_UNDERLINED_CODES[c] for c in piece[2:end].rstrip('}')]
+            elif piece[end-1] == '}':
+                codes = [_TOKEN_CODES[piece[1:end-1]]]
             else:
-                out.append(decoder.decodeAndUnderline(c))
-                state = 'underline'
+                ## An unclosed token is dropped
+                codes = []
 
-    return out
+        for c in mods:
+            codes[-1] |= _MODIFIER_BITS[c]
+
+        codes = array('H', codes).tobytes()
+        if len(self) < self.MAX_SIZE:
+            self[piece] = codes
+
+        return codes
+
+
+_PIECE_CODES = _PieceCodes()
+
+
+def cmdDecodeArray(cmd) -> array:
+    """Decode a print command into an array of 16-bit bitmaps in one pass"""
+    ## First character must be printable or token start
+    if cmd and cmd[0] != '{' and _CHAR_CODES[cmd[0]] == decoder.NOCODE:
+        raise DecodeError("First character must be pritable or start a token")
+
+    ## Modifiers after an empty '{!}' reach back to the piece before it
+    if '{!}' in cmd:
+        return _cmdDecodeScan(cmd)
+
+    return array('H', b''.join(map(_PIECE_CODES.__getitem__, _CMD_PIECES(cmd))))
+
+
+def _cmdDecodeScan(cmd) -> array:
+    out = []
+    pos = 0
+    if cmd and cmd[0] != '{':
+        out.append(_CHAR_CODES[cmd[0]])
+        pos = 1
+
+    for text, mods, underline, token in _CMD_SCAN(cmd, pos):
+        if text:
+            out += map(_CHAR_CODES.__getitem__, text)
+        elif mods:
+            for c in mods:
+                out[-1] |= _MODIFIER_BITS[c]
+        elif underline:
+            out += map(_UNDERLINED_CODES.__getitem__, underline)
+        elif token[-1:] == '}':
+            ## An unclosed token is dropped
+            out.append(_TOKEN_CODES[token[:-1]])
+
+    return array('H', out)
+
+
+def cmdDecodePrint(cmd) -> List[int]:
+    """Decode a print command into a list of bitmaps, one per tube"""
+    return cmdDecodeArray(cmd).tolist()
 
 
 def cmdDecodeToken(token) -> int:
@@ -78,5 +143,72 @@ def cmdDecodeToken(token) -> int:
     raise DecodeError(f"Invalid token '{token}'")
 
 
+def bitmapsToCode(bitmaps) -> str:
+    """A print command that decodes back to 'bitmaps'. Hex codes, the way HexFrame writes them"""
+    return ''.join('{' + hex(bitmap) + '}' for bitmap in bitmaps)
+
+
 def cmdLen(cmd) -> int:
     return len(re.sub(r"\{[^\}]*\}|!", '', cmd))
+
+
+class DecodeCache:
+    """
+    Bounded LRU cache of decoded commands, keyed by the command string
+    Bitmaps are returned as tuples so cached results can't be modified
+    """
+    def __init__(self, size=1024):
+        self.size      = size
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self.lock      = threading.Lock()
+        self.entries: 'OrderedDict[str, Tuple[int, ...]]' = OrderedDict()
+
+    def decode(self, cmd) -> Tuple[int, ...]:
+        """Decode a print command, using the cached bitmaps when possible"""
+        with self.lock:
+            bitmaps = self.entries.get(cmd)
+            if bitmaps is not None:
+                self.entries.move_to_end(cmd)
+                self.hits += 1
+                return bitmaps
+
+        ## Decode outside of the lock. Errors are raised and never cached
+        bitmaps = tuple(cmdDecodeArray(cmd))
+        with self.lock:
+            self.misses += 1
+            self.entries[cmd] = bitmaps
+            self.entries.move_to_end(cmd)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+        return bitmaps
+
+    def clear(self):
+        """Drop every entry and zero the counters"""
+        with self.lock:
+            self.entries.clear()
+            self.hits      = 0
+            self.misses    = 0
+            self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'size':      len(self.entries),
+                'max_size':  self.size,
+                'hits':      self.hits,
+                'misses':    self.misses,
+                'evictions': self.evictions,
+            }
+
+
+## Shared by every controller and Frame.decode()
+decode_cache = DecodeCache()
+
+
+def cachedDecodePrint(cmd) -> Tuple[int, ...]:
+    """cmdDecodePrint() through the shared LRU cache"""
+    return decode_cache.decode(cmd)
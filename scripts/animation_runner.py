@@ -2,49 +2,111 @@
 ##pylint: disable=wrong-import-position
 
 import argparse
+import os
 import sys
 import time
 
 sys.path.append("./")
 
-from pyxielib import assembler, controller
+from pyxielib import assembler, controller, telemetry
 from pyxielib.animation_file import FileAnimation
+from pyxielib.compiled_animation import CompiledAnimation, compileAnimation
+from pyxielib.frame_log import ReplayAnimation
+from pyxielib.headless import HeadlessRunner
 
 parser = argparse.ArgumentParser(description='Nixie Tube Animation Running')
 parser.add_argument('-c', '--controller', choices=['terminal', 'serial'], default='terminal')
 parser.add_argument('-n', '--no-clear', action='store_true')
-parser.add_argument('-a', '--animation', default="animations/packman.ani")
+parser.add_argument('-i', '--incremental', action='store_true', help="Only redraw the tubes that changed")
+parser.add_argument('-b', '--binary', action='store_true', help="Use the binary frame protocol with the serial controller")
+parser.add_argument('-p', '--pipelined', action='store_true', help="Don't wait for the serial controller to answer each frame")
+parser.add_argument('-s', '--stats', action='store_true', help="Print frame timing stats at the end of the run")
+parser.add_argument('--spin', type=float, default=0.0, help="Busy wait this many seconds before each frame")
+parser.add_argument('--no-compensate', action='store_true', help="Don't send frames early to make up for controller latency")
+parser.add_argument('-r', '--record', help="Also record the frames to this frame log")
+parser.add_argument('--replay', action='store_true', help="The animation is a frame log to play back")
+parser.add_argument('--speed', type=float, default=1.0, help="Play a frame log back this many times faster")
+parser.add_argument('--compile', metavar='PATH', help="Compile the animation to this .anc file and exit")
+parser.add_argument('-a', '--animation', default="animations/packman.ani",
+    help="A .ani file, a compiled .anc file, or a frame log with --replay")
 parser.add_argument('-l', '--loops', type=int, default=1)
+parser.add_argument('--headless', action='store_true',
+    help="Run on a virtual clock as fast as possible. The terminal isn't drawn")
+parser.add_argument('-d', '--duration', type=float,
+    help="Seconds of playback for a headless run, instead of --loops passes of the animation")
 args = parser.parse_args()
 
 
+if args.compile:
+    compileAnimation(FileAnimation(args.animation), args.compile)
+    print(f"Compiled '{args.animation}' to '{args.compile}'")
+    sys.exit(0)
+
+
 ctrl = None
 clear_screen = not args.no_clear
 if args.controller == 'terminal':
-    ctrl = controller.TerminalController(clear_screen=clear_screen)
+    stream = open(os.devnull, 'w') if args.headless else None
+    ctrl = controller.TerminalController(clear_screen=clear_screen, incremental=args.incremental, stream=stream)
 elif args.controller == 'serial':
     print("Opening connection to Nixie Control Board")
-    ctrl = controller.SerialController('/dev/ttyACM0', debug=True, baud=115200)
+    ctrl = controller.SerialController('/dev/ttyACM0', debug=True, baud=115200, binary=args.binary, pipelined=args.pipelined)
     print("Connection established")
 else:
     raise Exception(f"Invalid value for argument --controller: {args.controller}")
 
-ani = FileAnimation(args.animation)
-asmlr = assembler.Assembler(controller=ctrl)
-asmlr.start()
-asmlr.setAnimation(ani)
-
-try:
-    count = 0
-    while True:
-        if asmlr.animationDone():
-            count += 1
-            if args.loops and count >= args.loops:
-                break
-            asmlr.rerun()
-
-        time.sleep(0.1)
-except KeyboardInterrupt:
-    print("User required exit")
-
-asmlr.stop()
+controllers = [ctrl]
+if args.record:
+    controllers.append(controller.RecordingController(args.record))
+
+if args.replay:
+    ani = ReplayAnimation(args.animation, speed=args.speed)
+elif args.animation.endswith('.anc'):
+    ani = CompiledAnimation(args.animation)
+else:
+    ani = FileAnimation(args.animation)
+
+asmlr = assembler.Assembler(controllers=controllers, compensate_latency=(not args.no_compensate), spin=args.spin)
+if args.headless:
+    if not args.loops:
+        raise Exception("A headless run needs a number of --loops")
+
+    asmlr.setAnimation(ani)
+    runner = HeadlessRunner(asmlr)
+    if args.duration:
+        runner.run(args.duration)
+    else:
+        ## A looped animation is never done, so a pass also ends after one length
+        for count in range(args.loops):
+            if count:
+                asmlr.rerun()
+            runner.run(ani.length(), until=asmlr.animationDone)
+
+    stats = runner.stats()
+    print(f"Ran {stats['virtual_seconds']:.1f}s of playback, {stats['frames']} frames, "
+        f"in {stats['real_seconds']:.3f}s ({stats['speedup']:.0f}x)")
+else:
+    asmlr.start()
+    asmlr.setAnimation(ani)
+
+    try:
+        count = 0
+        while True:
+            if asmlr.animationDone():
+                count += 1
+                if args.loops and count >= args.loops:
+                    break
+                asmlr.rerun()
+
+            time.sleep(0.1)
+    except KeyboardInterrupt:
+        print("User required exit")
+
+    asmlr.stop()
+if args.record:
+    controllers[-1].close()
+if args.stats:
+    print(telemetry.formatStats(asmlr.timingStats()))
+if args.pipelined:
+    ctrl.stop()
+    print(ctrl.latencyStats())
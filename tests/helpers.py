@@ -0,0 +1,37 @@
+"""
+Test doubles and builders shared by the tests. Not a test module itself
+"""
+##pylint: disable=wrong-import-position
+
+import os
+import sys
+from typing import List, Tuple
+
+## Make the repo root importable when run directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyxielib import tube_manager as tm
+from pyxielib.animation import FullFrame, FullFrameAnimation, textToFrames
+from pyxielib.clock import getClock
+from pyxielib.controller import Controller
+
+
+class CaptureController(Controller):
+    """Keeps every code it is sent, and the clock time it was sent at"""
+    def __init__(self):
+        Controller.__init__(self)
+        self.codes: List[str]   = []
+        self.times: List[float] = []
+
+    def send(self, code):
+        self.codes.append(code)
+        self.times.append(getClock().monotonic())
+
+    def bitmaps(self) -> List[Tuple[int, ...]]:
+        """The bitmaps of every code sent"""
+        return [tuple(tm.cmdDecodePrint(x)) for x in self.codes]
+
+
+def makeAnimation(codes, delay=0.1, cls=FullFrameAnimation):
+    """A timed animation showing each of 'codes' for 'delay' seconds"""
+    return cls.makeTimed([FullFrame(textToFrames(x)) for x in codes], delay=delay)
@@ -0,0 +1,118 @@
+"""
+Reference implementations that optimized pyxielib code replaced
+
+Not part of pyxielib. The equivalence tests check the replacements
+against these, and the benchmarks time them side by side
+
+Import from a test:       from reference_impls import ...
+Import from a benchmark:  from tests.reference_impls import ...
+"""
+import re
+from typing import List
+
+from pyxielib import decoder
+from pyxielib import tube_manager as tm
+from pyxielib.animation_file import FileAnimationError
+
+
+def cmdDecodePrintStateMachine(cmd) -> List[int]:
+    """Character at a time decoder that tube_manager.cmdDecodeArray replaced"""
+    ## pylint: disable=too-many-branches
+    out = []
+    token = ''
+    state = 'start'
+    for c in cmd:
+        if state == 'start':
+            ## First character must be printable or token start
+            if c == '{':
+                state = 'token_start'
+                continue
+
+            if not decoder.isPrintable(c):
+                raise tm.DecodeError("First character must be pritable or start a token")
+
+            ## Decode and set char
+            out.append(decoder.decodeChar(c))
+            state = 'idle'
+        elif state == 'idle':
+            if c == '{':
+                state = 'token_start'
+            elif c == '!':
+                out[-1] = decoder.underlineCode(out[-1])
+                state = 'idle'
+            elif c == ':':
+                out[-1] = decoder.colonCode(out[-1])
+                state = 'idle'
+            else:
+                ## Decode and set char
+                out.append(decoder.decodeChar(c))
+                state = 'idle'
+        elif state == 'token_start':
+            if c == '!':
+                state = 'underline'
+                continue
+
+            token = ''
+            state = 'token'
+
+        ## Allow 'token_start' state to jump to 'token'
+        if state == 'token':
+            ## Add to token buf
+            if c != '}':
+                token += c
+                state = 'token'
+            else:
+                out.append(tm.cmdDecodeToken(token))
+                state = 'idle'
+        elif state == 'underline':
+            if c == '}':
+                state = 'idle'
+            else:
+                out.append(decoder.decodeAndUnderline(c))
+                state = 'underline'
+
+    return out
+
+
+def tokenizeBySlices(line):
+    """Slice at a time tokenizer that FileAnimation._tokenize replaced"""
+    tokens = []
+    parsed = ""
+    while line:
+        ## Match macro
+        m = re.search(r"^\{([A-z]\w*)}", line)
+        if m:
+            tokens.append(('macro', m.groups()[0]))
+
+        ## Match inline hex literal e.g. {0x1A2B}
+        if m is None:
+            m = re.search(r"^\{(0[xX][0-9A-Fa-f]+)}", line)
+            if m:
+                tokens.append(('hex', m.groups()[0]))
+
+        ## Match multiplier
+        if m is None:
+            m = re.search(r"^\{(\d+)}", line)
+            if m:
+                tokens.append(('multiplier', int(m.groups()[0])))
+
+        ## Match literal
+        if m is None:
+            m = re.search(r"^[^\{\}]+", line)
+            if m:
+                tokens.append(('literal', m.group()))
+
+        ## At least one match was found
+        if m:
+            matched = m.group()
+            line = line[len(matched):]
+            parsed += matched
+            continue
+
+        ## Identify error
+        if line[0] in ['{', '}']:
+            raise FileAnimationError(f"Found unmatched '{line[0]}: '{parsed}<<HERE>>{line}'")
+
+        raise FileAnimationError(f"Unknown syntax error: '{parsed}<<HERE>>{line}'")
+
+    return tokens
@@ -0,0 +1,273 @@
+"""
+Tests for the animation classes in ``animation.py``.
+
+Run directly:      python tests/test_animation.py
+Or via unittest:   python -m unittest discover tests
+"""
+##pylint: disable=wrong-import-position
+
+import os
+import sys
+import time
+import unittest
+
+## Make the repo root importable when run directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyxielib.animation import (
+    ComboAnimation, EmtpyAnimation, Frame, FullFrame, FullFrameAnimation, HexFrame,
+    LoopedFullFrameAnimation, LoopedTubeAnimation, MarqueeAnimation, TubeAnimation, TubeSequence,
+    concatFullFrameTimelines, textToFrames,
+)
+
+
+class NextDeadlineTest(unittest.TestCase):
+    def test_unstarted_animation_is_due_now(self):
+        ani = FullFrameAnimation.makeTimed([FullFrame(textToFrames("AB"))], delay=5)
+        self.assertLessEqual(ani.nextDeadline(), time.monotonic())
+
+    def test_full_frame_deadline_is_end_of_frame(self):
+        ani = FullFrameAnimation.makeTimed([FullFrame(textToFrames("AB"))], delay=5)
+        ani.updateFrameSet()
+        self.assertAlmostEqual(ani.nextDeadline(), ani.start_time + 5)
+
+    def test_finished_full_frame_has_no_deadline(self):
+        ani = FullFrameAnimation.makeTimed([FullFrame(textToFrames("AB"))], delay=0.001)
+        ani.updateFrameSet()
+        time.sleep(0.002)
+        ani.updateFrameSet()
+        self.assertTrue(ani.done())
+        self.assertIsNone(ani.nextDeadline())
+
+    def test_frozen_marquee_never_changes(self):
+        ani = MarqueeAnimation.fromText("HI", 16, freeze=10)
+        self.assertTrue(ani.updateFrameSet())
+        self.assertIsNone(ani.nextDeadline())
+
+    def test_scrolling_marquee_deadline_is_next_shift(self):
+        ani = MarqueeAnimation.fromText("HELLO", 2, delay=0.5)
+        ani.updateFrameSet()
+        self.assertAlmostEqual(ani.nextDeadline(), ani.start_time + 0.5*(ani.index + 1))
+
+    def test_tube_animation_uses_earliest_tube(self):
+        fast = TubeSequence.makeTimed([HexFrame(0x1), HexFrame(0x2)], delay=1)
+        slow = TubeSequence.makeTimed([HexFrame(0x1), HexFrame(0x2)], delay=3)
+        ani = TubeAnimation([slow, fast])
+        ani.updateFrameSet()
+        self.assertAlmostEqual(ani.nextDeadline(), fast.start_time + 1)
+
+    def test_looped_tube_animation_restarts_immediately(self):
+        seq = TubeSequence.makeTimed([HexFrame(0x1)], delay=0.001)
+        ani = LoopedTubeAnimation([seq])
+        ani.updateFrameSet()
+        time.sleep(0.002)
+        seq.popFrame()  ## Run the tube off the end without looping
+        self.assertTrue(ani.loopOver())
+        self.assertEqual(ani.nextDeadline(), 0.0)
+
+    def test_empty_animation_never_changes(self):
+        ani = EmtpyAnimation()
+        self.assertIsNone(ani.nextDeadline())
+        self.assertFalse(ani.startAt(0.0))
+        self.assertIsNone(ani.getBitmaps())
+        self.assertTrue(ani.done())
+
+
+class EndTimeTest(unittest.TestCase):
+    def test_full_frame_ends_after_last_frame(self):
+        ani = FullFrameAnimation.makeTimed([FullFrame(textToFrames(x)) for x in ("AB", "CD")], delay=2)
+        self.assertIsNone(ani.endTime())
+        ani.updateFrameSet()
+        self.assertAlmostEqual(ani.endTime(), ani.start_time + 4)
+
+    def test_done_at_end_time(self):
+        ani = FullFrameAnimation.makeTimed([FullFrame(textToFrames("AB"))], delay=0.01)
+        ani.updateFrameSet()
+        time.sleep(max(0, ani.endTime() - time.monotonic()))
+        ani.updateFrameSet()
+        self.assertTrue(ani.done())
+
+    def test_looped_animations_never_end(self):
+        ani = LoopedFullFrameAnimation.makeTimed([FullFrame(textToFrames("AB"))], delay=1)
+        ani.updateFrameSet()
+        self.assertIsNone(ani.endTime())
+        ani = LoopedTubeAnimation([TubeSequence.makeTimed([HexFrame(0x1)], delay=1)])
+        ani.updateFrameSet()
+        self.assertIsNone(ani.endTime())
+
+    def test_counted_loops_end(self):
+        ani = LoopedTubeAnimation([TubeSequence.makeTimed([HexFrame(0x1)], delay=1)], loops=3)
+        ani.updateFrameSet()
+        self.assertAlmostEqual(ani.endTime(), ani.start_time + 3)
+
+    def test_marquee(self):
+        frozen = MarqueeAnimation.fromText("HI", 16, freeze=10)
+        self.assertAlmostEqual(frozen.endTime(), frozen.start_time + 10)
+        scrolling = MarqueeAnimation.fromText("HELLO", 2, delay=0.5)
+        self.assertAlmostEqual(scrolling.endTime(), scrolling.start_time + 2.5)
+
+    def test_combo_ends_with_last_animation(self):
+        short = FullFrameAnimation.makeTimed([FullFrame(textToFrames("A"))], delay=1)
+        long = FullFrameAnimation.makeTimed([FullFrame(textToFrames("B"))], delay=3)
+        ani = ComboAnimation([short, long])
+        short.updateFrameSet()
+        long.updateFrameSet()
+        self.assertAlmostEqual(ani.endTime(), long.start_time + 3)
+        self.assertIsNone(ComboAnimation([short, LoopedFullFrameAnimation.makeTimed([FullFrame(textToFrames("C"))])]).endTime())
+
+
+class StartAtTest(unittest.TestCase):
+    def test_timed_from_start_time(self):
+        start = time.monotonic() - 0.5
+        ## Each with frames 2s apart, and how long it lasts
+        animations = [
+            (FullFrameAnimation.makeTimed([FullFrame(textToFrames(x)) for x in ("AB", "CD")], delay=2), 4),
+            (TubeAnimation([TubeSequence.makeTimed(textToFrames("AB"), delay=2)]), 4),
+            (MarqueeAnimation.fromText("HELLO", 2, delay=2), 10),
+        ]
+        for ani, length in animations:
+            ani.updateFrameSet()
+            self.assertTrue(ani.startAt(start), ani)
+            self.assertAlmostEqual(ani.nextDeadline(), start + 2)
+            self.assertAlmostEqual(ani.endTime(), start + length)
+
+    def test_first_frame_is_shown(self):
+        ani = FullFrameAnimation.makeTimed([FullFrame(textToFrames(x)) for x in ("AB", "CD")], delay=2)
+        ani.startAt(time.monotonic() - 0.5)
+        self.assertEqual(ani.getCode(), "AB")
+        self.assertFalse(ani.updateFrameSet())
+
+
+class TimelineTest(unittest.TestCase):
+    def setUp(self):
+        self.frames = [FullFrame(textToFrames(x)) for x in ("AA", "BB", "CC")]
+        self.ani = FullFrameAnimation([(1, self.frames[0]), (2, self.frames[1]), (0.5, self.frames[2])])
+
+    def test_length_is_sum_of_delays(self):
+        self.assertEqual(self.ani.length(), 3.5)
+
+    def test_frame_at(self):
+        self.assertEqual(self.ani.frameAt(0), self.frames[0])
+        self.assertEqual(self.ani.frameAt(0.999), self.frames[0])
+        self.assertEqual(self.ani.frameAt(1), self.frames[1])
+        self.assertEqual(self.ani.frameAt(3.2), self.frames[2])
+        self.assertIsNone(self.ani.frameAt(3.5))
+
+    def test_late_update_skips_missed_frames(self):
+        self.ani.updateFrameSet()
+        ## Pretend the caller stalled for 3.2 seconds
+        self.ani.start_time -= 3.2
+        self.assertTrue(self.ani.updateFrameSet())
+        self.assertEqual(self.ani.frame_index, 2)
+        self.assertEqual(self.ani.getCode(), "CC")
+
+    def test_lateness_does_not_accumulate(self):
+        self.ani.updateFrameSet()
+        start = self.ani.start_time
+        self.ani.start_time -= 1.4  ## First frame seen 0.4 seconds late
+        self.ani.updateFrameSet()
+        self.assertAlmostEqual(self.ani.nextDeadline(), start - 1.4 + 3)
+
+    def test_seek(self):
+        self.ani.seek(1.5)
+        self.assertEqual(self.ani.getCode(), "BB")
+        self.assertAlmostEqual(self.ani.nextDeadline() - time.monotonic(), 1.5, places=2)
+
+    def test_multiply_recompiles(self):
+        self.ani *= 2
+        self.assertEqual(self.ani.length(), 7)
+        self.assertEqual(self.ani.frameAt(4.6), self.frames[1])
+
+
+class TubeDeadlineHeapTest(unittest.TestCase):
+    def test_tubes_share_one_start_time(self):
+        tubes = [TubeSequence.makeTimed([HexFrame(0x1), HexFrame(0x2)], delay=1) for _ in range(4)]
+        ani = TubeAnimation(tubes)
+        ani.updateFrameSet()
+        self.assertEqual({tube.start_time for tube in tubes}, {ani.start_time})
+
+    def test_only_due_tubes_are_visited(self):
+        fast = TubeSequence.makeTimed([HexFrame(0x1), HexFrame(0x2)], delay=1)
+        slow = TubeSequence.makeTimed([HexFrame(0x1), HexFrame(0x2)], delay=5)
+        ani = TubeAnimation([fast, slow])
+        ani.updateFrameSet()
+        for tube in ani.tubes:
+            tube.start_time -= 1.5
+        ani.deadlines = [(d - 1.5, i) for d, i in ani.deadlines]
+        self.assertTrue(ani.updateFrameSet())
+        self.assertEqual(ani.getCode(), "{0x2}{0x1}")
+        self.assertEqual(slow.frame_index, 0)
+        self.assertEqual(sorted(ani.deadlines), [(fast.start_time + 2, 0), (slow.start_time + 5, 1)])
+
+    def test_no_update_before_deadline(self):
+        ani = TubeAnimation([TubeSequence.makeTimed([HexFrame(0x1), HexFrame(0x2)], delay=5)])
+        self.assertTrue(ani.updateFrameSet())
+        self.assertIsNone(ani.updateFrameSet())
+        self.assertAlmostEqual(ani.nextDeadline(), ani.start_time + 5)
+
+    def test_loops_stay_phase_locked(self):
+        seq = TubeSequence.makeTimed([HexFrame(0x1), HexFrame(0x2)], delay=1)
+        ani = LoopedTubeAnimation([seq])
+        ani.updateFrameSet()
+        first_start = ani.start_time
+        ## Run two seconds and a bit late: the loop has ended
+        ani.start_time -= 2.3
+        seq.start_time -= 2.3
+        ani.deadlines = [(d - 2.3, i) for d, i in ani.deadlines]
+        ani.updateFrameSet()
+        self.assertEqual(ani.loops_done, 1)
+        self.assertAlmostEqual(ani.start_time, first_start - 0.3)
+        self.assertEqual(ani.getCode(), "{0x1}")
+
+
+def naiveMerge(timelines):
+    """Reference merge: look every timeline up at every boundary"""
+    spans = []
+    for timeline in timelines:
+        clock, tl_spans = 0.0, []
+        for delay, item in timeline:
+            tl_spans.append((clock, clock + delay, item))
+            clock += delay
+        spans.append(tl_spans)
+
+    boundaries = sorted({0.0} | {end for tl in spans for _, end, _ in tl})
+    merged = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        items = [next((x for s, e, x in tl if s <= start < e), None) for tl in spans]
+        merged.append((end - start, items))
+
+    return merged
+
+
+class SweepMergeTest(unittest.TestCase):
+    def setUp(self):
+        self.tubes = [
+            TubeSequence([(0.5, HexFrame(0x1)), (0, HexFrame(0x4)), (1, HexFrame(0x2))]),
+            TubeSequence([(0.25, HexFrame(0x8))]*5),
+            TubeSequence([(0.3, HexFrame(0x10)), (0.7, HexFrame(0x20)), (2, HexFrame(0x40))]),
+        ]
+
+    def test_tube_animation_matches_naive_merge(self):
+        expected = [
+            (delay, FullFrame([item or Frame() for item in items]))
+            for delay, items in naiveMerge([tube.frames for tube in self.tubes])
+        ]
+        self.assertEqual(TubeAnimation(self.tubes).toFullFrameAnimation().frames, expected)
+
+    def test_concat_matches_naive_merge(self):
+        left = TubeAnimation(self.tubes[:2]).toFullFrameAnimation().frames
+        right = TubeAnimation(self.tubes[2:]).toFullFrameAnimation().frames
+        expected = []
+        for delay, (lft, rgt) in naiveMerge([left, right]):
+            tubes = (lft.getFrames() if lft else [Frame()]*2) + (rgt.getFrames() if rgt else [Frame()])
+            expected.append((delay, FullFrame(tubes)))
+
+        self.assertEqual(concatFullFrameTimelines(left, right), expected)
+
+    def test_total_length_preserved(self):
+        merged = TubeAnimation(self.tubes).toFullFrameAnimation()
+        self.assertAlmostEqual(merged.length(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
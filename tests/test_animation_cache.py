@@ -0,0 +1,241 @@
+"""
+Tests for the parsed animation cache in ``animation_cache.py`` and the
+shared library cache in ``animation_file.py``.
+
+Run directly:      python tests/test_animation_cache.py
+Or via unittest:   python -m unittest discover tests
+"""
+##pylint: disable=wrong-import-position
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+## Make the repo root importable when run directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyxielib import animation_cache
+from pyxielib.animation import HexFrame
+from pyxielib.animation_cache import AnimationCache, getAnimationCache, setAnimationCache
+from pyxielib.animation_file import FileAnimation, library_cache
+
+
+ANIMATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'animations')
+
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.mtime = 1_000_000_000
+        library_cache.clear()
+
+    def tearDown(self):
+        library_cache.clear()
+        self.dir.cleanup()
+
+    def write(self, name, body):
+        """Write a file. Each write gets a later mtime, however fast they come"""
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w') as f:
+            f.write(body)
+        self.mtime += 1
+        os.utime(path, (self.mtime, self.mtime))
+        return path
+
+
+class AnimationCacheTest(CacheTestCase):
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.cache = AnimationCache(os.path.join(self.dir.name, 'cache'))
+        self.old_cache = setAnimationCache(self.cache)
+        self.write('sprites.alib', "sprite|bar|0x0001\n")
+        self.write('sequences.alib', "import|sprites.alib\nsequence|start|blink\nframe|1|{bar}\nframe|1| \nsequence|end\n")
+        self.path = self.write('main.ani', "import|sequences.alib\nscale|0.1\nframe|1|AB\nsequence|insert|blink\n")
+
+    def tearDown(self):
+        setAnimationCache(self.old_cache)
+        CacheTestCase.tearDown(self)
+
+    def load(self, **kwargs):
+        return FileAnimation(self.path, **kwargs)
+
+    def test_hit_skips_parsing(self):
+        first = self.load()
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+        with mock.patch.object(FileAnimation, '_loadFramesHelper', side_effect=AssertionError("parsed")):
+            second = self.load()
+
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual([(t, str(f)) for t, f in second.frames], [(t, str(f)) for t, f in first.frames])
+        self.assertEqual(second.fullframes, second.frames)
+        self.assertIsInstance(second.frames[1][1].frames[0], HexFrame)
+        self.assertAlmostEqual(second.length(), 0.3)
+
+    def test_changed_file_is_a_miss(self):
+        self.load()
+        self.write('main.ani', "import|sequences.alib\nscale|0.1\nframe|1|CD\n")
+        self.assertEqual(self.load().getCode().strip(), "CD")
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_changed_nested_import_is_a_miss(self):
+        self.load()
+        self.write('sprites.alib', "sprite|bar|0x0008\n")
+        ani = self.load()
+        self.assertEqual(self.cache.misses, 2)
+        self.assertEqual(ani.frames[1][1].frames[0].hex_code, 0x0008)
+
+        ## And the new parse is what's cached
+        self.load()
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_changed_parser_is_a_miss(self):
+        self.load()
+        with mock.patch('pyxielib.animation_cache.parserDigest', return_value="new parser"):
+            self.load()
+            self.assertEqual(self.cache.misses, 2)
+
+            ## The entry is rewritten for the new parser
+            self.load()
+            self.assertEqual(self.cache.hits, 1)
+
+        self.load()
+        self.assertEqual(self.cache.misses, 3)
+
+    def test_parser_digest_covers_the_parser_source(self):
+        self.assertEqual(animation_cache.parserDigest(), animation_cache.parserDigest())
+        with mock.patch.object(animation_cache, '_parser_digest', []), \
+             mock.patch.object(animation_cache, 'PARSER_MODULES', ('animation_file.py',)):
+            digest = animation_cache.parserDigest()
+        self.assertNotEqual(digest, animation_cache.parserDigest())
+
+    def test_missing_import_is_a_miss(self):
+        self.load()
+        os.unlink(os.path.join(self.dir.name, 'sprites.alib'))
+        with self.assertRaises(Exception):
+            self.load()
+
+    def test_size_is_part_of_the_key(self):
+        self.load()
+        self.load(size=8)
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_unreadable_entry_is_reparsed(self):
+        self.load()
+        with open(self.cache.entryPath(self.path, 16), 'wb') as f:
+            f.write(b"not a pickle")
+
+        with self.assertLogs('pyxielib.animation_cache', level='WARNING'):
+            ani = self.load()
+        self.assertEqual(ani.frameCount(), 3)
+
+    def test_errors_are_not_cached(self):
+        self.write('main.ani', "frame|1|{nope}\n")
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                self.load()
+        self.assertFalse(os.path.exists(self.cache.entryPath(self.path, 16)))
+
+    def test_disabled(self):
+        self.load(cache=False)
+        setAnimationCache(None)
+        self.load()
+        self.assertIsNone(getAnimationCache())
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 0))
+        self.assertFalse(os.path.exists(self.cache.directory))
+
+    def test_unwritable_directory(self):
+        blocker = self.write('blocker', "")
+        setAnimationCache(AnimationCache(os.path.join(blocker, 'cache')))
+        with self.assertLogs('pyxielib.animation_cache', level='WARNING'):
+            self.assertEqual(self.load().frameCount(), 3)
+
+    def test_prune_by_age(self):
+        self.cache.max_age = 60
+        old = self.cache.entryPath(self.write('old.ani', "frame|1|AB\n"), 16)
+        FileAnimation(os.path.join(self.dir.name, 'old.ani'))
+        os.utime(old, (self.mtime, self.mtime))
+        self.load()
+        self.assertEqual([x[1] for x in self.cache.entries()], [self.cache.entryPath(self.path, 16)])
+
+    def test_prune_least_recently_used(self):
+        self.cache.max_entries = 2
+        self.cache.max_age = float('inf')
+        paths = [self.write(f'{name}.ani', "frame|1|AB\n") for name in ('a', 'b', 'c')]
+        for i, path in enumerate(paths[:2]):
+            FileAnimation(path)
+            os.utime(self.cache.entryPath(path, 16), (1_000_000_000 + i, 1_000_000_000 + i))
+        ## A hit makes 'a' the most recently used, so 'b' goes
+        FileAnimation(paths[0])
+        FileAnimation(paths[2])
+        self.assertEqual(sorted(x[1] for x in self.cache.entries()),
+            sorted(self.cache.entryPath(x, 16) for x in (paths[0], paths[2])))
+
+    def test_demo_round_trip(self):
+        path = os.path.join(ANIMATIONS, 'demo.ani')
+        parsed = FileAnimation(path, cache=False)
+        FileAnimation(path)
+        cached = FileAnimation(path)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual([(t, f.frames) for t, f in cached.frames], [(t, f.frames) for t, f in parsed.frames])
+
+        self.cache.clear()
+        FileAnimation(path)
+        self.assertEqual(self.cache.misses, 2)
+
+
+class LibraryCacheTest(CacheTestCase):
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.write('sprites.alib', "sprite|bar|0x0001\n")
+        self.write('sequences.alib', "import|sprites.alib\nsequence|start|blink\nframe|1|{bar}\nframe|1| \nsequence|end\n")
+        self.write('one.ani', "import|sequences.alib\nsequence|insert|blink\n")
+        self.write('two.ani', "import|sequences.alib\nframe|1|AB\nsequence|insert|blink\n")
+
+    def load(self, name):
+        return FileAnimation(os.path.join(self.dir.name, name), cache=False)
+
+    def test_libraries_are_parsed_once(self):
+        one = self.load('one.ani')
+        two = self.load('two.ani')
+        ## sequences.alib is parsed, and so is sprites.alib under it
+        self.assertEqual(library_cache.stats(), {'size': 2, 'hits': 1, 'misses': 2})
+        self.assertIs(one.sequences['blink'], two.sequences['blink'])
+        self.assertIs(one.sprites['bar'], two.sprites['bar'])
+        self.assertEqual(sorted(os.path.basename(x) for x in two.importedPaths()), ['sequences.alib', 'sprites.alib'])
+
+    def test_libraries_are_read_only(self):
+        self.load('one.ani')
+        lib = library_cache.get(os.path.join(self.dir.name, 'sequences.alib'), 16)
+        self.assertIsInstance(lib.sequences['blink'], tuple)
+        with self.assertRaises(TypeError):
+            lib.sprites['bar'] = None
+        with self.assertRaises(TypeError):
+            lib.sequences['new'] = ()
+
+    def test_scaled_import_leaves_the_library_alone(self):
+        self.write('scaled.ani', "import|3|sequences.alib\nsequence|insert|blink\n")
+        self.assertAlmostEqual(self.load('scaled.ani').length(), 6)
+        self.assertAlmostEqual(self.load('one.ani').length(), 2)
+
+    def test_changed_nested_import_is_reparsed(self):
+        self.load('one.ani')
+        self.write('sprites.alib', "sprite|bar|0x0008\n")
+        ani = self.load('two.ani')
+        self.assertEqual(ani.sprites['bar'].hex_code, 0x0008)
+        self.assertEqual(ani.frames[1][1].frames[0].hex_code, 0x0008)
+        self.assertEqual(library_cache.stats()['hits'], 0)
+
+    def test_circular_imports_are_not_shared(self):
+        self.write('a.alib', "import|b.alib\nsprite|a|0x0001\n")
+        self.write('b.alib', "import|a.alib\nsprite|b|0x0002\n")
+        self.write('main.ani', "import|a.alib\nframe|1|{a}{b}\n")
+        self.write('other.ani', "import|b.alib\nframe|1|{a}{b}\n")
+        for name in ('main.ani', 'other.ani'):
+            self.assertEqual(self.load(name).frameCount(), 1)
+        self.assertEqual(library_cache.stats()['size'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
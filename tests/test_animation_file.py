@@ -0,0 +1,114 @@
+"""
+Tests for the frame line tokenizer and line memo in ``animation_file.py``.
+
+Run directly:      python tests/test_animation_file.py
+Or via unittest:   python -m unittest discover tests
+"""
+##pylint: disable=wrong-import-position
+
+import itertools
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+## Make the repo root importable when run directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyxielib.animation_file import FileAnimation, FileAnimationError
+from reference_impls import tokenizeBySlices
+
+
+class TokenizeTest(unittest.TestCase):
+    ## Characters that start, end or break each kind of token
+    ALPHABET = "{}aZ_0x1F9 [^:!"
+
+    def outcome(self, func, line):
+        try:
+            return func(line)
+        except FileAnimationError as e:
+            return e.what()
+
+    def assertSameAsReference(self, line):
+        self.assertEqual(self.outcome(FileAnimation._tokenize, line),
+            self.outcome(tokenizeBySlices, line), line)
+
+    def test_tokens(self):
+        self.assertEqual(FileAnimation._tokenize("{l_frame}{14}AB {0x1A2b}"), [
+            ('macro', 'l_frame'), ('multiplier', 14), ('literal', 'AB '), ('hex', '0x1A2b'),
+        ])
+        self.assertEqual(FileAnimation._tokenize(""), [])
+
+    def test_error_positions(self):
+        with self.assertRaises(FileAnimationError) as ctx:
+            FileAnimation._tokenize("AB{c}{0x1G}")
+        self.assertIn("Found unmatched '{: 'AB{c}<<HERE>>{0x1G}'", ctx.exception.what())
+
+        with self.assertRaises(FileAnimationError) as ctx:
+            FileAnimation._tokenize("{2}}")
+        self.assertIn("'{2}<<HERE>>}'", ctx.exception.what())
+
+    def test_every_short_line(self):
+        for length in range(5):
+            for chars in itertools.product(self.ALPHABET, repeat=length):
+                self.assertSameAsReference(''.join(chars))
+
+    def test_random_long_lines(self):
+        rand = random.Random(24)
+        pieces = list(self.ALPHABET) + ["{t_rail}", "{0x0036}", "{14}", "{", "}", "ABC"]
+        for _ in range(2000):
+            self.assertSameAsReference(''.join(rand.choice(pieces) for _ in range(rand.randint(1, 30))))
+
+
+class LineMemoTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, name, body):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w') as f:
+            f.write(body)
+        return path
+
+    def load(self, body):
+        return FileAnimation(self.write('test.ani', body), size=4, cache=False)
+
+    def bitmaps(self, ani, index):
+        return [x.decode() for x in ani.frames[index][1].getFrames()]
+
+    def test_identical_lines_share_a_frame(self):
+        ani = self.load("sprite|a|0x0001\nframe|1|{a}{3}\nframe|1|XY\nframe|1|{a}{3}\n")
+        self.assertIs(ani.frames[0][1], ani.frames[2][1])
+        self.assertIsNot(ani.frames[0][1], ani.frames[1][1])
+
+    def test_defining_a_sprite_invalidates(self):
+        ani = self.load("sprite|a|0x0001\nframe|1|{a}\nsprite|a|0x0002\nframe|1|{a}\n")
+        self.assertEqual(self.bitmaps(ani, 0)[0], 0x0001)
+        self.assertEqual(self.bitmaps(ani, 1)[0], 0x0002)
+
+    def test_importing_invalidates(self):
+        self.write('lib.alib', "sprite|a|0x0008\n")
+        ani = self.load("sprite|a|0x0001\nframe|1|{a}\nimport|lib.alib\nframe|1|{a}\n")
+        self.assertEqual(self.bitmaps(ani, 0)[0], 0x0001)
+        self.assertEqual(self.bitmaps(ani, 1)[0], 0x0008)
+
+    def test_overlay_leaves_shared_frames_alone(self):
+        ani = self.load("frame|1|{0x0001}{0x0002}\nframe|1|{0x0001}{0x0002}\nframe|0|{0x4000}\n")
+        self.assertEqual(ani.frameCount(), 2)
+        self.assertEqual(self.bitmaps(ani, 0)[:2], [0x0001, 0x0002])
+        self.assertEqual(self.bitmaps(ani, 1)[:2], [0x4001, 0x0002])
+
+    def test_errors_are_reported_every_time(self):
+        with self.assertRaises(Exception) as ctx:
+            self.load("frame|1|{nope}\nframe|1|{nope}\n")
+        message = str(ctx.exception)
+        self.assertIn("Line 1", message)
+        self.assertIn("Line 2", message)
+
+
+if __name__ == '__main__':
+    unittest.main()
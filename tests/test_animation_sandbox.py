@@ -320,7 +320,7 @@ class FileIntegrationTest(unittest.TestCase):
             f.write(body)
             path = f.name
         try:
-            return FileAnimation(path)
+            return FileAnimation(path, cache=False)
         finally:
             os.unlink(path)
 
@@ -0,0 +1,432 @@
+"""
+Tests for the frame assembler thread.
+
+Run directly:      python tests/test_assembler.py
+Or via unittest:   python -m unittest discover tests
+"""
+##pylint: disable=wrong-import-position
+
+import os
+import sys
+import time
+import unittest
+
+## Make the repo root importable when run directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyxielib import tube_manager as tm
+from pyxielib.animation import (
+    EmtpyAnimation, FullFrame, FullFrameAnimation, MarqueeAnimation, animationTime, textToFrames,
+)
+from pyxielib.assembler import Assembler
+from pyxielib.clock import VirtualClock, setClock
+from helpers import CaptureController, makeAnimation
+
+
+class PartialController(CaptureController):
+    """Takes partial updates and keeps the changed tubes of each"""
+    def __init__(self):
+        CaptureController.__init__(self)
+        self.updates = []
+
+    def acceptsPartialUpdates(self):
+        return True
+
+    def sendTubes(self, bitmaps, changed):
+        self.updates.append({x: bitmaps[x] for x in changed})
+
+
+class SlowController(CaptureController):
+    """Takes 'delay' seconds to show every frame"""
+    def __init__(self, delay):
+        CaptureController.__init__(self)
+        self.delay = delay
+
+    def send(self, code):
+        time.sleep(self.delay)
+        CaptureController.send(self, code)
+
+
+class CountingAnimation(MarqueeAnimation):
+    """A frozen marquee that counts how often the assembler polls it"""
+    def __init__(self):
+        MarqueeAnimation.__init__(self, textToFrames("HI"), 2, freeze=60)
+        self.polls = 0
+
+    def updateFrameSet(self):
+        self.polls += 1
+        return MarqueeAnimation.updateFrameSet(self)
+
+
+class DeadlineTest(unittest.TestCase):
+    def setUp(self):
+        self.ctrl = CaptureController()
+        self.asmlr = Assembler(controller=self.ctrl)
+
+    def tearDown(self):
+        self.asmlr.stop()
+
+    def test_static_animation_does_not_poll(self):
+        ani = CountingAnimation()
+        self.asmlr.start()
+        self.asmlr.setAnimation(ani)
+        time.sleep(0.2)
+        ## One poll for the first frame, maybe one more for the setAnimation race
+        self.assertLessEqual(ani.polls, 2)
+        self.assertEqual(self.ctrl.codes, ['HI'])
+
+    def test_frames_sent_at_deadline(self):
+        ani = makeAnimation(["AA", "BB", "CC"], delay=0.05)
+        self.asmlr.start()
+        self.asmlr.setAnimation(ani)
+        time.sleep(0.25)
+        self.assertEqual(self.ctrl.codes, ['AA', 'BB', 'CC'])
+        self.assertTrue(self.asmlr.animationDone())
+
+    def test_set_animation_wakes_idle_thread(self):
+        self.asmlr.start()
+        time.sleep(0.05)  ## No animation: thread waits without a timeout
+        self.asmlr.setAnimation(FullFrameAnimation([(1, FullFrame(textToFrames("OK")))]))
+        time.sleep(0.05)
+        self.assertEqual(self.ctrl.codes, ['OK'])
+
+
+class SlowOutputTest(unittest.TestCase):
+    def test_frame_timing_is_kept(self):
+        ctrl = SlowController(0.1)
+        asmlr = Assembler(controller=ctrl)
+        codes = [f"{x:02}" for x in range(20)]
+        ani = makeAnimation(codes, delay=0.02)
+        asmlr.start()
+        start = time.monotonic()
+        asmlr.setAnimation(ani)
+        while not asmlr.animationDone() and time.monotonic() - start < 2:
+            time.sleep(0.005)
+
+        ## The animation keeps its own pace even though output is 5x slower
+        self.assertLess(time.monotonic() - start, 0.4 + 0.15)
+        time.sleep(0.25)
+        asmlr.stop()
+
+        ## The controller is brought up to date with the newest frame
+        self.assertEqual(ctrl.codes[-1], codes[-1])
+        self.assertLess(len(ctrl.codes), len(codes))
+        stats = asmlr.frameStats()
+        self.assertEqual(stats['frames'], len(codes))
+        self.assertEqual(stats['frames'] - stats['dropped'] - stats['coalesced'], len(ctrl.codes))
+
+
+class TelemetryTest(unittest.TestCase):
+    def test_timing_is_recorded(self):
+        ctrl = SlowController(0.01)
+        asmlr = Assembler(controller=ctrl, compensate_latency=False)
+        codes = [f"{x:02}" for x in range(10)]
+        asmlr.start()
+        asmlr.setAnimation(makeAnimation(codes, delay=0.03))
+        time.sleep(0.45)
+        asmlr.stop()
+
+        stats = asmlr.timingStats()['SlowController']
+        self.assertEqual(stats['frames'], len(ctrl.codes))
+        self.assertAlmostEqual(stats['send']['p50'], 0.01, delta=0.005)
+        self.assertLess(stats['lateness']['p50'], 0.02)
+        self.assertGreaterEqual(stats['lateness']['min'], 0)
+
+        ## Each frame went out after it was due
+        rows = asmlr.telemetry.recent.rows()
+        self.assertEqual(len(rows), len(ctrl.codes))
+        for scheduled, sent, duration in rows:
+            self.assertLessEqual(scheduled, sent)
+
+    def test_suppressed_frames_are_counted(self):
+        asmlr = Assembler(controller=CaptureController())
+        asmlr.outputTimed("AB", time.monotonic())
+        asmlr.outputTimed("AB", time.monotonic())
+        stats = asmlr.timingStats()['CaptureController']
+        self.assertEqual((stats['frames'], stats['suppressed']), (1, 1))
+
+
+class PacingTest(unittest.TestCase):
+    DELAY = 0.03
+
+    def run_animation(self, controllers, **kwargs):
+        asmlr = Assembler(controllers=controllers, **kwargs)
+        asmlr.MAX_LEAD_STEP = 0.01
+        codes = [f"{x:02}" for x in range(30)]
+        ani = makeAnimation(codes, delay=self.DELAY)
+        asmlr.start()
+        asmlr.setAnimation(ani)
+        time.sleep(1.1)
+        asmlr.stop()
+        for ctrl in controllers:
+            self.assertEqual(ctrl.codes, codes)
+        return asmlr, ani
+
+    def lateness(self, ctrl, ani):
+        """
+        Median of how long after its deadline each frame was showing, by the
+        wall clock. The first frame can't be early, and teaches the latency
+        """
+        late = sorted(t - (ani.start_time + i*self.DELAY) for i, t in enumerate(ctrl.times) if i > 1)
+        return late[len(late)//2]
+
+    def test_frames_show_at_their_deadlines(self):
+        ctrl = SlowController(0.02)
+        _, ani = self.run_animation([ctrl], compensate_latency=False)
+        self.assertGreater(self.lateness(ctrl, ani), 0.015)
+
+        ctrl = SlowController(0.02)
+        asmlr, ani = self.run_animation([ctrl])
+        self.assertLess(abs(self.lateness(ctrl, ani)), 0.008)
+        ## The telemetry agrees with the wall clock
+        self.assertLess(abs(asmlr.timingStats()['SlowController']['lateness']['p50']), 0.008)
+
+    def test_each_controller_has_its_own_lead(self):
+        fast, slow = SlowController(0), SlowController(0.02)
+        asmlr, ani = self.run_animation([fast, slow])
+        self.assertLess(asmlr.leadTime(asmlr.outputs[0]), 0.005)
+        self.assertGreater(asmlr.leadTime(asmlr.outputs[1]), 0.015)
+        ## So the two show each frame together
+        for ctrl in (fast, slow):
+            self.assertLess(abs(self.lateness(ctrl, ani)), 0.008)
+
+    def test_lead_is_only_for_the_assembler(self):
+        ctrl = SlowController(0.02)
+        asmlr = Assembler(controller=ctrl)
+        asmlr.start()
+        asmlr.setAnimation(makeAnimation([f"{x:02}" for x in range(30)], delay=self.DELAY))
+        time.sleep(0.3)
+        try:
+            self.assertGreater(asmlr.lead_time, 0)
+            self.assertAlmostEqual(animationTime(), time.monotonic(), places=3)
+        finally:
+            asmlr.stop()
+
+
+
+class JitteryClock(VirtualClock):
+    """A clock whose sleeps run 'jitter' long, and where every reading takes 'tick'"""
+    def __init__(self, jitter, tick=1e-6):
+        VirtualClock.__init__(self)
+        self.jitter = jitter
+        self.tick   = tick
+
+    def monotonic(self):
+        self.elapsed += self.tick
+        return VirtualClock.monotonic(self)
+
+    def sleep(self, seconds):
+        self.advance(seconds + self.jitter)
+
+
+class SpinTest(unittest.TestCase):
+    def sendError(self, spin):
+        """How long after it was due a frame was sent, when sleeping oversleeps by 2ms"""
+        clock = JitteryClock(0.002)
+        setClock(clock)
+        self.addCleanup(setClock, None)
+        ctrl = CaptureController()
+        asmlr = Assembler(controller=ctrl, compensate_latency=False, spin=spin)
+        due = clock.monotonic() + 0.1
+        asmlr.sendOnTime(asmlr.outputs[0], "AB", due)
+        return ctrl.times[0] - due
+
+    def test_spin_absorbs_sleep_jitter(self):
+        self.assertAlmostEqual(self.sendError(0), 0.002, delta=1e-4)
+        self.assertLess(abs(self.sendError(0.005)), 1e-4)
+
+    def test_spin_does_not_hold_the_lock(self):
+        ctrl = SlowController(0)
+        asmlr = Assembler(controller=ctrl, spin=0.05)
+        asmlr.start()
+        try:
+            asmlr.setAnimation(makeAnimation([f"{x:02}" for x in range(10)], delay=0.06))
+            time.sleep(0.1)
+            start = time.monotonic()
+            asmlr.queueAnimation(makeAnimation(["OK"]))
+            self.assertLess(time.monotonic() - start, 0.01)
+        finally:
+            asmlr.stop()
+
+
+class HandoffTest(unittest.TestCase):
+    def setUp(self):
+        self.ctrl = SlowController(0)
+        self.asmlr = Assembler(controller=self.ctrl, compensate_latency=False)
+
+    def tearDown(self):
+        self.asmlr.stop()
+
+    def test_queued_animation_starts_at_end_of_current(self):
+        first = makeAnimation(["AA", "BB"], delay=0.05)
+        self.asmlr.start()
+        self.asmlr.setAnimation(first)
+        self.asmlr.queueAnimation(makeAnimation(["CC", "DD"], delay=0.05))
+        self.assertFalse(self.asmlr.animationDone())
+        time.sleep(0.3)
+        self.assertEqual(self.ctrl.codes, ["AA", "BB", "CC", "DD"])
+        self.assertEqual(self.asmlr.swaps, 1)
+        self.assertTrue(self.asmlr.animationDone())
+
+        ## The second animation went out the moment the first ended
+        end = first.start_time + first.length()
+        self.assertLess(self.ctrl.times[2] - end, 0.01)
+
+    def test_late_swap_keeps_animations_back_to_back(self):
+        clock = VirtualClock()
+        setClock(clock)
+        self.addCleanup(setClock, None)
+        first, second = makeAnimation(["AA"], delay=1), makeAnimation(["BB", "CC"], delay=1)
+        self.asmlr.setAnimation(first)
+        self.asmlr.queueAnimation(second)
+        self.asmlr.step()
+        end = first.endTime()
+
+        ## The swap runs a quarter frame late. The second animation still
+        ## started when the first ended, and its next frame isn't pushed back
+        clock.advance(1.25)
+        self.assertEqual(self.asmlr.step(), ("BB", end, None))
+        self.assertEqual(second.endTime(), end + 2)
+        self.assertEqual(self.asmlr.deadline, end + 1)
+
+    def test_animation_queued_after_the_end_starts_then(self):
+        clock = VirtualClock()
+        setClock(clock)
+        self.addCleanup(setClock, None)
+        self.asmlr.setAnimation(makeAnimation(["AA"], delay=1))
+        self.asmlr.step()
+        clock.advance(5)
+        second = makeAnimation(["BB"], delay=1)
+        self.asmlr.queueAnimation(second)
+        self.asmlr.step()
+        self.assertEqual(second.endTime(), animationTime() + 1)
+
+    def test_nothing_to_show_is_not_queued(self):
+        self.asmlr.setAnimation(makeAnimation(["AA"], delay=1))
+        self.assertFalse(self.asmlr.queueAnimation(EmtpyAnimation()))
+        finished = makeAnimation(["CC"], delay=1)
+        finished.seek(1)
+        self.assertFalse(self.asmlr.queueAnimation(finished))
+        self.assertIsNone(self.asmlr.next_animation)
+        self.assertTrue(self.asmlr.queueAnimation(makeAnimation(["BB"])))
+
+    def test_queue_fills_empty_assembler(self):
+        self.asmlr.start()
+        self.asmlr.queueAnimation(makeAnimation(["OK"], delay=0.05))
+        time.sleep(0.05)
+        self.assertEqual(self.ctrl.codes, ["OK"])
+
+    def test_set_animation_drops_queued(self):
+        self.asmlr.start()
+        self.asmlr.setAnimation(makeAnimation(["AA"], delay=0.05))
+        self.asmlr.queueAnimation(makeAnimation(["BB"], delay=0.05))
+        self.asmlr.setAnimation(makeAnimation(["CC"], delay=0.05))
+        time.sleep(0.15)
+        self.assertEqual(self.ctrl.codes, ["AA", "CC"][-len(self.ctrl.codes):])
+        self.assertNotIn("BB", self.ctrl.codes)
+
+    def test_needs_next_animation(self):
+        self.asmlr.start()
+        self.asmlr.setAnimation(makeAnimation(["AA"], delay=0.2))
+        time.sleep(0.02)
+        self.assertFalse(self.asmlr.needsNextAnimation(0.1))
+        self.assertTrue(self.asmlr.needsNextAnimation(0.5))
+        self.asmlr.queueAnimation(makeAnimation(["BB"], delay=0.05))
+        self.assertFalse(self.asmlr.needsNextAnimation(0.5))
+
+
+class FanOutTest(unittest.TestCase):
+    def test_slow_controller_does_not_delay_fast_one(self):
+        fast, slow = SlowController(0), SlowController(0.1)
+        asmlr = Assembler(controllers=[fast, slow], compensate_latency=False)
+        codes = [f"{x:02}" for x in range(20)]
+        asmlr.start()
+        asmlr.setAnimation(makeAnimation(codes, delay=0.02))
+        time.sleep(0.6)
+        asmlr.stop()
+
+        self.assertEqual(fast.codes, codes)
+        self.assertEqual(slow.codes[-1], codes[-1])
+        self.assertLess(len(slow.codes), len(codes))
+
+        ## Each controller counts only its own drops
+        dropped = asmlr.droppedFrames()
+        self.assertEqual(dropped['SlowController#1'], 0)
+        self.assertEqual(dropped['SlowController#2'], len(codes) - len(slow.codes))
+        stats = asmlr.timingStats()
+        self.assertEqual(stats['SlowController#2']['dropped'], dropped['SlowController#2'])
+        self.assertEqual(stats['SlowController#1']['frames'], len(codes))
+
+    def test_each_controller_tracks_its_own_changes(self):
+        whole, partial = CaptureController(), PartialController()
+        asmlr = Assembler(controllers=[whole, partial])
+        partial.disable()
+        asmlr.output("AB")
+        partial.enable()
+        asmlr.output("AB")
+        asmlr.output("AC")
+        self.assertEqual(whole.codes, ["AB", "AC"])
+        self.assertEqual(partial.codes, ["AB"])
+        self.assertEqual(len(partial.updates), 2)
+        self.assertEqual(list(partial.updates[1]), [1])
+
+    def test_first_controller_is_primary(self):
+        first, second = CaptureController(), PartialController()
+        asmlr = Assembler(controllers=[first, second])
+        self.assertIs(asmlr.controller, first)
+        self.assertEqual(list(asmlr.timingStats()), ['CaptureController', 'PartialController'])
+
+
+class DeltaOutputTest(unittest.TestCase):
+    def test_only_changed_tubes_are_sent(self):
+        ctrl = PartialController()
+        asmlr = Assembler(controller=ctrl)
+        for code in ("12:00", "12:01", "12:01", "13:01"):
+            asmlr.output(code)
+
+        a, b = tm.cmdDecodePrint("12:00"), tm.cmdDecodePrint("12:01")
+        self.assertEqual(len(ctrl.updates), 3)
+        self.assertEqual(ctrl.updates[0], dict(enumerate(a)))
+        self.assertEqual(ctrl.updates[1], {len(b) - 1: b[-1]})
+        self.assertEqual(ctrl.updates[2], {1: tm.cmdDecodePrint("13:01")[1]})
+        self.assertEqual(asmlr.frames_suppressed, 1)
+
+    def test_whole_frame_when_tube_count_changes(self):
+        ctrl = PartialController()
+        asmlr = Assembler(controller=ctrl)
+        asmlr.output("AB")
+        asmlr.output("ABC")
+        self.assertEqual(sorted(ctrl.updates[1]), [0, 1, 2])
+
+    def test_duplicates_suppressed_for_whole_frame_controllers(self):
+        ctrl = CaptureController()
+        asmlr = Assembler(controller=ctrl)
+        same = ''.join(f"{{0x{x:X}}}" for x in tm.cmdDecodePrint("AB"))
+        for code in ("AB", "AB", same, "CD", "CD", "AB"):
+            asmlr.output(code)
+
+        ## Codes that decode the same are duplicates too
+        self.assertEqual(ctrl.codes, ["AB", "CD", "AB"])
+
+    def test_frame_resent_after_controller_reset(self):
+        ctrl = CaptureController()
+        asmlr = Assembler(controller=ctrl)
+        asmlr.output("AB")
+        ctrl.disable()
+        ctrl.enable()
+        asmlr.output("AB")
+        self.assertEqual(ctrl.codes, ["AB", "AB"])
+
+    def test_disabled_controller_gets_every_frame(self):
+        ctrl = CaptureController()
+        ctrl.disable()
+        asmlr = Assembler(controller=ctrl)
+        asmlr.output("AB")
+        asmlr.output("AB")
+        ctrl.enable()
+        asmlr.output("AB")
+        self.assertEqual(ctrl.codes, ["AB"]*3)
+
+
+if __name__ == '__main__':
+    unittest.main()
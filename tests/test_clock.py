@@ -0,0 +1,154 @@
+"""
+Tests for the clocks in ``clock.py`` and the runner in ``headless.py``.
+
+Run directly:      python tests/test_clock.py
+Or via unittest:   python -m unittest discover tests
+"""
+##pylint: disable=wrong-import-position
+
+import datetime as dt
+import os
+import sys
+import threading
+import time
+import unittest
+
+## Make the repo root importable when run directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyxielib.animation import LoopedFullFrameAnimation, MarqueeAnimation, animationTime, steppingAhead
+from pyxielib.assembler import Assembler
+from pyxielib.clock import Clock, VirtualClock, getClock, setClock
+from pyxielib.headless import HeadlessRunner
+from pyxielib.pyxieutil import PyxieError
+from helpers import CaptureController, makeAnimation
+
+
+class MessageScheduler:
+    """Stands in for a Scheduler: shows the next message once the last one is done"""
+    def __init__(self, assembler, messages, period=1.0):
+        self.assembler = assembler
+        self.messages  = list(messages)
+        self.period    = period
+        self.shown     = []
+
+    def isRunning(self):
+        return False
+
+    def poll(self):
+        if self.assembler.animationDone() and self.messages:
+            msg = self.messages.pop(0)
+            self.shown.append((msg, getClock().now()))
+            self.assembler.setAnimation(MarqueeAnimation.fromText(msg, 16, freeze=60))
+
+
+class VirtualClockTest(unittest.TestCase):
+    def tearDown(self):
+        setClock(None)
+
+    def test_time_stands_still(self):
+        clock = VirtualClock(dt.datetime(2024, 1, 1, 12))
+        start = clock.monotonic()
+        time.sleep(0.01)
+        self.assertEqual(clock.monotonic(), start)
+        clock.sleep(90)
+        self.assertEqual(clock.monotonic(), start + 90)
+        self.assertEqual(clock.now(), dt.datetime(2024, 1, 1, 12, 1, 30))
+
+    def test_never_goes_backwards(self):
+        clock = VirtualClock()
+        clock.advanceTo(clock.monotonic() + 5)
+        clock.advanceTo(clock.monotonic() - 1)
+        clock.advance(-1)
+        self.assertEqual(clock.elapsed, 5)
+
+    def test_animations_use_the_clock(self):
+        clock = VirtualClock()
+        old = setClock(clock)
+        self.assertIsInstance(old, Clock)
+        ani = makeAnimation(["AA", "BB"], delay=10)
+        ani.updateFrameSet()
+        self.assertFalse(ani.updateFrameSet())
+        clock.advance(10)
+        self.assertTrue(ani.updateFrameSet())
+        self.assertEqual(ani.getCode(), "BB")
+        self.assertEqual(animationTime(), clock.monotonic())
+
+        setClock(None)
+        self.assertFalse(getClock().virtual)
+
+    def test_stepping_ahead_is_per_thread(self):
+        clock = VirtualClock()
+        setClock(clock)
+        self.addCleanup(setClock, None)
+        seen = []
+        with steppingAhead(5):
+            thread = threading.Thread(target=lambda: seen.append(animationTime()))
+            thread.start()
+            thread.join()
+            self.assertEqual(animationTime(), clock.monotonic() + 5)
+        self.assertEqual(seen, [clock.monotonic()])
+        self.assertEqual(animationTime(), clock.monotonic())
+
+
+class HeadlessRunnerTest(unittest.TestCase):
+    def run_loop(self, seconds):
+        ctrl = CaptureController()
+        asmlr = Assembler(controller=ctrl)
+        asmlr.setAnimation(makeAnimation(["AA", "BB"], cls=LoopedFullFrameAnimation))
+        stats = HeadlessRunner(asmlr).run(seconds)
+        return ctrl, asmlr, stats
+
+    def test_an_hour_in_seconds(self):
+        start = time.monotonic()
+        ctrl, asmlr, stats = self.run_loop(3600)
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertAlmostEqual(stats['virtual_seconds'], 3600)
+        self.assertAlmostEqual(len(ctrl.codes), 36000, delta=2)
+        self.assertEqual(stats['frames'], len(ctrl.codes))
+
+        ## Every frame went out when it was due. A loop restarts the
+        ## runner's smallest step after its end
+        lateness = asmlr.timingStats()['CaptureController']['lateness']
+        self.assertEqual(lateness['min'], 0)
+        self.assertLessEqual(lateness['max'], 2*HeadlessRunner.MIN_STEP)
+        self.assertAlmostEqual(ctrl.times[-1] - ctrl.times[0], 0.1*(len(ctrl.times) - 1), \
+            delta=len(ctrl.times)*HeadlessRunner.MIN_STEP)
+
+    def test_deterministic(self):
+        first, _, _ = self.run_loop(60)
+        second, _, _ = self.run_loop(60)
+        self.assertEqual(first.codes, second.codes)
+        self.assertEqual([round(b - a, 9) for a, b in zip(first.times, first.times[1:])],
+            [round(b - a, 9) for a, b in zip(second.times, second.times[1:])])
+
+    def test_real_clock_is_restored(self):
+        self.run_loop(1)
+        self.assertFalse(getClock().virtual)
+
+    def test_stops_when_nothing_is_left(self):
+        ctrl = CaptureController()
+        asmlr = Assembler(controller=ctrl)
+        asmlr.setAnimation(makeAnimation(["AA", "BB", "CC"], delay=20))
+        stats = HeadlessRunner(asmlr).run()
+        self.assertEqual(ctrl.codes, ["AA", "BB", "CC"])
+        self.assertAlmostEqual(stats['virtual_seconds'], 60)
+
+    def test_scheduler_is_polled(self):
+        ctrl = CaptureController()
+        asmlr = Assembler(controller=ctrl)
+        start = dt.datetime(2024, 1, 1, 8)
+        schdlr = MessageScheduler(asmlr, ["ONE", "TWO", "THREE"])
+        stats = HeadlessRunner(asmlr, schdlr, clock=VirtualClock(start)).run(3*3600)
+        self.assertEqual([x.strip() for x in ctrl.codes], ["ONE", "TWO", "THREE"])
+        self.assertEqual([x[1] for x in schdlr.shown], [start + dt.timedelta(seconds=61*x) for x in range(3)])
+        self.assertEqual(stats['polls'], 3*3600 + 1)
+
+    def test_scheduler_run_needs_an_end(self):
+        asmlr = Assembler(controller=CaptureController())
+        with self.assertRaises(PyxieError):
+            HeadlessRunner(asmlr, MessageScheduler(asmlr, [])).run()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+"""
+Tests for compiled animations in ``compiled_animation.py``.
+
+Run directly:      python tests/test_compiled_animation.py
+Or via unittest:   python -m unittest discover tests
+"""
+##pylint: disable=wrong-import-position
+
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import unittest
+
+## Make the repo root importable when run directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyxielib import compiled_animation as ca
+from pyxielib import tube_manager as tm
+from pyxielib.animation import LoopedFullFrameAnimation, MarqueeAnimation, TubeAnimation, TubeSequence, textToFrames
+from pyxielib.animation_file import FileAnimation
+from pyxielib.assembler import Assembler
+from pyxielib.clock import VirtualClock, setClock
+from pyxielib.controller import Controller
+from pyxielib.headless import HeadlessRunner
+from helpers import CaptureController, makeAnimation
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANIMATIONS = os.path.join(ROOT, 'animations')
+
+
+def playHeadless(animation, seconds=None):
+    """The (offset from the first frame, bitmaps) of every frame sent"""
+    ctrl = CaptureController()
+    asmlr = Assembler(controller=ctrl)
+    asmlr.setAnimation(animation)
+    HeadlessRunner(asmlr).run(seconds)
+    return [(round(t - ctrl.times[0], 6), bitmaps) for t, bitmaps in zip(ctrl.times, ctrl.bitmaps())]
+
+
+def padded(frames, tubes):
+    return [(t, bitmaps + (0,)*(tubes - len(bitmaps))) for t, bitmaps in frames]
+
+
+class CompiledAnimationTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'show.anc')
+
+    def tearDown(self):
+        setClock(None)
+        self.dir.cleanup()
+
+    def compiled(self, animation):
+        ca.compileAnimation(animation, self.path)
+        return ca.CompiledAnimation(self.path)
+
+    def assertSamePlayback(self, played, expected):
+        """
+        The same frames at the same times. A deadline that rounds to just
+        before the frame boundary costs the headless runner a step
+        """
+        self.assertEqual([x[1] for x in played], [x[1] for x in expected])
+        for (t, _), (expected_t, _) in zip(played, expected):
+            self.assertAlmostEqual(t, expected_t, delta=len(expected)*HeadlessRunner.MIN_STEP)
+
+    def test_identical_frames_share_a_row(self):
+        ani = self.compiled(makeAnimation(["AB", "CD", "AB", "AB", "CD"]))
+        self.assertEqual(ani.frameCount(), 5)
+        self.assertEqual(ani.table_size, 2)
+        self.assertEqual(ani.tubeCount(), 2)
+        self.assertAlmostEqual(ani.length(), 0.5)
+        self.assertEqual(os.path.getsize(self.path), ca.HEADER.size + 5*4*2 + 2*2*2)
+        self.assertEqual(ani.bitmapsAt(2), tuple(tm.cmdDecodePrint("AB")))
+
+    def test_steps_like_the_original(self):
+        clock = VirtualClock()
+        setClock(clock)
+        ani = self.compiled(makeAnimation(["AB", "CD", "EF"], delay=10))
+        self.assertEqual(ani.nextDeadline(), 0.0)
+        self.assertTrue(ani.updateFrameSet())
+        start = clock.monotonic()
+        self.assertEqual(ani.endTime(), start + 30)
+        self.assertFalse(ani.updateFrameSet())
+        self.assertEqual(ani.nextDeadline(), start + 10)
+
+        ## Late updates skip straight to the right frame
+        clock.advance(25)
+        self.assertTrue(ani.updateFrameSet())
+        self.assertEqual(ani.getBitmaps(), tuple(tm.cmdDecodePrint("EF")))
+        self.assertEqual(ani.getCode(), "{0x%x}{0x%x}" % ani.getBitmaps())
+        self.assertFalse(ani.done())
+
+        clock.advance(5)
+        self.assertFalse(ani.updateFrameSet())
+        self.assertTrue(ani.done())
+        self.assertIsNone(ani.nextDeadline())
+        self.assertEqual(ani.getBitmaps(), tuple(tm.cmdDecodePrint("EF")))
+
+        ani.reset()
+        self.assertFalse(ani.done())
+        self.assertTrue(ani.updateFrameSet())
+        self.assertEqual(ani.getBitmaps(), tuple(tm.cmdDecodePrint("AB")))
+
+    def test_demo_plays_the_same(self):
+        source = FileAnimation(os.path.join(ANIMATIONS, 'demo.ani'), cache=False)
+        expected = padded(playHeadless(source), source.tubeCount())
+        self.assertSamePlayback(playHeadless(self.compiled(source)), expected)
+
+    def test_looped(self):
+        source = makeAnimation(["AB", "CD"], delay=0.5, cls=LoopedFullFrameAnimation)
+        expected = playHeadless(source, 10)
+        ani = self.compiled(makeAnimation(["AB", "CD"], delay=0.5, cls=LoopedFullFrameAnimation))
+        self.assertTrue(ani.looped)
+        self.assertIsNone(ani.endTime())
+        self.assertGreater(len(expected), 15)
+        ## LoopedFullFrameAnimation restarts a step after its deadline. This
+        ## restarts on it, and so fits one more frame in
+        self.assertSamePlayback(playHeadless(ani, 10)[:len(expected)], expected)
+
+    def test_tube_animation(self):
+        source = TubeAnimation([TubeSequence.makeTimed(textToFrames(x), delay=0.2) for x in ("ABC", "DE")])
+        expected = padded(playHeadless(source.toFullFrameAnimation()), 2)
+        self.assertSamePlayback(playHeadless(self.compiled(source)), expected)
+
+    def test_bitmaps_skip_the_decoder(self):
+        class TubeController(Controller):
+            def __init__(self):
+                Controller.__init__(self)
+                self.frames = []
+
+            def acceptsPartialUpdates(self):
+                return True
+
+            def sendTubes(self, bitmaps, changed):
+                self.frames.append(tuple(bitmaps))
+
+        tubes, codes = TubeController(), CaptureController()
+        asmlr = Assembler(controllers=[tubes, codes])
+        asmlr.setAnimation(self.compiled(makeAnimation(["AB", "CD"])))
+        tm.decode_cache.clear()
+        HeadlessRunner(asmlr).run()
+        expected = [tuple(tm.cmdDecodePrint(x)) for x in ("AB", "CD")]
+        self.assertEqual(tubes.frames, expected)
+        self.assertEqual(codes.bitmaps(), expected)
+        self.assertEqual(tm.decode_cache.stats()['misses'], 0)
+
+    def test_only_full_frames(self):
+        with self.assertRaises(ca.CompiledAnimationError):
+            ca.compileAnimation(MarqueeAnimation.fromText("HI", 4), self.path)
+
+    def test_bad_files(self):
+        with open(self.path, 'wb') as f:
+            f.write(b"frame|1|AB\n" + bytes(40))
+        with self.assertRaises(ca.CompiledAnimationError):
+            ca.CompiledAnimation(self.path)
+
+        ca.compileAnimation(makeAnimation(["AB", "CD"]), self.path)
+        with open(self.path, 'rb+') as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+        with self.assertRaises(ca.CompiledAnimationError):
+            ca.CompiledAnimation(self.path)
+
+        ca.compileAnimation(makeAnimation(["AB"]), self.path)
+        with open(self.path, 'rb+') as f:
+            f.seek(ca.HEADER.size + 4)
+            f.write(struct.pack(">I", 7))
+        ani = ca.CompiledAnimation(self.path)
+        with self.assertRaises(ca.CompiledAnimationError):
+            ani.updateFrameSet()
+
+
+
+class AnimationRunnerTest(unittest.TestCase):
+    """scripts/animation_runner.py --headless on an animation that never ends"""
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'loop.anc')
+        ca.compileAnimation(makeAnimation(["AB", "CD"], delay=0.5, cls=LoopedFullFrameAnimation), self.path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def runHeadless(self, *args):
+        result = subprocess.run(
+            [sys.executable, os.path.join('scripts', 'animation_runner.py'), '--headless', '-a', self.path, *args],
+            cwd=ROOT, capture_output=True, text=True, timeout=60, check=False,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout
+
+    def test_looped_passes_end(self):
+        self.assertIn("Ran 3.0s of playback", self.runHeadless('--loops', '3'))
+
+    def test_duration(self):
+        self.assertIn("Ran 10.0s of playback", self.runHeadless('--duration', '10'))
+
+
+if __name__ == '__main__':
+    unittest.main()
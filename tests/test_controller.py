@@ -0,0 +1,378 @@
+"""
+Tests for the display controllers in ``controller.py``.
+
+Run directly:      python tests/test_controller.py
+Or via unittest:   python -m unittest discover tests
+"""
+##pylint: disable=wrong-import-position
+
+import io
+import os
+import re
+import sys
+import time
+import unittest
+
+## Make the repo root importable when run directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyxielib import frame_protocol as fp
+from pyxielib import tube_manager as tm
+from pyxielib.assembler import Assembler
+from pyxielib.board_emulator import BoardEmulator
+from pyxielib.controller import ControllerError, RaspberryPiController, SerialController, TerminalController
+from pyxielib.fake_raspi import FakeGPIO, FakeSpiDev, FakeSpidev
+
+
+class FakeTerminal:
+    """Just enough of an ANSI terminal to replay TerminalController output"""
+    CSI_RE = re.compile(r"\033\[(\d*)(?:;(\d*))?([HJK])")
+
+    def __init__(self, rows=10, cols=200):
+        self.rows = rows
+        self.cols = cols
+        self.clear()
+        self.row = 0
+        self.col = 0
+
+    def clear(self):
+        self.screen = [[' ']*self.cols for _ in range(self.rows)]
+
+    def feed(self, text):
+        pos = 0
+        while pos < len(text):
+            m = self.CSI_RE.match(text, pos)
+            if m:
+                arg1, arg2, cmd = m.groups()
+                if cmd == 'H':
+                    self.row = int(arg1 or 1) - 1
+                    self.col = int(arg2 or 1) - 1
+                elif cmd == 'J':
+                    self.clear()
+                else:
+                    self.screen[self.row][self.col:] = [' ']*(self.cols - self.col)
+                pos = m.end()
+                continue
+
+            c = text[pos]
+            if c == '\n':
+                self.row += 1
+                self.col = 0
+            else:
+                self.screen[self.row][self.col] = c
+                self.col += 1
+            pos += 1
+
+    def lines(self):
+        return [''.join(row).rstrip() for row in self.screen]
+
+
+class IncrementalTerminalTest(unittest.TestCase):
+    CODES = ["12!34:56", "12!34:57", "12!34 57", "A{0x8001}B", "ABCDEFGH", "ABCDEFGH", "XBCDEFGY"]
+
+    def replay(self, codes):
+        """Screen contents after each frame, for full and incremental redraws"""
+        full = TerminalController(clear_screen=True, stream=io.StringIO())
+        incremental = TerminalController(incremental=True, stream=io.StringIO())
+        screens = []
+        for code in codes:
+            full.send(code)
+            incremental.send(code)
+            expected, actual = FakeTerminal(), FakeTerminal()
+            expected.feed(full.stream.getvalue().rpartition("\033[2J\n")[2])
+            actual.feed(incremental.stream.getvalue())
+            screens.append((expected.lines(), actual.lines(), (actual.row, actual.col)))
+
+        return full, incremental, screens
+
+    def test_partial_updates_through_assembler(self):
+        full = TerminalController(clear_screen=True, stream=io.StringIO())
+        incremental = TerminalController(incremental=True, stream=io.StringIO())
+        asmlr = Assembler(controller=incremental)
+        self.assertTrue(incremental.acceptsPartialUpdates())
+        for code in self.CODES:
+            full.send(code)
+            asmlr.output(code)
+            expected, actual = FakeTerminal(), FakeTerminal()
+            expected.feed(full.stream.getvalue().rpartition("\033[2J\n")[2])
+            actual.feed(incremental.stream.getvalue())
+            self.assertEqual(expected.lines(), actual.lines())
+
+    def test_screen_matches_full_redraw(self):
+        _, _, screens = self.replay(self.CODES)
+        for expected, actual, _ in screens:
+            self.assertEqual(actual, expected)
+
+    def test_cursor_parked_below_display(self):
+        _, _, screens = self.replay(self.CODES)
+        self.assertEqual({cursor for _, _, cursor in screens}, {(7, 0)})
+
+    def test_unchanged_frame_writes_nothing(self):
+        ctrl = TerminalController(incremental=True, stream=io.StringIO())
+        ctrl.send("HELLO")
+        written = ctrl.bytes_written
+        ctrl.send("HELLO")
+        self.assertEqual(ctrl.bytes_written, written)
+        self.assertEqual(ctrl.frames_written, 2)
+
+    def test_fewer_bytes_than_full_redraw(self):
+        codes = [f"CLOCK 12!34!{x:02}" for x in range(60)]
+        full, incremental, _ = self.replay(codes)
+        self.assertLess(incremental.bytes_written*4, full.bytes_written)
+
+
+class SerialControllerTest(unittest.TestCase):
+    CODES = ["HELLO WORLD", "SAT 14 09!41!07! PM", "{0x1F}{!AB}C"]
+
+    def setUp(self):
+        self.board = BoardEmulator()
+
+    def expected(self, code):
+        bitmaps = tm.cmdDecodePrint(code)[:16]
+        return bitmaps + [0]*(16 - len(bitmaps))
+
+    def test_text_mode(self):
+        ctrl = SerialController('emulator', connection=self.board)
+        for code in self.CODES:
+            ctrl.send(code)
+            self.assertEqual(self.board.tubes, self.expected(code))
+
+    def test_binary_mode(self):
+        ctrl = SerialController('emulator', connection=self.board, binary=True)
+        for code in self.CODES:
+            ctrl.send(code)
+            self.assertEqual(self.board.tubes, self.expected(code))
+            self.assertEqual(self.board.output, b'')
+
+        self.assertEqual(self.board.frames_shown, len(self.CODES))
+
+    def test_binary_mode_uses_less_of_the_link(self):
+        for code in (self.CODES[1], "{0x1}{0x2}{0x4}{0x8}{0x10}{0x20}{0x40}{0x80}"):
+            text = BoardEmulator()
+            SerialController('emulator', connection=text).send(code)
+            binary = BoardEmulator()
+            SerialController('emulator', connection=binary, binary=True).send(code)
+            self.assertLess(binary.bytes_received + binary.bytes_sent, text.bytes_received + text.bytes_sent)
+
+    def test_tube_updates(self):
+        ctrl = SerialController('emulator', connection=self.board, binary=True)
+        asmlr = Assembler(controller=ctrl)
+        self.assertTrue(ctrl.acceptsPartialUpdates())
+        sizes = []
+        for x in range(10):
+            received = self.board.bytes_received
+            code = f"SAT 14 09!41!{x:02}! PM"
+            asmlr.output(code)
+            sizes.append(self.board.bytes_received - received)
+            self.assertEqual(self.board.tubes, self.expected(code))
+
+        ## A whole frame first, then only the seconds digits
+        self.assertEqual(sizes[0], fp.frameSize(16))
+        self.assertEqual(sizes[1:], [fp.tubesSize(1)]*9)
+
+    def test_whole_frame_after_a_nak(self):
+        ctrl = SerialController('emulator', connection=self.board, binary=True)
+        ctrl.sendTubes(tm.cmdDecodePrint("AB"), [0, 1])
+        self.board.reply(fp.encodeNak(9, fp.ERR_CHECKSUM))
+        with self.assertLogs('pyxielib.controller', level='WARNING'):
+            ctrl.readReply(9)
+
+        received = self.board.bytes_received
+        self.board.reset_input_buffer()
+        ctrl.sendTubes(tm.cmdDecodePrint("AC"), [1])
+        self.assertEqual(self.board.bytes_received - received, fp.frameSize(2))
+
+    def test_no_tube_updates_when_pipelined_or_text(self):
+        self.assertFalse(SerialController('emulator', connection=BoardEmulator()).acceptsPartialUpdates())
+        ctrl = SerialController('emulator', connection=BoardEmulator(), binary=True, pipelined=True)
+        self.assertFalse(ctrl.acceptsPartialUpdates())
+        ctrl.stop()
+
+    def test_sequence_wraps(self):
+        ctrl = SerialController('emulator', connection=self.board, binary=True)
+        for x in range(300):
+            ctrl.send(str(x))
+
+        self.assertEqual(ctrl.seq, 300 & 0xFF)
+
+    def test_nak_is_not_fatal(self):
+        class NakBoard(BoardEmulator):
+            def processFrame(self):
+                self.reply(fp.encodeNak(self.pending[1], fp.ERR_CHECKSUM))
+                self.pending.clear()
+                return True
+
+        board = NakBoard()
+        ctrl = SerialController('emulator', connection=board, binary=True)
+        with self.assertLogs('pyxielib.controller', level='WARNING'):
+            ctrl.send("AB")
+            ctrl.send("CD")
+        self.assertEqual(board.frames_shown, 0)
+
+    def test_no_reply(self):
+        ctrl = SerialController('emulator', connection=self.board, binary=True)
+        self.board.write = len
+        self.assertRaises(ControllerError, ctrl.send, "AB")
+
+
+class PipelinedSerialTest(unittest.TestCase):
+    def setUp(self):
+        self.board = BoardEmulator(timeout=0.05)
+        self.ctrl = None
+
+    def tearDown(self):
+        if self.ctrl is not None:
+            self.ctrl.stop()
+
+    def controller(self, **kwargs):
+        self.ctrl = SerialController('emulator', connection=self.board, pipelined=True, **kwargs)
+        return self.ctrl
+
+    def test_frames_are_shown(self):
+        ctrl = self.controller(binary=True)
+        for x in range(20):
+            ctrl.send(f"{x:>4}")
+            self.assertTrue(ctrl.waitForReplies(1))
+
+        self.assertEqual(self.board.tubes[:4], tm.cmdDecodePrint("  19"))
+        stats = ctrl.latencyStats()
+        self.assertEqual((stats['sent'], stats['acked'], stats['dropped'], stats['lost']), (20, 20, 0, 0))
+        self.assertGreaterEqual(stats['max'], stats['mean'])
+
+    def test_send_does_not_wait_for_a_busy_board(self):
+        ctrl = self.controller(binary=True, window=4)
+        self.board.pause()
+        start = time.monotonic()
+        for x in range(50):
+            ctrl.send(f"{x:>4}")
+        self.assertLess(time.monotonic() - start, 0.5)
+
+        self.board.resume()
+        self.assertTrue(ctrl.waitForReplies(1))
+        stats = ctrl.latencyStats()
+        self.assertEqual(stats['sent'] + stats['dropped'], 50)
+        self.assertLessEqual(stats['sent'], 4 + 1)
+        self.assertEqual(self.board.tubes[:4], tm.cmdDecodePrint("  49"))
+
+    def test_window_limits_frames_in_flight(self):
+        ctrl = self.controller(binary=True, window=3)
+        self.board.pause()
+        for x in range(10):
+            ctrl.send(str(x))
+            time.sleep(0.01)
+
+        self.assertEqual(len(ctrl.in_flight), 3)
+        self.board.resume()
+        self.assertTrue(ctrl.waitForReplies(1))
+
+    def test_text_mode(self):
+        ctrl = self.controller()
+        self.assertEqual(ctrl.window, 1)
+        for code in ("AB", "CD", "EF"):
+            ctrl.send(code)
+            self.assertTrue(ctrl.waitForReplies(1))
+
+        self.assertEqual(self.board.tubes[:2], tm.cmdDecodePrint("EF"))
+        self.assertEqual(ctrl.latencyStats()['acked'], 3)
+
+    def test_unanswered_frames_expire(self):
+        ctrl = self.controller(binary=True, timeout=0.1)
+        self.board.pause()
+        with self.assertLogs('pyxielib.controller', level='WARNING'):
+            ctrl.send("AB")
+            start = time.monotonic()
+            self.assertTrue(ctrl.waitForReplies(5))
+
+        ## Woken as soon as the frame expires, not at the end of the wait
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(ctrl.latencyStats()['lost'], 1)
+
+
+class RaspberryPiControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.spidev = FakeSpidev()
+        self.gpio = FakeGPIO()
+        self.ctrl = RaspberryPiController(spi_module=self.spidev, gpio_module=self.gpio, num_tubes=4)
+        self.spi = self.spidev.devices[0]
+
+    @staticmethod
+    def expected(code, num_tubes=4):
+        """Bytes sent by the original list building implementation"""
+        bitmaps = tm.cmdDecodePrint(code)[:num_tubes]
+        bitmaps += [0]*(num_tubes - len(bitmaps))
+        data = []
+        for bitmap in reversed(bitmaps):
+            data += [(bitmap >> 8) & 0xFF, bitmap & 0xFF]
+        return bytes(data)
+
+    def test_frame_layout(self):
+        for code in ("AB", "ABCD", "ABCDEFG", "{0x1234}{0xFFFF}:!", ""):
+            self.ctrl.send(code)
+            self.assertEqual(self.spi.transfers[-1], self.expected(code))
+
+    def test_identical_frames_are_skipped(self):
+        for code in ("AB", "AB", "AB", "CD", "CD"):
+            self.ctrl.send(code)
+
+        self.assertEqual(self.spi.transfers, [self.expected("AB"), self.expected("CD")])
+        self.assertEqual((self.ctrl.frames_sent, self.ctrl.frames_skipped), (2, 3))
+
+    def test_output_is_blanked_while_shifting(self):
+        self.ctrl.send("AB")
+        self.assertTrue(self.gpio.pins[self.ctrl.oe_pin])
+        self.ctrl.disable()
+        self.ctrl.send("CD")
+        self.assertFalse(self.gpio.pins[self.ctrl.oe_pin])
+        self.ctrl.enable()
+        self.assertTrue(self.gpio.pins[self.ctrl.oe_pin])
+
+    def test_long_chains(self):
+        for num_tubes in (1, 17, 64):
+            spidev = FakeSpidev()
+            ctrl = RaspberryPiController(spi_module=spidev, gpio_module=FakeGPIO(), num_tubes=num_tubes)
+            code = "THE QUICK BROWN FOX JUMPS OVER THE LAZY DOG"
+            ctrl.send(code)
+            self.assertEqual(b''.join(ctrl.spi.transfers), self.expected(code, num_tubes))
+
+    def pinsPerChunk(self, ctrl):
+        """Record the strobe and output enable pins during every chunk sent"""
+        pins = []
+        write = ctrl.spi_write
+
+        def spiWrite(chunk):
+            pins.append((self.gpio.pins[ctrl.strobe_pin], self.gpio.pins[ctrl.oe_pin]))
+            write(chunk)
+
+        ctrl.spi_write = spiWrite
+        return pins
+
+    def test_chunked_transfers_are_shown_at_once(self):
+        ctrl = RaspberryPiController(spi_module=self.spidev, gpio_module=self.gpio, num_tubes=40, max_transfer=16)
+        pins = self.pinsPerChunk(ctrl)
+        ctrl.send("CHUNKED")
+        self.assertEqual([len(x) for x in ctrl.spi.transfers], [16]*5)
+        self.assertEqual(b''.join(ctrl.spi.transfers), self.expected("CHUNKED", 40))
+        self.assertEqual(pins, [(True, False)]*5)
+        self.assertTrue(self.gpio.pins[ctrl.oe_pin])
+
+    def test_strobe_latch(self):
+        ctrl = RaspberryPiController(spi_module=self.spidev, gpio_module=self.gpio, num_tubes=40, max_transfer=16,
+            strobe_latch=True)
+        pins = self.pinsPerChunk(ctrl)
+        ctrl.send("CHUNKED")
+        self.assertEqual(pins, [(False, True)]*5)
+        self.assertTrue(self.gpio.pins[ctrl.strobe_pin])
+
+    def test_xfer_without_writebytes2(self):
+        class OldSpiDev(FakeSpiDev):
+            writebytes2 = None
+
+        spidev = FakeSpidev()
+        spidev.SpiDev = OldSpiDev
+        ctrl = RaspberryPiController(spi_module=spidev, gpio_module=FakeGPIO(), num_tubes=4)
+        ctrl.send("AB")
+        self.assertEqual(ctrl.spi.transfers, [self.expected("AB")])
+
+
+if __name__ == '__main__':
+    unittest.main()
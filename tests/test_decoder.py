@@ -0,0 +1,55 @@
+"""
+Tests for the terminal rendering in ``decoder.py``.
+
+Run directly:      python tests/test_decoder.py
+Or via unittest:   python -m unittest discover tests
+"""
+##pylint: disable=wrong-import-position
+
+import os
+import random
+import sys
+import unittest
+
+## Make the repo root importable when run directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyxielib import decoder
+
+
+def naiveDecodedStr(bitmaps, buffer=0):
+    """Render tube by tube straight from bitmapToLines"""
+    out_lines = [""] * 6
+    for bitmap in bitmaps:
+        for i, line in enumerate(decoder.bitmapToLines(bitmap)):
+            out_lines[i] += line
+            if buffer and len(line) <= 5:
+                out_lines[i] += " "*buffer
+
+    return "\n".join(out_lines) + "\n"
+
+
+class RenderTest(unittest.TestCase):
+    def test_matches_naive_render(self):
+        rand = random.Random(1234)
+        for num_tubes in (1, 16, 64):
+            for buffer in (0, 1, 3):
+                bitmaps = [rand.randrange(0x10000) for _ in range(num_tubes)]
+                self.assertEqual(
+                    decoder.bitmapsToDecodedStr(bitmaps, buffer=buffer),
+                    naiveDecodedStr(bitmaps, buffer=buffer),
+                )
+
+    def test_colon_tubes_are_not_buffered(self):
+        lines = decoder.glyphLines(0x8001, buffer=2)
+        self.assertEqual({len(line) for line in lines}, {8})
+
+    def test_glyphs_are_cached(self):
+        self.assertIs(decoder.glyphLines(0x1234, buffer=1), decoder.glyphLines(0x1234, buffer=1))
+
+    def test_no_tubes(self):
+        self.assertEqual(decoder.bitmapsToDecodedStr([]), naiveDecodedStr([]))
+
+
+if __name__ == '__main__':
+    unittest.main()
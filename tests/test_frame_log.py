@@ -0,0 +1,193 @@
+"""
+Tests for the frame log in ``frame_log.py`` and the RecordingController.
+
+Run directly:      python tests/test_frame_log.py
+Or via unittest:   python -m unittest discover tests
+"""
+##pylint: disable=wrong-import-position
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+## Make the repo root importable when run directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyxielib import frame_log as fl
+from pyxielib import tube_manager as tm
+from pyxielib.animation import FullFrame, FullFrameAnimation, PixieAnimationError, textToFrames
+from pyxielib.assembler import Assembler
+from pyxielib.controller import Controller, RecordingController
+
+
+class LogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'frames.pxlg')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def writeLog(self, frames, **kwargs):
+        with fl.FrameLogWriter(self.path, **kwargs) as log:
+            for timestamp, bitmaps in frames:
+                log.write(bitmaps, timestamp)
+
+
+class VarintTest(unittest.TestCase):
+    def test_round_trip(self):
+        for value in (0, 1, 0x7F, 0x80, 0x3FFF, 0x4000, 2**40):
+            data = fl.encodeVarint(value)
+            self.assertEqual(fl.decodeVarint(b'x' + data, 1), (value, len(data) + 1))
+
+    def test_small_values_take_one_byte(self):
+        self.assertEqual(len(fl.encodeVarint(100)), 1)
+        self.assertEqual(len(fl.encodeVarint(20000)), 3)
+
+    def test_truncated(self):
+        with self.assertRaises(fl.FrameLogError):
+            fl.decodeVarint(fl.encodeVarint(2**20)[:-1], 0)
+
+
+class FrameLogTest(LogTestCase):
+    FRAMES = [
+        (10.0,   (0x1, 0x2, 0x3)),
+        (10.05,  (0x1, 0x2, 0x4)),
+        (10.1,   (0x1, 0x2, 0x4)),
+        (10.125, (0x5, 0x6, 0x7)),
+        (10.5,   (0x5, 0x6)),
+        (11.0,   (0x5, 0x8)),
+    ]
+
+    def test_round_trip(self):
+        self.writeLog(self.FRAMES)
+        with fl.FrameLogReader(self.path) as log:
+            frames = list(log.frames())
+            self.assertEqual(len(log), len(self.FRAMES))
+            self.assertAlmostEqual(log.duration, 1.0)
+
+        self.assertEqual([x[1] for x in frames], [x[1] for x in self.FRAMES])
+        for (timestamp, _), (expected, _) in zip(frames, self.FRAMES):
+            self.assertAlmostEqual(timestamp, expected - 10, places=6)
+
+    def test_deltas_store_only_changes(self):
+        self.writeLog(self.FRAMES[:3])
+        header = fl.HEADER.size
+        dt = len(fl.encodeVarint(50000))
+        keyframe = 1 + 1 + 1 + 2*3
+        one_change = 1 + dt + 1 + 3
+        no_change = 1 + dt + 1
+        self.assertEqual(os.path.getsize(self.path), header + keyframe + one_change + no_change)
+
+    def test_keyframes(self):
+        frames = [(x*0.1, (x, 0, 0, 0)) for x in range(10)]
+        self.writeLog(frames, keyframe_interval=4)
+        with fl.FrameLogReader(self.path) as log:
+            self.assertEqual([x[2] for x in log.keyframes], [0, 4, 8])
+            ## Playback starts from the keyframe before the time asked for
+            started = list(log.frames(0.65))
+            self.assertEqual(started[0][1], frames[4][1])
+            self.assertEqual([x[1] for x in started], [x[1] for x in frames[4:]])
+            self.assertAlmostEqual(started[0][0], 0.4)
+
+    def test_tube_count_change_is_a_keyframe(self):
+        self.writeLog(self.FRAMES)
+        with fl.FrameLogReader(self.path) as log:
+            self.assertEqual([x[2] for x in log.keyframes], [0, 4])
+
+    def test_cut_short_log_plays_whole_records(self):
+        self.writeLog(self.FRAMES)
+        with open(self.path, 'rb+') as f:
+            f.truncate(os.path.getsize(self.path) - 2)
+
+        with self.assertLogs('pyxielib.frame_log', level='WARNING'):
+            log = fl.FrameLogReader(self.path)
+        with log:
+            self.assertEqual(len(log), len(self.FRAMES) - 1)
+            self.assertEqual(list(log.frames())[-1][1], self.FRAMES[-2][1])
+
+    def test_not_a_log(self):
+        with open(self.path, 'wb') as f:
+            f.write(b"frame|1|AB\n")
+        with self.assertRaises(fl.FrameLogError):
+            fl.FrameLogReader(self.path)
+
+        open(self.path, 'wb').close()
+        with self.assertRaises(fl.FrameLogError):
+            fl.FrameLogReader(self.path)
+
+
+class ReplayTest(LogTestCase):
+    def test_replay_animation(self):
+        codes = ["AB", "CD", "EF"]
+        self.writeLog([(x*0.04, tm.cmdDecodePrint(code)) for x, code in enumerate(codes)])
+        ani = fl.ReplayAnimation(self.path)
+        shown = []
+        start = time.monotonic()
+        while not ani.done() and time.monotonic() - start < 1:
+            if ani.updateFrameSet():
+                shown.append(tuple(tm.cmdDecodePrint(ani.getCode())))
+            time.sleep(0.005)
+
+        self.assertEqual(shown, [tuple(tm.cmdDecodePrint(x)) for x in codes])
+        self.assertAlmostEqual(time.monotonic() - start, 0.08, delta=0.04)
+
+    def test_accelerated(self):
+        self.writeLog([(x, (x,)) for x in range(5)])
+        ani = fl.ReplayAnimation(self.path, speed=100)
+        ani.updateFrameSet()
+        self.assertAlmostEqual(ani.length(), 0.04)
+        self.assertAlmostEqual(ani.nextDeadline(), ani.start_time + 0.01)
+        self.assertAlmostEqual(ani.endTime(), ani.start_time + 0.04)
+        time.sleep(0.05)
+        self.assertTrue(ani.updateFrameSet())
+        self.assertEqual(ani.getBitmaps(), (4,))
+        self.assertTrue(ani.done())
+        self.assertIsNone(ani.nextDeadline())
+
+    def test_bad_speed(self):
+        self.writeLog([(0, (1,))])
+        with self.assertRaises(PixieAnimationError):
+            fl.ReplayAnimation(self.path, speed=0)
+
+
+class RecordingControllerTest(LogTestCase):
+    def test_records_what_other_controllers_show(self):
+        class Keeper(Controller):
+            def __init__(self):
+                Controller.__init__(self)
+                self.codes = []
+
+            def send(self, code):
+                self.codes.append(code)
+
+        keeper = Keeper()
+        recorder = RecordingController(self.path)
+        asmlr = Assembler(controllers=[keeper, recorder], compensate_latency=False)
+        codes = ["12:00", "12:01", "13:01"]
+        asmlr.start()
+        asmlr.setAnimation(FullFrameAnimation.makeTimed([FullFrame(textToFrames(x)) for x in codes], delay=0.03))
+        time.sleep(0.2)
+        asmlr.stop()
+        recorder.close()
+
+        with fl.FrameLogReader(self.path) as log:
+            frames = list(log.frames())
+
+        self.assertEqual([x[1] for x in frames], [tuple(tm.cmdDecodePrint(x)) for x in keeper.codes])
+        self.assertAlmostEqual(frames[-1][0], 0.06, delta=0.02)
+
+        ## Replaying the log shows the same thing again
+        replayed = Keeper()
+        asmlr = Assembler(controller=replayed, compensate_latency=False)
+        asmlr.start()
+        asmlr.setAnimation(fl.ReplayAnimation(self.path, speed=4))
+        time.sleep(0.1)
+        asmlr.stop()
+        self.assertEqual([tuple(tm.cmdDecodePrint(x)) for x in replayed.codes], [x[1] for x in frames])
+
+
+if __name__ == '__main__':
+    unittest.main()
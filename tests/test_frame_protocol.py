@@ -0,0 +1,125 @@
+"""
+Tests for the binary frame protocol in ``frame_protocol.py`` and the
+board model in ``board_emulator.py``.
+
+Run directly:      python tests/test_frame_protocol.py
+Or via unittest:   python -m unittest discover tests
+"""
+##pylint: disable=wrong-import-position
+
+import os
+import sys
+import unittest
+
+## Make the repo root importable when run directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyxielib import frame_protocol as fp
+from pyxielib import tube_manager as tm
+from pyxielib.board_emulator import BoardEmulator
+
+
+class FrameCodecTest(unittest.TestCase):
+    def test_round_trip(self):
+        bitmaps = (0x0000, 0x0001, 0x8000, 0xFFFF, 0x1234)
+        packet = fp.encodeFrame(bitmaps, seq=7)
+        self.assertEqual(len(packet), fp.frameSize(len(bitmaps)))
+        self.assertEqual(fp.decodeFrame(packet), (7, bitmaps))
+
+    def test_layout(self):
+        packet = fp.encodeFrame([0x1234], seq=0x101)
+        self.assertEqual(packet[:5], bytes((fp.STX, 0x01, 1, 0x12, 0x34)))
+        self.assertEqual(int.from_bytes(packet[5:], 'big'), fp.crc16(packet[1:5]))
+
+    def test_crc_is_ccitt(self):
+        ## CRC-16/CCITT-FALSE check value
+        self.assertEqual(fp.crc16(b"123456789"), 0x29B1)
+
+    def test_corruption_is_detected(self):
+        packet = bytearray(fp.encodeFrame([0x1234, 0x5678]))
+        packet[4] ^= 0x10
+        self.assertRaises(fp.FrameProtocolError, fp.decodeFrame, bytes(packet))
+
+    def test_tube_update_round_trip(self):
+        tubes = ((0, 0x0001), (7, 0xFFFF), (15, 0x1234))
+        packet = fp.encodeTubes(tubes, seq=300)
+        self.assertEqual(len(packet), fp.tubesSize(3))
+        self.assertEqual(fp.packetSize(packet), len(packet))
+        self.assertEqual(fp.decodeTubes(packet), (300 & 0xFF, tubes))
+
+    def test_tube_update_corruption_is_detected(self):
+        packet = bytearray(fp.encodeTubes([(1, 2)]))
+        packet[3] ^= 0x01
+        self.assertRaises(fp.FrameProtocolError, fp.decodeTubes, bytes(packet))
+
+    def test_tube_index_out_of_range(self):
+        self.assertRaises(fp.FrameProtocolError, fp.encodeTubes, [(256, 0)])
+
+    def test_too_many_tubes(self):
+        self.assertRaises(fp.FrameProtocolError, fp.encodeFrame, [0]*(fp.MAX_TUBES + 1))
+
+    def test_smaller_than_text_command(self):
+        code = "SAT 14 09!41!07! PM"
+        text = f"print:{code}\n\r".encode('utf8')
+        self.assertLess(len(fp.encodeFrame(tm.cmdDecodePrint(code))), len(text) + len(f"Print: '{code}'\n> "))
+
+
+class BoardEmulatorTest(unittest.TestCase):
+    def setUp(self):
+        self.board = BoardEmulator(num_tubes=4)
+        self.assertEqual(self.board.readline(), b"Nixie tube command terminal\n")
+        self.assertEqual(self.board.read_until(b"> "), b"> ")
+
+    def test_binary_frame(self):
+        self.board.write(fp.encodeFrame([1, 2, 3, 4], seq=9))
+        self.assertEqual(self.board.read(10), fp.encodeAck(9))
+        self.assertEqual(self.board.tubes, [1, 2, 3, 4])
+
+    def test_tube_update(self):
+        self.board.write(fp.encodeFrame([1, 2, 3, 4]))
+        self.board.write(fp.encodeTubes([(1, 7), (3, 9), (10, 5)], seq=2))
+        self.assertEqual(self.board.read(10), fp.encodeAck(0) + fp.encodeAck(2))
+        self.assertEqual(self.board.tubes, [1, 7, 3, 9])
+
+    def test_frame_is_padded_and_cut(self):
+        self.board.write(fp.encodeFrame([1, 2]))
+        self.assertEqual(self.board.tubes, [1, 2, 0, 0])
+        self.board.write(fp.encodeFrame([1, 2, 3, 4, 5, 6]))
+        self.assertEqual(self.board.tubes, [1, 2, 3, 4])
+
+    def test_frame_split_across_writes(self):
+        packet = fp.encodeFrame([5, 6, 7, 8], seq=3)
+        for x in packet:
+            self.board.write(bytes((x,)))
+
+        self.assertEqual(self.board.read(10), fp.encodeAck(3))
+        self.assertEqual(self.board.frames_shown, 1)
+
+    def test_bad_checksum_is_nacked(self):
+        packet = bytearray(fp.encodeFrame([1, 2, 3, 4], seq=4))
+        packet[-1] ^= 0xFF
+        self.board.write(bytes(packet) + fp.encodeFrame([4, 3, 2, 1], seq=5))
+        self.assertEqual(self.board.read(10), fp.encodeNak(4, fp.ERR_CHECKSUM) + fp.encodeAck(5))
+        self.assertEqual(self.board.tubes, [4, 3, 2, 1])
+
+    def test_incomplete_frame_expires(self):
+        self.board.write(fp.encodeFrame([1, 2, 3, 4], seq=6)[:-1])
+        self.assertEqual(self.board.read(10), b'')
+        self.board.expire()
+        self.assertEqual(self.board.read(10), fp.encodeNak(6, fp.ERR_TIMEOUT))
+        self.assertEqual(self.board.frames_shown, 0)
+
+    def test_text_and_binary_mixed(self):
+        self.board.write(b"print:AB\n\r" + fp.encodeFrame([9], seq=1))
+        self.assertEqual(self.board.readline(), b"Print: 'AB'\n")
+        self.assertEqual(self.board.read(len(self.board.output)), b"> " + fp.encodeAck(1))
+        self.assertEqual(self.board.tubes, [9, 0, 0, 0])
+
+    def test_text_error(self):
+        self.board.write(b"print:{0zz}\n\r")
+        self.assertIn(b"NAK: ", self.board.read_until(b"> "))
+        self.assertEqual(self.board.frames_shown, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""
+Tests for the helpers in ``pyxieutil.py``.
+
+Run directly:      python tests/test_pyxieutil.py
+Or via unittest:   python -m unittest discover tests
+"""
+##pylint: disable=wrong-import-position
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+## Make the repo root importable when run directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyxielib.pyxieutil import LatestValueQueue
+
+
+class LatestValueQueueTest(unittest.TestCase):
+    def test_newest_value_wins(self):
+        queue = LatestValueQueue(maxsize=3)
+        for x in range(3):
+            queue.put(x)
+
+        self.assertEqual(queue.getLatest(), 2)
+        self.assertEqual((queue.coalesced, queue.dropped, len(queue)), (2, 0, 0))
+
+    def test_full_queue_drops_oldest(self):
+        queue = LatestValueQueue(maxsize=2)
+        for x in range(5):
+            queue.put(x)
+
+        self.assertEqual(list(queue.items), [3, 4])
+        self.assertEqual((queue.puts, queue.dropped), (5, 3))
+
+    def test_timeout(self):
+        queue = LatestValueQueue()
+        start = time.monotonic()
+        self.assertIsNone(queue.getLatest(timeout=0.05))
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+    def test_put_wakes_reader(self):
+        queue = LatestValueQueue()
+        got = []
+        reader = threading.Thread(target=lambda: got.append(queue.getLatest(timeout=5)))
+        reader.start()
+        time.sleep(0.02)
+        queue.put("frame")
+        reader.join()
+        self.assertEqual(got, ["frame"])
+
+    def test_close_wakes_reader(self):
+        queue = LatestValueQueue()
+        reader = threading.Thread(target=queue.getLatest)
+        reader.start()
+        queue.close()
+        reader.join(1)
+        self.assertFalse(reader.is_alive())
+        queue.put("ignored")
+        self.assertEqual(len(queue), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+"""
+Tests for the schedulers in ``scheduler.py``.
+
+Run directly:      python tests/test_scheduler.py
+Or via unittest:   python -m unittest discover tests
+"""
+##pylint: disable=wrong-import-position
+
+import os
+import sys
+import unittest
+
+## Make the repo root importable when run directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyxielib.assembler import Assembler
+from pyxielib.headless import HeadlessRunner
+from helpers import CaptureController
+
+try:
+    from pyxielib import program, scheduler
+except ImportError:
+    ## Needs croniter and feedparser
+    program = scheduler = None
+
+
+@unittest.skipIf(scheduler is None, "scheduler's dependencies aren't installed")
+class LookaheadTest(unittest.TestCase):
+    def run_program(self, make_program, enabled):
+        ctrl = CaptureController()
+        if not enabled:
+            ctrl.disable()
+        asmlr = Assembler(controller=ctrl)
+        schdlr = scheduler.SingleProgramScheduler(make_program(ctrl), asmlr)
+        HeadlessRunner(asmlr, schdlr).run(10)
+        return ctrl, asmlr
+
+    def test_wake_does_not_queue_an_empty_animation(self):
+        ## Once awake the program only has an EmtpyAnimation left to give
+        ctrl, asmlr = self.run_program(program.WakeProgram, enabled=False)
+        self.assertTrue(ctrl.enabled)
+        self.assertEqual([x.strip() for x in ctrl.codes], ["Waking..."])
+        self.assertEqual(asmlr.swaps, 0)
+
+    def test_sleep_does_not_queue_an_empty_animation(self):
+        ctrl, asmlr = self.run_program(program.SleepProgram, enabled=True)
+        self.assertFalse(ctrl.enabled)
+        self.assertEqual([x.strip() for x in ctrl.codes], ["Sleeping..."])
+        self.assertEqual(asmlr.swaps, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
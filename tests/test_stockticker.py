@@ -0,0 +1,61 @@
+"""
+Tests for the market hours in ``stockticker.py``.
+
+Run directly:      python tests/test_stockticker.py
+Or via unittest:   python -m unittest discover tests
+"""
+##pylint: disable=wrong-import-position
+
+import datetime as dt
+import os
+import sys
+import unittest
+
+## Make the repo root importable when run directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyxielib.clock import VirtualClock, setClock
+
+try:
+    from pyxielib import stockticker
+except ImportError:
+    ## Needs requests, bs4 and feedparser
+    stockticker = None
+
+
+@unittest.skipIf(stockticker is None, "stockticker's dependencies aren't installed")
+class MarketHoursTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock(dt.datetime(2024, 3, 5, 9, 29, 30))
+        setClock(self.clock)
+
+    def tearDown(self):
+        setClock(None)
+
+    def test_market_open(self):
+        self.assertTrue(stockticker.isPreMarket())
+        self.assertFalse(stockticker.isMarketOpen())
+        self.clock.advance(30)
+        self.assertFalse(stockticker.isPreMarket())
+        self.assertTrue(stockticker.isMarketOpen())
+
+        self.clock.advance(6.5*60*60)
+        self.assertFalse(stockticker.isMarketOpen())
+        self.assertTrue(stockticker.isPostMarket())
+        self.assertTrue(stockticker.isExtendedHours())
+
+    def test_stocks_are_cleared_before_open(self):
+        ticker = stockticker.StockTicker(symbols='AAPL', quick_start=False)
+        ticker.stocks = {'AAPL': stockticker.Stock('AAPL', 2.0, 1.0, 1.0)}
+        self.clock.advance(60)
+        ticker.clearStocks()
+        self.assertTrue(ticker.stocks)
+
+        ## The next morning, before the bell
+        self.clock.advance(24*60*60 - 120)
+        ticker.clearStocks()
+        self.assertEqual(ticker.stocks, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+"""
+Tests for the frame timing telemetry in ``telemetry.py``.
+
+Run directly:      python tests/test_telemetry.py
+Or via unittest:   python -m unittest discover tests
+"""
+##pylint: disable=wrong-import-position
+
+import os
+import random
+import sys
+import unittest
+
+## Make the repo root importable when run directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyxielib.telemetry import FrameTelemetry, HdrHistogram, RingBuffer, formatStats
+
+
+def exactPercentile(values, pct):
+    values = sorted(values)
+    return values[max(1, round(pct/100*len(values))) - 1]
+
+
+class HdrHistogramTest(unittest.TestCase):
+    def test_buckets_round_trip(self):
+        hist = HdrHistogram(precision=7)
+        last = -1
+        for value in list(range(1000)) + [2**x + y for x in range(10, 31) for y in (-1, 0, 1)]:
+            index = hist.bucketIndex(value)
+            self.assertGreaterEqual(index, last)
+            last = index
+            self.assertLessEqual(abs(hist.bucketValue(index) - value), value/2**6 + 0.5)
+
+    def test_percentiles_are_close(self):
+        rng = random.Random(15)
+        values = [rng.lognormvariate(-6, 1.5) for _ in range(10000)]
+        hist = HdrHistogram()
+        for value in values:
+            hist.record(value)
+
+        for pct in (1, 50, 90, 99, 99.9):
+            exact = exactPercentile(values, pct)
+            self.assertAlmostEqual(hist.percentile(pct), exact, delta=exact*0.02 + 1e-6)
+
+        self.assertEqual((hist.min, hist.max, hist.count), (min(values), max(values), len(values)))
+
+    def test_negative_values(self):
+        hist = HdrHistogram()
+        values = [-0.003, -0.001, 0.0, 0.002, 0.004]
+        for value in values:
+            hist.record(value)
+
+        for pct in (20, 40, 60, 80, 100):
+            exact = exactPercentile(values, pct)
+            self.assertAlmostEqual(hist.percentile(pct), exact, delta=abs(exact)*0.02 + 1e-6)
+
+    def test_empty(self):
+        self.assertIsNone(HdrHistogram().percentile(50))
+
+    def test_values_are_capped(self):
+        hist = HdrHistogram(max_seconds=1)
+        hist.record(10)
+        self.assertAlmostEqual(hist.percentile(50), 1, delta=0.01)
+
+
+class RingBufferTest(unittest.TestCase):
+    def test_keeps_last_rows(self):
+        ring = RingBuffer(3, 2)
+        for x in range(5):
+            ring.append(x, -x)
+
+        self.assertEqual(ring.rows(), [(2, -2), (3, -3), (4, -4)])
+
+    def test_partly_filled(self):
+        ring = RingBuffer(3, 1)
+        ring.append(1)
+        self.assertEqual(ring.rows(), [(1,)])
+
+
+class FrameTelemetryTest(unittest.TestCase):
+    def test_stats(self):
+        telemetry = FrameTelemetry("Test")
+        for x in range(100):
+            telemetry.record(x, x + 0.002, 0.001)
+
+        stats = telemetry.stats()
+        self.assertEqual(stats['frames'], 100)
+        self.assertAlmostEqual(stats['lateness']['p50'], 0.002, delta=0.00005)
+        self.assertAlmostEqual(stats['send']['p99'], 0.001, delta=0.00005)
+        self.assertEqual(len(telemetry.recent.rows()), 100)
+        self.assertIn("Test", formatStats({"Test": stats}))
+
+
+if __name__ == '__main__':
+    unittest.main()
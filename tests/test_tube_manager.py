@@ -0,0 +1,108 @@
+"""
+Tests for the print command decoder in ``tube_manager.py``.
+
+Run directly:      python tests/test_tube_manager.py
+Or via unittest:   python -m unittest discover tests
+"""
+##pylint: disable=wrong-import-position
+
+import itertools
+import os
+import sys
+import unittest
+
+## Make the repo root importable when run directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyxielib import tube_manager as tm
+from reference_impls import cmdDecodePrintStateMachine
+
+
+class DecodeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = tm.DecodeCache(size=2)
+
+    def test_matches_uncached_decode(self):
+        for cmd in ("HELLO", "A:B!{0x1F}", "{!AB}C"):
+            self.assertEqual(self.cache.decode(cmd), tuple(tm.cmdDecodePrint(cmd)))
+
+    def test_hits_and_misses(self):
+        self.cache.decode("AB")
+        self.cache.decode("AB")
+        self.cache.decode("CD")
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.decode("AB")
+        self.cache.decode("CD")
+        self.cache.decode("AB")  ## AB is now the most recent
+        self.cache.decode("EF")
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+        self.assertIn("AB", self.cache.entries)
+        self.assertNotIn("CD", self.cache.entries)
+
+    def test_results_are_immutable(self):
+        self.assertIsInstance(self.cache.decode("AB"), tuple)
+
+    def test_errors_are_not_cached(self):
+        self.assertRaises(tm.DecodeError, self.cache.decode, "{0zz}")
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_clear(self):
+        self.cache.decode("AB")
+        self.cache.clear()
+        self.assertEqual(self.cache.stats(), {'size': 0, 'max_size': 2, 'hits': 0, 'misses': 0, 'evictions': 0})
+
+
+class BulkDecodeEquivalenceTest(unittest.TestCase):
+    """cmdDecodeArray must decode exactly like the reference state machine"""
+
+    ## Pieces of the grammar, including broken and unterminated ones
+    ATOMS = [
+        'A', 'z', '5', ' ', '~', '}', '“', '\u00e9', '!', ':',
+        '{', '{0x1F}', '{0XaB}', '{0b101}', '{0B1}', '{}', '{zz}',
+        '{!', '{!}', '{!AB}', '{!a:!}', '{0x',
+    ]
+
+    @staticmethod
+    def outcome(func, cmd):
+        """Either the decoded list or the type of error raised"""
+        try:
+            return list(func(cmd))
+        except Exception as e:
+            return type(e)
+
+    def assertEquivalent(self, cmd):
+        self.assertEqual(
+            self.outcome(tm.cmdDecodeArray, cmd),
+            self.outcome(cmdDecodePrintStateMachine, cmd),
+            f"Decoders differ on {cmd!r}",
+        )
+
+    def test_atom_combinations(self):
+        for length in range(4):
+            for atoms in itertools.product(self.ATOMS, repeat=length):
+                self.assertEquivalent(''.join(atoms))
+
+    def test_every_character_with_modifiers(self):
+        for cp in range(0x200):
+            c = chr(cp)
+            for cmd in (c, 'A' + c, c + '!', c + ':', c + '!:', 'A' + c + ':!', '{!' + c + '}'):
+                self.assertEquivalent(cmd)
+
+    def test_every_hex_token(self):
+        cmd = ''.join(f"{{0x{x:X}}}" for x in range(0x10000))
+        self.assertEqual(list(tm.cmdDecodeArray(cmd)), list(range(0x10000)))
+        self.assertEquivalent(cmd)
+
+    def test_every_binary_token(self):
+        cmd = ''.join(f"{{0b{x:b}}}" for x in range(0x100))
+        self.assertEquivalent(cmd)
+
+    def test_tokens_are_masked_to_16_bits(self):
+        self.assertEqual(list(tm.cmdDecodeArray("{0x1ABCD}")), [0xABCD])
+
+
+if __name__ == '__main__':
+    unittest.main()